@@ -0,0 +1,399 @@
+import argparse
+import asyncio
+import json
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+from shared.clients import get_pool_stats
+from shared.deadlines import get_timeout_stats
+from shared.session_log import SESSION_ID_PATTERN
+
+# The three pipelines behind one asyncio HTTP/JSON service, for running
+# without Streamlit.
+#
+#   python api_server.py --port 8080 --backends openai,langchain
+#
+#   POST /sessions                          -> {"sessionId": "..."}
+#   POST /{backend}/chat                    {"sessionId", "prompt", "stream"}
+#   GET  /{backend}/sessions/{id}/messages
+#   GET  /health
+#   GET  /stats
+#
+# The pipelines are synchronous, so each turn runs on a worker thread while
+# the event loop keeps serving everyone else.  Each backend has its own limit
+# on turns in flight and on how many can wait, for their session or a slot,
+# past that we answer 429 rather than queueing forever.  Turns in one session
+# run one at a time.
+#
+# With "stream": true the answer comes back as server-sent events: "content"
+# events with each new piece of text (only the openai backend streams, the
+# others send the whole answer at once), then "done" with the response and
+# stats, or "error".
+#
+# Sessions live in memory, the least recently used are dropped past
+# --max-sessions.  With CHAT_HISTORY_DIR set the history is on disk (see
+# shared/session_log.py), so it survives that and restarts.  It is reloaded
+# under the session's lock, so never out from under a turn that is using it.
+
+ALL_BACKENDS = ["openai", "langchain", "semantic-kernel"]
+
+
+def load_openai():
+    from my_openai import openai_pipeline
+
+    def run_turn(session, prompt, on_content=None):
+        history = session.history
+        openai_pipeline.append_to_chat_history(history, "user", content=prompt)
+
+        # The deltas go straight out as they arrive.
+        stats = openai_pipeline.make_llm_call(
+            history,
+            max_round_trips=6,
+            stream=on_content is not None,
+            new_content_writer=lambda: on_content,
+        )
+        return history[-1].content, stats
+
+    return openai_pipeline, run_turn
+
+
+def load_langchain():
+    from my_langchain import langchain_pipeline
+
+    def run_turn(session, prompt, on_content=None):
+        if session.agent is None:
+            session.agent = langchain_pipeline.create_agent()
+
+        response, events, stats = langchain_pipeline.run_agent(
+            session.history, prompt, agent=session.agent
+        )
+        langchain_pipeline.append_to_chat_history(session.history, "user", prompt)
+        langchain_pipeline.append_to_chat_history(
+            session.history, "ai", response, events, stats
+        )
+        return response, stats
+
+    return langchain_pipeline, run_turn
+
+
+def load_semantic_kernel():
+    from my_semantic_kernel import semantic_kernel_pipeline
+
+    def run_turn(session, prompt, on_content=None):
+        response, logs, stats = semantic_kernel_pipeline.run_prompt(
+            session.history, prompt
+        )
+        semantic_kernel_pipeline.append_to_chat_history(
+            session.history, "user", prompt
+        )
+        semantic_kernel_pipeline.append_to_chat_history(
+            session.history, "assistant", response, logs
+        )
+        return response, stats
+
+    return semantic_kernel_pipeline, run_turn
+
+
+backend_loaders = {
+    "openai": load_openai,
+    "langchain": load_langchain,
+    "semantic-kernel": load_semantic_kernel,
+}
+
+
+class Session:
+    def __init__(self, session_id, history):
+        self.session_id = session_id
+        self.history = history
+        # Only the langchain backend uses this.
+        self.agent = None
+        self.lock = asyncio.Lock()
+
+
+class Backend:
+    def __init__(self, name, pipeline, run_turn, max_concurrency, max_waiting):
+        self.name = name
+        self.pipeline = pipeline
+        self.run_turn = run_turn
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.stats = {"turns": 0, "errors": 0, "rejected": 0, "inFlight": 0}
+        self.waiting = 0
+
+    def get_stats(self):
+        stats = {
+            **self.stats,
+            "waiting": self.waiting,
+            "chatDeployments": self.pipeline.chat_router.get_stats(),
+        }
+
+        # Only the raw OpenAI pipeline guesses at tool calls.
+        if getattr(self.pipeline, "tool_prefetcher", None) is not None:
+            stats["speculativeTools"] = self.pipeline.tool_prefetcher.get_stats()
+
+        return stats
+
+
+class ApiServer:
+    def __init__(self, backends, max_sessions=1000):
+        self.backends = backends
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.executor = ThreadPoolExecutor(
+            max_workers=sum(b.max_concurrency for b in backends.values()),
+            thread_name_prefix="api-turn",
+        )
+
+    def get_session(self, backend, session_id):
+        key = (backend.name, session_id)
+        session = self.sessions.get(key)
+
+        if session is None:
+            session = Session(
+                session_id, backend.pipeline.create_chat_history(session_id)
+            )
+            self.sessions[key] = session
+
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+        self.sessions.move_to_end(key)
+        return session
+
+    def refresh_history(self, backend, session):
+        # Only with session.lock held.  The registry might have evicted the
+        # store, or another worker added to it, this gets the current one.
+        if backend.pipeline.app_settings.chat_history_dir:
+            session.history = backend.pipeline.create_chat_history(
+                session.session_id
+            )
+
+    def get_backend(self, request):
+        backend = self.backends.get(request.match_info["backend"])
+
+        if backend is None:
+            raise web.HTTPNotFound(
+                text=json.dumps({"error": "unknown backend"}),
+                content_type="application/json",
+            )
+
+        return backend
+
+    async def run_turn(self, backend, session, prompt, on_content=None):
+        # Waiting covers our turn in the session as well as the slot, so
+        # max_waiting bounds everything queued up behind this backend.
+        if backend.waiting >= backend.max_waiting:
+            backend.stats["rejected"] += 1
+            raise web.HTTPTooManyRequests(
+                text=json.dumps({"error": f"{backend.name} is busy, try again"}),
+                content_type="application/json",
+            )
+
+        backend.waiting += 1
+
+        try:
+            # Wait for our turn in the session before taking a slot, so a
+            # queued follow up doesn't hold one while it waits.
+            await session.lock.acquire()
+
+            try:
+                self.refresh_history(backend, session)
+                await backend.slots.acquire()
+            except BaseException:
+                session.lock.release()
+                raise
+        finally:
+            backend.waiting -= 1
+
+        backend.stats["inFlight"] += 1
+
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                self.executor, backend.run_turn, session, prompt, on_content
+            )
+            backend.stats["turns"] += 1
+            return result
+        except Exception:
+            backend.stats["errors"] += 1
+            raise
+        finally:
+            backend.stats["inFlight"] -= 1
+            backend.slots.release()
+            session.lock.release()
+
+    async def create_session(self, request):
+        return web.json_response({"sessionId": uuid.uuid4().hex})
+
+    async def chat(self, request):
+        backend = self.get_backend(request)
+        body = await request.json()
+        prompt = body.get("prompt")
+        session_id = body.get("sessionId") or uuid.uuid4().hex
+
+        if not prompt or not SESSION_ID_PATTERN.fullmatch(session_id):
+            return web.json_response(
+                {"error": "prompt is required, sessionId must be 32 hex digits"},
+                status=400,
+            )
+
+        session = self.get_session(backend, session_id)
+
+        if body.get("stream"):
+            return await self.stream_chat(request, backend, session, prompt)
+
+        try:
+            response, stats = await self.run_turn(backend, session, prompt)
+        except web.HTTPException:
+            raise
+        except Exception as e:
+            return web.json_response(
+                {"sessionId": session_id, "error": f"{type(e).__name__}: {e}"},
+                status=500,
+            )
+
+        return web.json_response(
+            {"sessionId": session_id, "response": response, "stats": stats},
+            dumps=lambda value: json.dumps(value, default=str),
+        )
+
+    async def stream_chat(self, request, backend, session, prompt):
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def on_content(text):
+            # Called on the worker thread.
+            if text:
+                loop.call_soon_threadsafe(events.put_nowait, ("content", text))
+
+        turn = asyncio.ensure_future(
+            self.run_turn(backend, session, prompt, on_content)
+        )
+        turn.add_done_callback(lambda _: events.put_nowait(None))
+
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+        )
+        await response.prepare(request)
+
+        async def send(event, data):
+            payload = json.dumps(data, default=str)
+            await response.write(f"event: {event}\ndata: {payload}\n\n".encode())
+
+        while True:
+            event = await events.get()
+
+            if event is None:
+                break
+
+            await send("content", {"content": event[1]})
+
+        try:
+            answer, stats = turn.result()
+            await send("done", {"response": answer, "stats": stats})
+        except web.HTTPException as e:
+            await send("error", {"error": e.text, "status": e.status})
+        except Exception as e:
+            await send("error", {"error": f"{type(e).__name__}: {e}"})
+
+        await response.write_eof()
+        return response
+
+    async def messages(self, request):
+        backend = self.get_backend(request)
+        session_id = request.match_info["session_id"]
+
+        if not SESSION_ID_PATTERN.fullmatch(session_id):
+            raise web.HTTPBadRequest(text="bad session id")
+
+        session = self.get_session(backend, session_id)
+
+        # Waits for a turn in progress, so we never read the history while a
+        # worker is adding to it, and the answer has whole turns.
+        async with session.lock:
+            self.refresh_history(backend, session)
+            messages = [
+                {
+                    "role": m.role,
+                    "content": m.content,
+                    "functionName": m.function_name,
+                    "completionId": m.completion_id,
+                    "usage": m.usage,
+                }
+                for m in session.history
+            ]
+
+        return web.json_response(
+            messages,
+            dumps=lambda value: json.dumps(value, default=str),
+        )
+
+    async def health(self, request):
+        return web.json_response({"ok": True, "backends": list(self.backends)})
+
+    async def stats(self, request):
+        return web.json_response(
+            {
+                "sessions": len(self.sessions),
+                "backends": {
+                    name: backend.get_stats() for name, backend in self.backends.items()
+                },
+                "pools": get_pool_stats(),
+                "timeouts": get_timeout_stats(),
+            }
+        )
+
+    def make_app(self):
+        app = web.Application()
+        app.add_routes(
+            [
+                web.post("/sessions", self.create_session),
+                web.post("/{backend}/chat", self.chat),
+                web.get("/{backend}/sessions/{session_id}/messages", self.messages),
+                web.get("/health", self.health),
+                web.get("/stats", self.stats),
+            ]
+        )
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the chat pipelines over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--backends", default=",".join(ALL_BACKENDS))
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--max-waiting", type=int, default=64)
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    args = parser.parse_args()
+
+    load_dotenv()
+    names = [b.strip() for b in args.backends.split(",") if b.strip()]
+
+    for name in names:
+        if name not in backend_loaders:
+            parser.error(f"unknown backend {name}, pick from {ALL_BACKENDS}")
+
+    async def create_app():
+        # The pipelines set themselves up at import time, do that once here
+        # rather than on the first request.
+        backends = {}
+
+        for name in names:
+            pipeline, run_turn = backend_loaders[name]()
+            backends[name] = Backend(
+                name, pipeline, run_turn, args.max_concurrency, args.max_waiting
+            )
+
+        return ApiServer(backends, args.max_sessions).make_app()
+
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import requests
+
+from benchmarks.stats import summarize_latencies
+from my_openai.hero_stats_cache import HeroStatsCache, extract_hero_rows
+from my_openai.tool_executor import MAX_WORKERS, ToolExecutor
+from shared.clients import create_http_session, get_pool_stats
+from shared.hero_stats_server import start_server
+
+# Load test for the hero stats tool, against the local stand-in server
+# (shared/hero_stats_server.py) so the numbers don't depend on the network.
+#
+#   python -m benchmarks.hero_stats_load --latency-ms 50 --jitter-ms 25
+#
+# Every call goes through a ToolExecutor, the same way the OpenAI app makes
+# them, and asks for a random range of days out of a fixed window.  Each
+# variant (cached or not, pooled HTTP or a new connection per request) is run
+# at every concurrency level with a cold cache and a fresh session, and we
+# report throughput and latency for each.
+#
+# The tool pool has MAX_WORKERS threads, so above that the extra callers just
+# queue for a worker, as they would in the app.
+
+TOOL_NAME = "get_heroes_winrate_stats"
+
+VARIANTS = [
+    {"name": "uncached-unpooled", "cached": False, "pooled": False},
+    {"name": "uncached-pooled", "cached": False, "pooled": True},
+    {"name": "cached-unpooled", "cached": True, "pooled": False},
+    {"name": "cached-pooled", "cached": True, "pooled": True},
+]
+
+
+def make_fetch(endpoint, session):
+    # session=None means a new connection for every request.
+    get = session.get if session is not None else requests.get
+
+    def fetch_heroes_stats(start_date, end_date):
+        response = get(
+            f"{endpoint}/hero-stats",
+            params={"startDate": start_date, "endDate": end_date},
+        )
+        response.raise_for_status()
+        return response.json()
+
+    return fetch_heroes_stats
+
+
+def make_tool_calls(count, window_days, max_span_days, seed):
+    # The window ends yesterday, so cached days never expire mid-run.
+    rng = random.Random(seed)
+    last_day = date.today() - timedelta(days=1)
+    tool_calls = []
+
+    for n in range(count):
+        span = rng.randint(1, max_span_days)
+        end = last_day - timedelta(days=rng.randint(0, window_days - span))
+        start = end - timedelta(days=span - 1)
+        tool_calls.append(
+            {
+                "id": f"call-{n}",
+                "type": "function",
+                "function": {
+                    "name": TOOL_NAME,
+                    "arguments": json.dumps(
+                        {"start_date": start.isoformat(), "end_date": end.isoformat()}
+                    ),
+                },
+            }
+        )
+
+    return tool_calls
+
+
+def run_level(variant, endpoint, concurrency, tool_calls):
+    session = create_http_session() if variant["pooled"] else None
+    fetch = make_fetch(endpoint, session)
+    cache = None
+
+    if variant["cached"]:
+        cache = HeroStatsCache(fetch)
+        function = cache.get_range
+    else:
+
+        def function(start_date, end_date):
+            return extract_hero_rows(fetch(start_date, end_date))
+
+    executor = ToolExecutor({TOOL_NAME: function})
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as callers:
+        results = [
+            result
+            for results in callers.map(
+                lambda tool_call: executor.run([tool_call]), tool_calls
+            )
+            for result in results
+        ]
+
+    wall_seconds = time.perf_counter() - start
+
+    if session is not None:
+        session.close()
+
+    ok = [r for r in results if not r["error"]]
+
+    return {
+        "variant": variant["name"],
+        "concurrency": concurrency,
+        "calls": len(results),
+        "errors": len(results) - len(ok),
+        "callsPerSecond": round(len(ok) / wall_seconds, 1),
+        "latency": summarize_latencies([round(r["elapsed"] * 1000, 1) for r in ok]),
+        "cache": cache.stats() if cache is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the hero stats tool against a local server."
+    )
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--variants", default=",".join(v["name"] for v in VARIANTS))
+    parser.add_argument("--window-days", type=int, default=30)
+    parser.add_argument("--max-span-days", type=int, default=7)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=25)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="hero_stats_load.json")
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    names = [n.strip() for n in args.variants.split(",") if n.strip()]
+    variants = [v for v in VARIANTS if v["name"] in names]
+
+    if len(variants) != len(names):
+        parser.error(f"pick variants from {[v['name'] for v in VARIANTS]}")
+
+    if args.max_span_days > args.window_days:
+        parser.error("--max-span-days can't be more than --window-days")
+
+    server = start_server(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    tool_calls = make_tool_calls(
+        args.requests, args.window_days, args.max_span_days, args.seed
+    )
+    print(f"Hero stats server on {server.endpoint}, tool pool has {MAX_WORKERS}.")
+
+    rows = []
+
+    try:
+        for variant in variants:
+            for concurrency in levels:
+                row = run_level(variant, server.endpoint, concurrency, tool_calls)
+                rows.append(row)
+                print(
+                    f"{row['variant']:>18} x{concurrency:<3} "
+                    f"{row['callsPerSecond']:>8} calls/s  "
+                    f"p50 {row['latency'].get('p50Ms')}ms  "
+                    f"p95 {row['latency'].get('p95Ms')}ms  "
+                    f"errors {row['errors']}"
+                )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    report = {
+        "settings": vars(args),
+        "results": rows,
+        "server": server.get_stats(),
+        "pools": get_pool_stats(),
+    }
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+
+    print(f"Wrote {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import argparse
+import json
+import time
+import tracemalloc
+
+from dotenv import load_dotenv
+
+from benchmarks.stats import summarize_latencies
+from settings import AppSettings
+from shared.clients import get_search_client
+from shared.local_hotel_index import LocalHotelIndex
+
+# Tools for the local hotel index (shared/local_hotel_index.py).
+#
+#   python -m benchmarks.hotel_search_recall export
+#
+# pulls every document out of the Azure index into the snapshot file, and
+#
+#   python -m benchmarks.hotel_search_recall compare --queries queries.txt
+#
+# runs the same queries against Azure and the local index and reports how
+# many of Azure's top k the local index also found (recall@k), along with
+# the latency of each and how much memory the local index takes.
+
+SAMPLE_QUERIES = [
+    "hotel with a pool",
+    "luxury hotel near the beach",
+    "budget hotel with free parking",
+    "boutique hotel downtown",
+    "hotel with a view of the mountains",
+    "pet friendly hotel",
+    "hotel close to the airport",
+    "historic hotel",
+    "hotel with free wifi and breakfast",
+    "resort with spa and golf",
+]
+
+
+def get_azure_client(app_settings):
+    return get_search_client(
+        app_settings.search_api_endpoint,
+        app_settings.search_index,
+        app_settings.search_api_key,
+    )
+
+
+def export_snapshot(app_settings, path):
+    documents = [
+        {k: v for k, v in document.items() if not k.startswith("@search.")}
+        for document in get_azure_client(app_settings).search(
+            search_text="*", top=1000
+        )
+    ]
+
+    with open(path, "w") as snapshot_file:
+        json.dump(documents, snapshot_file, indent=2)
+
+    print(f"Wrote {len(documents)} documents to {path}.")
+
+
+def timed_ids(client, query, top):
+    start = time.perf_counter()
+    results = list(client.search(search_text=query, top=top, select=["HotelId"]))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return [r["HotelId"] for r in results], elapsed_ms
+
+
+def measure_index_bytes(documents):
+    # tracemalloc slows down everything it watches, so this builds a second
+    # index just to measure, rather than tracing the one we time.
+    tracing = tracemalloc.is_tracing()
+
+    if not tracing:
+        tracemalloc.start()
+
+    before = tracemalloc.get_traced_memory()[0]
+
+    try:
+        # Bound to a name, so it's still alive when we measure.
+        index = LocalHotelIndex(documents)
+        return tracemalloc.get_traced_memory()[0] - before
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+
+def compare(app_settings, snapshot_path, queries, top):
+    azure = get_azure_client(app_settings)
+    local = LocalHotelIndex.from_snapshot(snapshot_path)
+    index_bytes = measure_index_bytes(local.documents)
+    rows = []
+
+    for query in queries:
+        azure_ids, azure_ms = timed_ids(azure, query, top)
+        local_ids, local_ms = timed_ids(local, query, top)
+        recall = (
+            len(set(azure_ids) & set(local_ids)) / len(azure_ids) if azure_ids else None
+        )
+        rows.append(
+            {
+                "query": query,
+                "recall": recall,
+                "azureMs": round(azure_ms, 2),
+                "localMs": round(local_ms, 2),
+            }
+        )
+
+    recalls = [row["recall"] for row in rows if row["recall"] is not None]
+
+    return {
+        "top": top,
+        "queries": rows,
+        "meanRecall": sum(recalls) / len(recalls) if recalls else None,
+        "azureLatency": summarize_latencies([row["azureMs"] for row in rows]),
+        "localLatency": summarize_latencies([row["localMs"] for row in rows]),
+        "localIndex": {**local.get_stats(), "indexBytes": index_bytes},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the hotel index, or compare it with the local one."
+    )
+    parser.add_argument("command", choices=["export", "compare"])
+    parser.add_argument("--snapshot", help="defaults to HOTEL_SNAPSHOT_PATH")
+    parser.add_argument("--queries", help="a file with one query per line")
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    load_dotenv()
+    app_settings = AppSettings()
+    snapshot_path = args.snapshot or app_settings.hotel_snapshot_path
+
+    if args.command == "export":
+        export_snapshot(app_settings, snapshot_path)
+        return
+
+    queries = SAMPLE_QUERIES
+
+    if args.queries:
+        with open(args.queries) as queries_file:
+            queries = [line.strip() for line in queries_file if line.strip()]
+
+    print(json.dumps(compare(app_settings, snapshot_path, queries, args.top), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from benchmarks.stats import summarize_latencies
+from shared.llm_scheduler import (
+    BATCH,
+    INTERACTIVE,
+    PRIORITY_NAMES,
+    LlmScheduler,
+    estimate_chat_tokens,
+    priority,
+    total_tokens,
+)
+from shared.mock_openai_server import start_server
+
+# Sends a burst of chat completions at a rate limited mock deployment
+# (shared/mock_openai_server.py), straight through the OpenAI client and then
+# through an LlmScheduler, to see what the scheduler buys us at peak.
+#
+#   python -m benchmarks.rate_limit_load --requests 200 --concurrency 32
+#
+# Some of the calls are marked batch, the rest interactive, and latency is
+# reported for each, so we can check interactive calls really go first.
+# Without the scheduler a 429 is a failed call, which is what the apps do
+# today.
+
+MOCK_DEPLOYMENT = "mock-gpt"
+
+VARIANTS = ["direct", "scheduled"]
+
+
+def make_prompts(count, batch_fraction, seed):
+    rng = random.Random(seed)
+    return [
+        {
+            "priority": BATCH if rng.random() < batch_fraction else INTERACTIVE,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": f"Question {n}: " + "tell me about heroes " * 20,
+                }
+            ],
+        }
+        for n in range(count)
+    ]
+
+
+def make_create(endpoint):
+    def create(messages):
+        return openai.ChatCompletion.create(
+            engine=MOCK_DEPLOYMENT,
+            messages=messages,
+            api_base=endpoint,
+            api_type="azure",
+            api_key="mock",
+            api_version="2023-12-01-preview",
+        )
+
+    return create
+
+
+def run_variant(variant, endpoint, prompts, concurrency, args):
+    create = make_create(endpoint)
+    scheduler = (
+        LlmScheduler(
+            args.scheduler_tokens_per_minute,
+            args.scheduler_requests_per_minute,
+            max_retries=args.max_retries,
+            seed=args.seed,
+        )
+        if variant == "scheduled"
+        else None
+    )
+
+    def send(prompt):
+        start = time.perf_counter()
+        error = None
+
+        try:
+            with priority(prompt["priority"]):
+                if scheduler is None:
+                    create(prompt["messages"])
+                else:
+                    scheduler.call(
+                        lambda: create(prompt["messages"]),
+                        estimate_chat_tokens(
+                            prompt["messages"], completion_tokens=args.completion_tokens
+                        ),
+                        actual_tokens=total_tokens,
+                    )
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+        return {
+            "priority": prompt["priority"],
+            "error": error,
+            "latencyMs": round((time.perf_counter() - start) * 1000),
+        }
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as callers:
+        results = list(callers.map(send, prompts))
+
+    wall_seconds = time.perf_counter() - start
+    ok = [r for r in results if not r["error"]]
+
+    return {
+        "variant": variant,
+        "calls": len(results),
+        "errors": len(results) - len(ok),
+        "wallSeconds": round(wall_seconds, 2),
+        "callsPerSecond": round(len(ok) / wall_seconds, 2),
+        "latency": {
+            name: summarize_latencies(
+                [r["latencyMs"] for r in ok if r["priority"] == level]
+            )
+            for level, name in PRIORITY_NAMES.items()
+        },
+        "scheduler": scheduler.get_stats() if scheduler is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test chat completions against a rate limited mock."
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--variants", default=",".join(VARIANTS))
+    parser.add_argument("--batch-fraction", type=float, default=0.5)
+    parser.add_argument("--tokens-per-minute", type=int, default=60000)
+    parser.add_argument("--requests-per-minute", type=int, default=360)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--completion-tokens", type=int, default=50)
+    # Leave the scheduler a little headroom under the deployment's quota.
+    parser.add_argument("--scheduler-tokens-per-minute", type=int)
+    parser.add_argument("--scheduler-requests-per-minute", type=int)
+    parser.add_argument("--max-retries", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="rate_limit_load.json")
+    args = parser.parse_args()
+
+    variants = [v.strip() for v in args.variants.split(",") if v.strip()]
+
+    for variant in variants:
+        if variant not in VARIANTS:
+            parser.error(f"unknown variant {variant}, pick from {VARIANTS}")
+
+    if args.scheduler_tokens_per_minute is None:
+        args.scheduler_tokens_per_minute = round(args.tokens_per_minute * 0.9)
+
+    if args.scheduler_requests_per_minute is None:
+        args.scheduler_requests_per_minute = round(args.requests_per_minute * 0.9)
+
+    prompts = make_prompts(args.requests, args.batch_fraction, args.seed)
+    rows = []
+    servers = {}
+
+    for variant in variants:
+        # A fresh server each time, so one variant's 429s don't spill into
+        # the next one's quota.
+        server = start_server(
+            tokens_per_minute=args.tokens_per_minute,
+            requests_per_minute=args.requests_per_minute,
+            latency_ms=args.latency_ms,
+            completion_tokens=args.completion_tokens,
+        )
+
+        try:
+            row = run_variant(
+                variant, server.endpoint, prompts, args.concurrency, args
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        rows.append(row)
+        servers[variant] = server.get_stats()
+        print(
+            f"{variant:>10} {row['callsPerSecond']:>7} calls/s  "
+            f"errors {row['errors']}  "
+            f"interactive p95 {row['latency']['interactive'].get('p95Ms')}ms  "
+            f"batch p95 {row['latency']['batch'].get('p95Ms')}ms  "
+            f"429s {servers[variant]['throttled']}"
+        )
+
+    report = {"settings": vars(args), "results": rows, "servers": servers}
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+
+    print(f"Wrote {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stats import summarize_latencies
+from shared.llm_scheduler import BATCH, priority
+
+# Replays prompts from a JSONL file through the openai, langchain and
+# semantic-kernel pipelines without Streamlit, so we can compare them under
+# real load.  Each line of the input is one of:
+#
+#   {"id": "q1", "prompt": "Who is the best healer this month?"}
+#   {"id": "c1", "conversation": ["Find me a hotel in Seattle", "Is it cheap?"]}
+#
+# and can optionally limit which backends run it with "backends": [...].
+# Every turn becomes one line in the results file, and a p50/p95/p99 summary
+# per backend is printed and written next to it.
+#
+#   python -m benchmarks.replay --concurrency 8 --backends openai,langchain
+
+ALL_BACKENDS = ["openai", "langchain", "semantic-kernel"]
+
+
+def load_openai():
+    from my_openai import openai_pipeline
+
+    def run_turn(history, prompt):
+        openai_pipeline.append_to_chat_history(history, "user", content=prompt)
+        return openai_pipeline.make_llm_call(history, max_round_trips=6)
+
+    return openai_pipeline.create_chat_history, run_turn
+
+
+def load_langchain():
+    from my_langchain import langchain_pipeline
+
+    def run_turn(history, prompt):
+        response, _, stats = langchain_pipeline.run_agent(history, prompt)
+        langchain_pipeline.append_to_chat_history(history, "user", prompt)
+        langchain_pipeline.append_to_chat_history(history, "ai", response)
+        return stats
+
+    return langchain_pipeline.create_chat_history, run_turn
+
+
+def load_semantic_kernel():
+    from my_semantic_kernel import semantic_kernel_pipeline
+
+    def run_turn(history, prompt):
+        response, _, stats = semantic_kernel_pipeline.run_prompt(history, prompt)
+        semantic_kernel_pipeline.append_to_chat_history(history, "user", prompt)
+        semantic_kernel_pipeline.append_to_chat_history(
+            history, "assistant", response
+        )
+        return stats
+
+    return semantic_kernel_pipeline.create_chat_history, run_turn
+
+
+backend_loaders = {
+    "openai": load_openai,
+    "langchain": load_langchain,
+    "semantic-kernel": load_semantic_kernel,
+}
+
+
+def read_requests(path):
+    requests = []
+    skipped = 0
+
+    with open(path) as requests_file:
+        for line_number, line in enumerate(requests_file, start=1):
+            if not line.strip():
+                continue
+
+            request = json.loads(line)
+
+            if "conversation" in request:
+                turns = request["conversation"]
+            elif "prompt" in request:
+                turns = [request["prompt"]]
+            else:
+                skipped += 1
+                continue
+
+            requests.append(
+                {
+                    "id": request.get("id", f"line-{line_number}"),
+                    "turns": turns,
+                    "backends": request.get("backends"),
+                }
+            )
+
+    return requests, skipped
+
+
+def run_conversation(backend_loader, backend, request, repeat, write_result):
+    create_chat_history, run_turn = backend_loader
+    history = create_chat_history()
+
+    for turn, prompt in enumerate(request["turns"]):
+        result = {
+            "requestId": request["id"],
+            "repeat": repeat,
+            "backend": backend,
+            "turn": turn,
+            "prompt": prompt,
+            "error": None,
+        }
+        start = time.perf_counter()
+
+        try:
+            # Anyone using the apps at the same time goes first.
+            with priority(BATCH):
+                result.update(run_turn(history, prompt))
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+
+        result["latencyMs"] = round((time.perf_counter() - start) * 1000)
+        write_result(result)
+
+        # Later turns depend on this one, so there's no point carrying on.
+        if result["error"]:
+            return
+
+
+def summarize(results, wall_seconds):
+    summary = {"wallSeconds": round(wall_seconds, 2), "backends": {}}
+
+    for backend in sorted({r["backend"] for r in results}):
+        rows = [r for r in results if r["backend"] == backend]
+        ok = [r for r in rows if not r["error"]]
+        summary["backends"][backend] = {
+            "turns": len(rows),
+            "errors": len(rows) - len(ok),
+            "latency": summarize_latencies([r["latencyMs"] for r in ok]),
+            "llmCalls": sum(r.get("llmCalls", 0) for r in ok),
+            "toolCalls": sum(r.get("toolCalls", 0) for r in ok),
+            "promptTokens": sum(r.get("promptTokens", 0) for r in ok),
+            "completionTokens": sum(r.get("completionTokens", 0) for r in ok),
+            "toolResultTokens": sum(r.get("toolResultTokens", 0) for r in ok),
+            "toolResultTokensSaved": sum(
+                r.get("toolResultTokensSaved", 0) for r in ok
+            ),
+            "toolResultTokensTruncated": sum(
+                r.get("toolResultTokensTruncated", 0) for r in ok
+            ),
+            "turnsPerSecond": round(len(ok) / wall_seconds, 2)
+            if wall_seconds
+            else None,
+        }
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay prompts through the chat pipelines."
+    )
+    parser.add_argument("--input", default="requests.jsonl")
+    parser.add_argument("--output", default="replay_results.jsonl")
+    parser.add_argument("--backends", default=",".join(ALL_BACKENDS))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+
+    for backend in backends:
+        if backend not in backend_loaders:
+            parser.error(f"unknown backend {backend}, pick from {ALL_BACKENDS}")
+
+    requests, skipped = read_requests(args.input)
+    print(f"Loaded {len(requests)} requests from {args.input}, skipped {skipped}.")
+
+    # Import the pipelines up front, they set things up at import time and we
+    # don't want the workers racing to do it.
+    loaded = {backend: backend_loaders[backend]() for backend in backends}
+
+    results = []
+    lock = threading.Lock()
+
+    with open(args.output, "w") as output_file:
+
+        def write_result(result):
+            with lock:
+                results.append(result)
+                output_file.write(json.dumps(result) + "\n")
+                output_file.flush()
+
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [
+                executor.submit(
+                    run_conversation,
+                    loaded[backend],
+                    backend,
+                    request,
+                    repeat,
+                    write_result,
+                )
+                for repeat in range(args.repeat)
+                for request in requests
+                for backend in backends
+                if not request["backends"] or backend in request["backends"]
+            ]
+
+            for future in futures:
+                future.result()
+
+        wall_seconds = time.perf_counter() - start
+
+    summary = summarize(results, wall_seconds)
+    summary_path = args.output.rsplit(".", 1)[0] + ".summary.json"
+
+    with open(summary_path, "w") as summary_file:
+        json.dump(summary, summary_file, indent=2)
+
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import math
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile, values don't need to be sorted.
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize_latencies(latencies_ms):
+    if not latencies_ms:
+        return {"count": 0}
+
+    return {
+        "count": len(latencies_ms),
+        "meanMs": round(sum(latencies_ms) / len(latencies_ms), 1),
+        "p50Ms": percentile(latencies_ms, 50),
+        "p95Ms": percentile(latencies_ms, 95),
+        "p99Ms": percentile(latencies_ms, 99),
+        "maxMs": max(latencies_ms),
+    }
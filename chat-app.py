@@ -1,27 +1,74 @@
 import os
 import logging
 import json
+import time
+import uuid
 from datetime import datetime
 
 from dotenv import load_dotenv
 import streamlit as st
 import openai
+from openai.util import convert_to_openai_object
 from opencensus.ext.azure.log_exporter import AzureLogHandler
 
+from settings import parse_chat_deployments, parse_stream_completions
+from shared.chat_rendering import fragment, show_detail, show_paged
+from shared.clients import get_deployment_router, get_session_registry
+from shared.deadlines import deadline, get_backend, get_timeout_stats
+from shared.history import fit_to_budget
+from shared.llm_scheduler import estimate_chat_tokens, total_tokens
+from shared.message_store import MessageStore
+from shared.session_log import get_session_id
+from shared.response_cache import AzureOpenAIEmbedder, HashingEmbedder, ResponseCache
+from shared.streaming import ThrottledTextWriter, as_completion, collect_stream
+from shared.telemetry import AzureLogSink, FileSink, MemorySink, TelemetryExporter
+from shared.tracing import span
+
 load_dotenv()
 
 OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
 OPENAI_API_BASE = os.environ["OPENAI_API_BASE"]
-APPLICATIONINSIGHTS_CONNECTION_STRING = os.environ[
+APPLICATIONINSIGHTS_CONNECTION_STRING = os.environ.get(
     "APPLICATIONINSIGHTS_CONNECTION_STRING"
-]
+)
+# "azure" sends to Application Insights, "file:<path>" appends JSONL to a
+# local file and "memory" just keeps the records, for tests.
+TELEMETRY_SINK = os.environ.get("TELEMETRY_SINK", "azure")
 CHAT_MODEL = "chat"  # gpt-35-turbo
 EMBEDDING_MODEL = "text-embedding-ada-002"  # text-embedding-ada-002
+STREAM_COMPLETIONS = parse_stream_completions(os.environ.get("STREAM_COMPLETIONS"))
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "3000"))
+# "azure" uses EMBEDDING_MODEL, "hashing" is a local embedder that needs no API.
+RESPONSE_CACHE_EMBEDDER = os.environ.get("RESPONSE_CACHE_EMBEDDER", "azure")
+RESPONSE_CACHE_THRESHOLD = float(os.environ.get("RESPONSE_CACHE_THRESHOLD", "0.95"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH")
+# Unset keeps chat history in memory, see shared/session_log.py.
+CHAT_HISTORY_DIR = os.environ.get("CHAT_HISTORY_DIR")
+CHAT_HISTORY_MAX_SESSIONS = int(os.environ.get("CHAT_HISTORY_MAX_SESSIONS", "100"))
+# This process's share of the deployment's quota, 0 doesn't limit.  See
+# shared/llm_scheduler.py.
+CHAT_TOKENS_PER_MINUTE = int(os.environ.get("CHAT_TOKENS_PER_MINUTE", "0"))
+CHAT_REQUESTS_PER_MINUTE = int(os.environ.get("CHAT_REQUESTS_PER_MINUTE", "0"))
+CHAT_MAX_RETRIES = int(os.environ.get("CHAT_MAX_RETRIES", "5"))
+# How long a completion, and a whole turn, may take.  See shared/deadlines.py.
+CHAT_TIMEOUT_SECONDS = float(os.environ.get("CHAT_TIMEOUT_SECONDS", "60"))
+TURN_DEADLINE_SECONDS = float(os.environ.get("TURN_DEADLINE_SECONDS", "120"))
+# Unset is just the one deployment above, see shared/deployment_router.py.
+CHAT_DEPLOYMENTS = parse_chat_deployments(
+    os.environ.get("CHAT_DEPLOYMENTS"),
+    {
+        "name": CHAT_MODEL,
+        "endpoint": OPENAI_API_BASE,
+        "apiKey": OPENAI_API_KEY,
+        "model": CHAT_MODEL,
+        "tokensPerMinute": CHAT_TOKENS_PER_MINUTE,
+        "requestsPerMinute": CHAT_REQUESTS_PER_MINUTE,
+    },
+)
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-handler = AzureLogHandler(connection_string=APPLICATIONINSIGHTS_CONNECTION_STRING)
-logger.addHandler(handler)
 openai.api_type = "azure"
 openai.api_key = OPENAI_API_KEY
 openai.api_base = OPENAI_API_BASE
@@ -29,147 +76,298 @@ openai.api_version = "2023-07-01-preview"
 
 st.set_page_config(page_title="Prompt monitoring playground")
 
-if "chat_history" not in st.session_state:
-    st.session_state["chat_history"] = []
+if CHAT_HISTORY_DIR:
+    # Fetched on every rerun, so a session that was evicted is read back and
+    # anything another worker added is picked up.  The session id doubles as
+    # the conversation id, it outlives the Streamlit session.
+    st.session_state["conversation_id"] = get_session_id()
+    st.session_state["chat_history"] = get_session_registry(
+        os.path.join(CHAT_HISTORY_DIR, "chat-app"), CHAT_HISTORY_MAX_SESSIONS
+    ).get(st.session_state["conversation_id"])
+elif "chat_history" not in st.session_state:
+    st.session_state["chat_history"] = MessageStore()
+
+
+# Shared by every session, that's where the repeats come from.
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    embedder = (
+        HashingEmbedder()
+        if RESPONSE_CACHE_EMBEDDER == "hashing"
+        else AzureOpenAIEmbedder(EMBEDDING_MODEL)
+    )
+    return ResponseCache(
+        embedder,
+        threshold=RESPONSE_CACHE_THRESHOLD,
+        ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+        path=RESPONSE_CACHE_PATH,
+    )
+
+
+response_cache = get_response_cache()
+chat_router = get_deployment_router(CHAT_DEPLOYMENTS, CHAT_MAX_RETRIES)
+chat_backend = get_backend("chat", CHAT_TIMEOUT_SECONDS)
+
+
+# One exporter (and one AzureLogHandler) per process.  Creating the handler on
+# every rerun would attach another copy to the root logger each time.
+@st.cache_resource(show_spinner=False)
+def get_telemetry_exporter():
+    if TELEMETRY_SINK == "memory":
+        sink = MemorySink()
+    elif TELEMETRY_SINK.startswith("file:"):
+        sink = FileSink(TELEMETRY_SINK[len("file:") :])
+    else:
+        handler = AzureLogHandler(
+            connection_string=APPLICATIONINSIGHTS_CONNECTION_STRING
+        )
+        logger.addHandler(handler)
+        sink = AzureLogSink(logger, handler)
+
+    return TelemetryExporter(sink)
+
+
+telemetry = get_telemetry_exporter()
+
+if "conversation_id" not in st.session_state:
+    st.session_state["conversation_id"] = str(uuid.uuid4())
 
 
 def record_feedback(completion_id, feedback):
-    # We make assumptions here that the conversation is
-    # always user/ai/user/ai.  Once we have other steps
-    # for RAG, we'll do a little more bookkeeping to find
-    # the most recent prompt from the user, ignoring any
-    # intermediate completions.
-    conversation = []
-    messages = st.session_state["chat_history"]
-
-    for i in range(0, len(messages)):
-        message = messages[i]
-        conversation.append({"role": message["role"], "content": message["content"]})
-
-        if message["completion"] and message["completion"].id == completion_id:
-            message["feedback"] = feedback
-            logger.info(
-                "feedback",
-                extra={
-                    "custom_dimensions": {
-                        "completionId": message["completion"].id,
-                        "feedback": feedback,
-                    }
-                },
-            )
-            return
+    message = st.session_state["chat_history"].set_feedback(completion_id, feedback)
 
+    if message is not None:
+        telemetry.emit(
+            "feedback",
+            {
+                "conversationId": st.session_state["conversation_id"],
+                "completionId": completion_id,
+                "feedback": feedback,
+            },
+        )
 
-def show_chat_history():
-    for message in st.session_state["chat_history"]:
-        role = message["role"]
-        content = message["content"]
-        feedback = message["feedback"]
-        completion = message["completion"]
-
-        if completion:
-            if message["feedback"]:
-                col1, col2 = st.columns([10, 1])
-                with col1:
-                    with st.chat_message(name=role):
-                        st.write(content)
-                with col2:
-                    if feedback == "good":
-                        st.write("👍")
-                    elif feedback == "bad":
-                        st.write("👎")
-            else:
-                col1, col2, col3 = st.columns([10, 1, 1])
-                with col1:
-                    with st.chat_message(name=role):
-                        st.write(content)
-                with col2:
-                    st.button(
-                        "👍",
-                        on_click=record_feedback,
-                        args=(completion.id, "good"),
-                        key=f"{completion.id}-good",
-                    )
-                with col3:
-                    st.button(
-                        "👎",
-                        on_click=record_feedback,
-                        args=(completion.id, "bad"),
-                        key=f"{completion.id}-bad",
-                    )
-        else:
+
+# A click on a feedback button only reruns the message it belongs to.
+@fragment
+def show_completion(index):
+    message = st.session_state["chat_history"][index]
+    role = message.role
+    content = message.content
+    feedback = message.feedback
+    completion_id = message.completion_id
+
+    if feedback:
+        col1, col2 = st.columns([10, 1])
+        with col1:
+            with st.chat_message(name=role):
+                st.write(content)
+        with col2:
+            if feedback == "good":
+                st.write("👍")
+            elif feedback == "bad":
+                st.write("👎")
+    else:
+        col1, col2, col3 = st.columns([10, 1, 1])
+        with col1:
             with st.chat_message(name=role):
                 st.write(content)
+        with col2:
+            st.button(
+                "👍",
+                on_click=record_feedback,
+                args=(completion_id, "good"),
+                key=f"{completion_id}-good",
+            )
+        with col3:
+            st.button(
+                "👎",
+                on_click=record_feedback,
+                args=(completion_id, "bad"),
+                key=f"{completion_id}-bad",
+            )
+
+    show_detail(message, "usage", key=f"{completion_id}-usage", label="Show usage")
 
-        if completion:
-            st.json(completion, expanded=False)
+
+def show_message(index, message):
+    if message.completion_id:
+        show_completion(index)
+    else:
+        with st.chat_message(name=message.role):
+            st.write(message.content)
+
+
+def show_chat_history():
+    show_paged(st.session_state["chat_history"], show_message)
 
 
 def append_to_chat_history(role, content, completion=None):
+    # Only the id (for feedback) and the usage are kept from the completion.
     st.session_state["chat_history"].append(
-        {
-            "role": role,
-            "content": content,
-            "feedback": None,
-            "completion": completion,
-        }
+        role,
+        content,
+        completion_id=completion.id if completion else None,
+        usage=completion.usage.to_dict_recursive()
+        if completion and completion.get("usage")
+        else None,
     )
 
 
 def get_conversation():
-    return [
-        {"role": m["role"], "content": m["content"]}
-        for m in st.session_state["chat_history"]
-    ]
-
+    chat_history = st.session_state["chat_history"]
+    return chat_history.as_wire(
+        fit_to_budget(chat_history.messages, HISTORY_TOKEN_BUDGET)
+    )
 
-prompt = st.chat_input("Ask a question")
-
-if prompt:
-    append_to_chat_history("user", prompt)
 
+def create_completion(messages):
     start = datetime.now()
-    completion = openai.ChatCompletion.create(
-        engine=CHAT_MODEL, messages=get_conversation()
+    completion = chat_router.call(
+        lambda deployment: chat_backend.call(
+            lambda timeout: openai.ChatCompletion.create(
+                engine=deployment.model,
+                api_base=deployment.endpoint,
+                api_key=deployment.api_key,
+                messages=messages,
+                request_timeout=timeout,
+            )
+        ),
+        estimate_chat_tokens(messages),
+        actual_tokens=total_tokens,
     )
     finish = datetime.now()
     elapsed = round((finish - start).total_seconds() * 1000)
-    response = completion.choices[0].message.content
-    role = completion.choices[0].message.role
-
-    append_to_chat_history(role, response, completion)
-    conversation = [
-        {"role": m["role"], "content": m["content"]}
-        for m in st.session_state["chat_history"]
-    ]
-    # The annotations are not always there, not sure why, handle it.
-    prompt_filter_results = (
-        completion.prompt_annotations[0].content_filter_results
-        if hasattr(completion, "prompt_annotations") and completion.prompt_annotations
-        else {}
+
+    # Without streaming, the first token shows up along with the last one.
+    return completion, elapsed, elapsed
+
+
+def stream_completion(messages):
+    with st.chat_message(name="assistant"):
+        placeholder = st.empty()
+
+    started = time.perf_counter()
+    chunks = chat_router.call(
+        lambda deployment: chat_backend.call(
+            lambda timeout: openai.ChatCompletion.create(
+                engine=deployment.model,
+                api_base=deployment.endpoint,
+                api_key=deployment.api_key,
+                messages=messages,
+                stream=True,
+                request_timeout=timeout,
+            )
+        ),
+        estimate_chat_tokens(messages),
+    )
+    streamed = collect_stream(
+        chunks, started, on_content=ThrottledTextWriter(placeholder.write)
     )
-    response_filter_results = (
-        completion.choices[0].content_filter_results
-        if hasattr(completion.choices[0], "content_filter_results")
-        and completion.choices[0].content_filter_results
-        else {}
+    elapsed = round(streamed["elapsed"] * 1000)
+    time_to_first_token = (
+        round(streamed["time_to_first_token"] * 1000)
+        if streamed["time_to_first_token"] is not None
+        else elapsed
     )
-    logger.info(
-        "chat completion",
-        extra={
-            "custom_dimensions": {
+
+    return as_completion(streamed), elapsed, time_to_first_token
+
+
+def cached_completion(lookup):
+    # The copy gets its own id, the feedback buttons are keyed on it.
+    response = lookup.response
+    return convert_to_openai_object(
+        {**response, "id": f"{response['id']}-cached-{uuid.uuid4().hex[:8]}"}
+    )
+
+
+prompt = st.chat_input("Ask a question")
+
+if prompt:
+    with deadline(TURN_DEADLINE_SECONDS), span("turn", backend="chat-app"):
+        append_to_chat_history("user", prompt)
+
+        with span("prompt assembly", messages=len(st.session_state["chat_history"])):
+            messages = get_conversation()
+
+        lookup_start = time.perf_counter()
+
+        with span("cache lookup") as lookup_span:
+            lookup = response_cache.lookup(CHAT_MODEL, messages)
+            lookup_span.set(level=lookup.level, similarity=lookup.similarity)
+
+        if lookup.response is not None:
+            completion = cached_completion(lookup)
+            elapsed = round((time.perf_counter() - lookup_start) * 1000)
+            time_to_first_token = elapsed
+        else:
+            if STREAM_COMPLETIONS:
+                # Draw what we have so far, so the answer can stream in underneath.
+                show_chat_history()
+
+            with span("llm call", model=CHAT_MODEL, streamed=STREAM_COMPLETIONS) as llm:
+                if STREAM_COMPLETIONS:
+                    completion, elapsed, time_to_first_token = stream_completion(
+                        messages
+                    )
+                else:
+                    completion, elapsed, time_to_first_token = create_completion(
+                        messages
+                    )
+
+                llm.set(
+                    usage=completion.get("usage"), timeToFirstToken=time_to_first_token
+                )
+
+            response_cache.put(lookup, completion.to_dict_recursive())
+
+        response = completion.choices[0].message.content
+        role = completion.choices[0].message.role
+
+        append_to_chat_history(role, response, completion)
+        # The annotations are not always there, not sure why, handle it.
+        prompt_filter_results = (
+            completion.prompt_annotations[0].content_filter_results
+            if hasattr(completion, "prompt_annotations")
+            and completion.prompt_annotations
+            else {}
+        )
+        response_filter_results = (
+            completion.choices[0].content_filter_results
+            if hasattr(completion.choices[0], "content_filter_results")
+            and completion.choices[0].content_filter_results
+            else {}
+        )
+        # Rather than the whole transcript, we log which conversation this is and
+        # where the turn sits in it.  The prompt and response are the new part,
+        # the earlier turns were logged when they happened.
+        telemetry.emit(
+            "chat completion",
+            {
+                "conversationId": st.session_state["conversation_id"],
+                "turnIndex": len(st.session_state["chat_history"]) // 2 - 1,
                 "completionId": completion.id,
                 "prompt": prompt,
                 "response": response,
-                "conversation": json.dumps(conversation),
                 "usage": json.dumps(completion.usage),
                 "promptFilterResults": json.dumps(prompt_filter_results),
                 "responseFilterResults": json.dumps(response_filter_results),
                 "timeInMilliseconds": elapsed,
-            }
-        },
-    )
+                "timeToFirstTokenInMilliseconds": time_to_first_token,
+                "streamed": STREAM_COMPLETIONS,
+                "responseCache": lookup.level,
+                "responseCacheSimilarity": lookup.similarity,
+            },
+        )
 
-    handler.flush()
+    if STREAM_COMPLETIONS:
+        # Start over so the new answer is drawn with its feedback buttons.
+        st.rerun()
 
 show_chat_history()
+
+with st.sidebar.expander("Chat deployments"):
+    st.json(chat_router.get_stats())
+
+with st.sidebar.expander("Timeouts and hedges"):
+    st.json(get_timeout_stats())
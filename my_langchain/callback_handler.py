@@ -1,18 +1,119 @@
-from typing import Dict, List, Any, Union
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Dict, List, Any, Optional, Union
 from langchain.callbacks.base import BaseCallbackHandler
 from langchain.schema import AgentAction, AgentFinish, BaseMessage, LLMResult
 
+from shared.tracing import start_span
+
 
 class CustomCallbackHandler(BaseCallbackHandler):
-    events = []
+    """Records what happened during one agent run.
+
+    Create one per run.  Events are kept as small dicts (what happened, when,
+    how long it took, tokens used and a truncated payload) in a ring buffer,
+    so a chatty agent can't grow it without bound.  With spill_path set, the
+    full payload of every event is appended to that JSONL file, and the event
+    keeps a spillId pointing at it.
+    """
+
+    def __init__(
+        self,
+        max_events: int = 200,
+        max_payload_chars: int = 500,
+        spill_path: Optional[str] = None,
+    ):
+        super().__init__()
+        self.events = deque(maxlen=max_events)
+        self.dropped_events = 0
+        self.max_payload_chars = max_payload_chars
+        self.spill_path = spill_path
+        self._started = time.perf_counter()
+        self._run_starts = {}
+        self._lock = threading.Lock()
+
+    def get_events(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.events)
+
+    def _truncate(self, text: str) -> str:
+        if len(text) <= self.max_payload_chars:
+            return text
+
+        return f"{text[: self.max_payload_chars]}... ({len(text)} chars)"
+
+    def _spill(self, event: str, payload: Any) -> str:
+        spill_id = uuid.uuid4().hex
+        line = json.dumps(
+            {"spillId": spill_id, "event": event, "payload": payload}, default=str
+        )
+
+        with open(self.spill_path, "a") as spill_file:
+            spill_file.write(line + "\n")
+
+        return spill_id
+
+    def _record(
+        self,
+        event: str,
+        payload: Any,
+        run_id: Any = None,
+        starting: bool = False,
+        ending: bool = False,
+        **extra: Any
+    ) -> None:
+        now = time.perf_counter()
+        record = {"event": event, "atMs": round((now - self._started) * 1000)}
+
+        if run_id is not None:
+            record["runId"] = str(run_id)
+
+            if starting:
+                self._run_starts[run_id] = now
+            elif ending and run_id in self._run_starts:
+                start = self._run_starts.pop(run_id)
+                record["durationMs"] = round((now - start) * 1000)
+
+        record.update(extra)
+        if isinstance(payload, str):
+            text = payload
+        else:
+            text = json.dumps(payload, default=str)
+
+        record["payload"] = self._truncate(text)
+
+        if self.spill_path:
+            record["spillId"] = self._spill(event, payload)
+
+        with self._lock:
+            if len(self.events) == self.events.maxlen:
+                self.dropped_events += 1
+
+            self.events.append(record)
 
     def on_llm_start(
         self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
     ) -> Any:
-        self.events.append({"llm_start": {"prompts": prompts}})
+        self._record("llm_start", prompts, kwargs.get("run_id"), starting=True)
 
     def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
-        self.events.append({"llm_end": {"response": response}})
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        text = "\n".join(
+            generation.text
+            for generations in response.generations
+            for generation in generations
+        )
+        self._record(
+            "llm_end",
+            text,
+            kwargs.get("run_id"),
+            ending=True,
+            promptTokens=token_usage.get("prompt_tokens"),
+            completionTokens=token_usage.get("completion_tokens"),
+        )
 
     def on_chat_model_start(
         self,
@@ -20,36 +121,202 @@ class CustomCallbackHandler(BaseCallbackHandler):
         messages: List[List[BaseMessage]],
         **kwargs: Any
     ) -> Any:
-        self.events.append({"chat_model_start": {"messages": messages}})
+        payload = [
+            [{"type": m.type, "content": m.content} for m in batch]
+            for batch in messages
+        ]
+        self._record(
+            "chat_model_start",
+            payload,
+            kwargs.get("run_id"),
+            starting=True,
+            messageCount=sum(len(batch) for batch in messages),
+        )
 
     def on_chain_start(
         self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any
     ) -> Any:
-        self.events.append({"chain_start": {"inputs": inputs}})
+        self._record("chain_start", inputs, kwargs.get("run_id"), starting=True)
 
     def on_chain_end(self, outputs: Dict[str, Any], **kwargs: Any) -> Any:
         """Run when chain ends running."""
-        self.events.append({"chain_end": {"outputs": outputs}})
+        self._record("chain_end", outputs, kwargs.get("run_id"), ending=True)
 
-    def on_chain_error(self, outputs: Dict[str, Any], **kwargs: Any) -> Any:
-        """Run when chain ends running."""
-        self.events.append({"chain_error": {"outputs": outputs}})
+    def on_chain_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> Any:
+        """Run when chain errors."""
+        self._record("chain_error", repr(error), kwargs.get("run_id"), ending=True)
 
     def on_tool_start(
         self, serialized: Dict[str, Any], input_str: str, **kwargs: Any
     ) -> Any:
-        self.events.append({"tool_start": {"input_str": input_str}})
+        self._record(
+            "tool_start",
+            input_str,
+            kwargs.get("run_id"),
+            starting=True,
+            tool=serialized.get("name"),
+        )
 
     def on_tool_end(self, output: str, **kwargs: Any) -> Any:
-        self.events.append({"tool_end": {"output": output}})
+        self._record("tool_end", output, kwargs.get("run_id"), ending=True)
 
     def on_tool_error(
         self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
     ) -> Any:
-        self.events.append({"tool_error": {"error": error}})
+        self._record("tool_error", repr(error), kwargs.get("run_id"), ending=True)
 
     def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
-        self.events.append({"agent_action": {"action": action}})
+        self._record(
+            "agent_action", action.tool_input, kwargs.get("run_id"), tool=action.tool
+        )
 
     def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> Any:
-        self.events.append({"agent_finish": {"outputs": finish}})
+        self._record("agent_finish", finish.return_values, kwargs.get("run_id"))
+
+
+class RunStatsCallbackHandler(BaseCallbackHandler):
+    """Counts LLM calls, tool calls, tokens and LLM time for one agent run."""
+
+    def __init__(self):
+        super().__init__()
+        self.stats = {
+            "llmCalls": 0,
+            "toolCalls": 0,
+            "promptTokens": 0,
+            "completionTokens": 0,
+            "llmMs": 0,
+        }
+        self._llm_starts = {}
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
+    ) -> Any:
+        # Chat models come through here too, since we don't implement
+        # on_chat_model_start.
+        self._llm_starts[kwargs.get("run_id")] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        start = self._llm_starts.pop(kwargs.get("run_id"), None)
+
+        if start is not None:
+            self.stats["llmMs"] += round((time.perf_counter() - start) * 1000)
+
+        self.stats["llmCalls"] += 1
+        self.stats["promptTokens"] += token_usage.get("prompt_tokens", 0)
+        self.stats["completionTokens"] += token_usage.get("completion_tokens", 0)
+
+    def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, **kwargs: Any
+    ) -> Any:
+        self.stats["toolCalls"] += 1
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Turns LangChain's callbacks into spans (see shared/tracing.py).
+
+    Chains (the agent, APIChain, RetrievalQA...), LLM calls, tools and
+    retrievers each get a span, nested the way LangChain ran them.  The
+    outermost ones are children of whatever span was current when the run
+    started.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def _start(self, name: str, run_id: Any, parent_run_id: Any = None, **attributes):
+        with self._lock:
+            parent = self._spans.get(parent_run_id)
+            self._spans[run_id] = start_span(name, parent, **attributes)
+
+    def _end(self, **kwargs: Any) -> Any:
+        with self._lock:
+            span = self._spans.pop(kwargs.get("run_id"), None)
+
+        return span
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
+    ) -> Any:
+        self._start("llm call", kwargs.get("run_id"), kwargs.get("parent_run_id"))
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
+        span = self._end(**kwargs)
+
+        if span is not None:
+            span.set(usage=(response.llm_output or {}).get("token_usage"))
+            span.end()
+
+    def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> Any:
+        self._fail(error, **kwargs)
+
+    def on_chain_start(
+        self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any
+    ) -> Any:
+        self._start(
+            "chain",
+            kwargs.get("run_id"),
+            kwargs.get("parent_run_id"),
+            chain=(serialized or {}).get("id", ["?"])[-1],
+        )
+
+    def on_chain_end(self, outputs: Dict[str, Any], **kwargs: Any) -> Any:
+        self._finish(**kwargs)
+
+    def on_chain_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> Any:
+        self._fail(error, **kwargs)
+
+    def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, **kwargs: Any
+    ) -> Any:
+        self._start(
+            "tool call",
+            kwargs.get("run_id"),
+            kwargs.get("parent_run_id"),
+            tool=(serialized or {}).get("name"),
+        )
+
+    def on_tool_end(self, output: str, **kwargs: Any) -> Any:
+        self._finish(**kwargs)
+
+    def on_tool_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> Any:
+        self._fail(error, **kwargs)
+
+    def on_retriever_start(
+        self, serialized: Dict[str, Any], query: str, **kwargs: Any
+    ) -> Any:
+        self._start("retriever", kwargs.get("run_id"), kwargs.get("parent_run_id"))
+
+    def on_retriever_end(self, documents: Any, **kwargs: Any) -> Any:
+        span = self._end(**kwargs)
+
+        if span is not None:
+            span.set(documents=len(documents))
+            span.end()
+
+    def on_retriever_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> Any:
+        self._fail(error, **kwargs)
+
+    def _finish(self, **kwargs: Any) -> None:
+        span = self._end(**kwargs)
+
+        if span is not None:
+            span.end()
+
+    def _fail(self, error: BaseException, **kwargs: Any) -> None:
+        span = self._end(**kwargs)
+
+        if span is not None:
+            span.end(f"{type(error).__name__}: {error}")
@@ -1,154 +1,73 @@
-from dotenv import load_dotenv
-
-# We don't really need the langchain import here, but if we don't do it,
-# we get spurious errors running this in streamlit, like:
-#    - AttributeError: module 'langchain' has no attribute 'verbose'
-#    - ImportError: cannot import name 'ChatOpenAI' from partially initialized module 'langchain.chat_models' (most likely due to a circular import)
-import langchain
-
-
 import streamlit as st
-from langchain.schema import AIMessage, HumanMessage
-from langchain.prompts.chat import MessagesPlaceholder, HumanMessagePromptTemplate
-from langchain.chat_models import AzureChatOpenAI
-from langchain.chains import APIChain, LLMChain, RetrievalQA
-from langchain.tools import Tool
-from langchain.agents import initialize_agent, AgentType
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import PromptTemplate, ChatPromptTemplate
-from langchain.retrievers import AzureCognitiveSearchRetriever
-
-from my_langchain.callback_handler import CustomCallbackHandler
-from settings import AppSettings
-
-# Show the blow-by-blow as the agent runs.
-langchain.debug = True
-
-load_dotenv()
-
-app_settings = AppSettings()
 
-st.set_page_config(page_title="Tool Comparison - Langchain", page_icon="ocelot.ico")
-
-if "chat_history" not in st.session_state:
-    st.session_state["chat_history"] = []
-
-
-@st.cache_data
-def get_api_spec():
-    with open("resources/hots_api_spec.json") as api_spec_file:
-        return api_spec_file.read()
-
-
-llm = AzureChatOpenAI(
-    openai_api_base=app_settings.chat_api_endpoint,
-    openai_api_key=app_settings.chat_api_key,
-    openai_api_type="azure",
-    openai_api_version="2023-07-01-preview",
-    deployment_name=app_settings.chat_model,
+from my_langchain.langchain_pipeline import (
+    app_settings,
+    append_to_chat_history,
+    chat_router,
+    create_agent,
+    create_chat_history,
+    run_agent,
 )
+from shared.chat_rendering import show_detail, show_paged
+from shared.clients import get_pool_stats
+from shared.deadlines import get_timeout_stats
+from shared.session_log import get_session_id
 
-# We only return the "Description" field.  In a real example we
-# would index this differently, but this is a convenient sample
-# dataset provided by Azure.
-retriever = AzureCognitiveSearchRetriever(
-    service_name=app_settings.search_service,
-    index_name=app_settings.search_index,
-    api_key=app_settings.search_api_key,
-    top_k=5,
-    content_key="Description",
-)
+st.set_page_config(page_title="Tool Comparison - Langchain", page_icon="ocelot.ico")
 
+if app_settings.chat_history_dir:
+    # Fetched on every rerun, so a session that was evicted is read back and
+    # anything another worker added is picked up.
+    st.session_state["chat_history"] = create_chat_history(get_session_id())
+elif "chat_history" not in st.session_state:
+    st.session_state["chat_history"] = create_chat_history()
 
-def show_chat_history():
-    for message in st.session_state["chat_history"]:
-        role = message["role"]
-        content = message["content"]
-        llm_response = message["llm_response"]
+if "agent" not in st.session_state:
+    st.session_state["agent"] = create_agent()
 
-        with st.chat_message(name=role):
-            st.write(content)
 
-        if llm_response:
-            st.json(llm_response, expanded=False)
+def show_message(index, message):
+    role = message.role
+    content = message.content
+    stats = message.stats
 
+    with st.chat_message(name=role):
+        st.write(content)
 
-def append_to_chat_history(role, content, llm_response=None):
-    st.session_state["chat_history"].append(
-        {
-            "role": role,
-            "content": content,
-            "llm_response": llm_response,
-        }
-    )
+        if stats:
+            st.caption(
+                f"{stats['totalMs']} ms total: {stats['setupMs']} ms setup, "
+                f"{stats['llmMs']} ms in the LLM, "
+                f"{stats['frameworkMs']} ms in the framework"
+            )
 
+    show_detail(message, "detail", key=f"events-{index}", label="Show events")
 
-def get_conversation():
-    def get_message(m):
-        if m["role"] == "user":
-            return HumanMessage(content=m["content"])
-        else:
-            # We don't expect any "system" messages for now.
-            return AIMessage(content=m["content"])
 
-    return [get_message(m) for m in st.session_state["chat_history"]]
+def show_chat_history():
+    show_paged(st.session_state["chat_history"], show_message)
 
 
 prompt = st.chat_input("Ask a question")
 
 if prompt:
-    conversation = get_conversation()
-    append_to_chat_history("user", prompt)
+    chat_history = st.session_state["chat_history"]
 
-    memory = ConversationBufferMemory(memory_key="chat_history")
-
-    llm_chain = LLMChain(
-        llm=llm, prompt=PromptTemplate.from_template("Answer this question: {content}")
-    )
-    chat_tool = Tool.from_function(
-        llm_chain.run,
-        name="chat",
-        description="uses chat to answer general knowledge questions",
-    )
-    api_chain = APIChain.from_llm_and_api_docs(llm, get_api_spec())
-    api_tool = Tool.from_function(
-        api_chain.run,
-        name="api",
-        description="an API that can answer questions about win rates for Heroes of the Storm",
-    )
-    retrieval_chain = RetrievalQA.from_llm(
-        llm=llm,
-        retriever=retriever,
-    )
-    retrieval_tool = Tool.from_function(
-        retrieval_chain.run,
-        name="search",
-        description="a index that can be searched to find information about hotels, and only hotels, not general knowledge questions",
+    # The history holds the earlier turns, the prompt goes in separately.
+    response, events, stats = run_agent(
+        chat_history, prompt, agent=st.session_state["agent"]
     )
 
-    # OPENAI_FUNCTIONS should take advantage of the "function calling" feature in the newest
-    # gpt3.5 and gpt4 models.
-    tools = [chat_tool, retrieval_tool, api_tool]
-    agent = initialize_agent(
-        tools=tools,
-        agent_type=AgentType.OPENAI_FUNCTIONS,
-        llm=llm,
-        memory=memory,
-    )
+    append_to_chat_history(chat_history, "user", prompt)
+    append_to_chat_history(chat_history, "ai", response, events, stats)
 
-    prompt_template = ChatPromptTemplate.from_messages(
-        [
-            # We would place the system message here, if we had one.
-            MessagesPlaceholder(variable_name="chat_history"),
-            HumanMessagePromptTemplate.from_template("{human_input}"),
-        ]
-    )
+show_chat_history()
 
-    handler = CustomCallbackHandler()
-    full_prompt = prompt_template.format(human_input=prompt, chat_history=conversation)
-    response = agent.run(input=full_prompt, callbacks=[handler])
-    role = "ai"
+with st.sidebar.expander("Connection pools"):
+    st.json(get_pool_stats())
 
-    append_to_chat_history("ai", response, handler.events)
+with st.sidebar.expander("Chat deployments"):
+    st.json(chat_router.get_stats())
 
-show_chat_history()
+with st.sidebar.expander("Timeouts and hedges"):
+    st.json(get_timeout_stats())
@@ -0,0 +1,228 @@
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+# We don't really need the langchain import here, but if we don't do it,
+# we get spurious errors running this in streamlit, like:
+#    - AttributeError: module 'langchain' has no attribute 'verbose'
+#    - ImportError: cannot import name 'ChatOpenAI' from partially initialized module 'langchain.chat_models' (most likely due to a circular import)
+import langchain
+
+
+import streamlit as st
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+from langchain.prompts.chat import MessagesPlaceholder, HumanMessagePromptTemplate
+from langchain.chains import APIChain, LLMChain, RetrievalQA
+from langchain.tools import Tool
+from langchain.agents import initialize_agent, AgentType
+from langchain.prompts import PromptTemplate, ChatPromptTemplate
+
+from my_langchain.callback_handler import (
+    CustomCallbackHandler,
+    RunStatsCallbackHandler,
+    TracingCallbackHandler,
+)
+from my_langchain.pooled_clients import (
+    PooledRequestsWrapper,
+    RoutedAzureChatOpenAI,
+    SearchClientRetriever,
+)
+from settings import AppSettings
+from shared.clients import (
+    get_chat_router,
+    get_hotel_search_client,
+    get_session_registry,
+)
+from shared.deadlines import deadline, get_backend
+from shared.history import fit_to_budget
+from shared.message_store import MessageStore
+from shared.tracing import span
+
+# Everything the LangChain app does, minus the Streamlit UI, so the same code
+# can be driven headless (see benchmarks/replay.py).  The chat history is a
+# MessageStore from create_chat_history() that the caller owns.
+
+load_dotenv()
+
+app_settings = AppSettings()
+
+# Show the blow-by-blow as the agent runs.  It prints everything to stdout,
+# which is slow, so it's off unless LANGCHAIN_DEBUG=true.  The compact events
+# from CustomCallbackHandler are there either way.
+langchain.debug = app_settings.langchain_debug
+
+
+@st.cache_data(show_spinner=False)
+def get_api_spec():
+    with open("resources/hots_api_spec.json") as api_spec_file:
+        api_spec = json.load(api_spec_file)
+
+    # The APIChain builds its URLs from the spec, so point it at whatever
+    # HEROES_API_ENDPOINT says (the real API or shared/hero_stats_server.py).
+    api_spec["servers"] = [{"url": app_settings.heroes_api_endpoint}]
+    return json.dumps(api_spec, indent=2)
+
+
+chat_router = get_chat_router(app_settings)
+
+# Timeouts for everything we call out to, see shared/deadlines.py.  The
+# lookups are safe to send twice, so they may be hedged.
+heroes_backend = get_backend(
+    "heroes", app_settings.heroes_timeout_seconds, hedge=app_settings.hedge_lookups
+)
+search_backend = get_backend(
+    "search", app_settings.search_timeout_seconds, hedge=app_settings.hedge_lookups
+)
+chat_backend = get_backend("chat", app_settings.chat_timeout_seconds)
+
+llm = RoutedAzureChatOpenAI(
+    openai_api_base=app_settings.chat_api_endpoint,
+    openai_api_key=app_settings.chat_api_key,
+    openai_api_type="azure",
+    openai_api_version="2023-07-01-preview",
+    deployment_name=app_settings.chat_model,
+    router=chat_router,
+    backend=chat_backend,
+    request_timeout=app_settings.chat_timeout_seconds,
+)
+
+# We only return the "Description" field.  In a real example we
+# would index this differently, but this is a convenient sample
+# dataset provided by Azure.
+retriever = SearchClientRetriever(
+    client=get_hotel_search_client(app_settings),
+    top_k=5,
+    content_key="Description",
+    backend=search_backend,
+)
+
+
+def append_to_chat_history(history, role, content, llm_response=None, stats=None):
+    history.append(role, content, detail=llm_response, stats=stats)
+
+
+def as_langchain_message(message):
+    if message.role == "user":
+        return HumanMessage(content=message.content)
+    elif message.role == "system":
+        # Only the summary of turns that didn't fit in the budget.
+        return SystemMessage(content=message.content)
+    else:
+        return AIMessage(content=message.content)
+
+
+def create_chat_history(session_id=None):
+    # With CHAT_HISTORY_DIR set, each session's history lives on disk.
+    if app_settings.chat_history_dir and session_id:
+        registry = get_session_registry(
+            os.path.join(app_settings.chat_history_dir, "langchain"),
+            app_settings.chat_history_max_sessions,
+            as_langchain_message,
+        )
+        return registry.get(session_id)
+
+    return MessageStore(to_wire=as_langchain_message)
+
+
+def get_conversation(history):
+    return history.as_wire(
+        fit_to_budget(history.messages, app_settings.history_token_budget)
+    )
+
+
+# The chains and tools don't hold any per-conversation state, so we build them
+# once per process and share them between sessions.
+@st.cache_resource(show_spinner=False)
+def get_tools():
+    llm_chain = LLMChain(
+        llm=llm, prompt=PromptTemplate.from_template("Answer this question: {content}")
+    )
+    chat_tool = Tool.from_function(
+        llm_chain.run,
+        name="chat",
+        description="uses chat to answer general knowledge questions",
+    )
+    api_chain = APIChain.from_llm_and_api_docs(llm, get_api_spec())
+    api_chain.requests_wrapper = PooledRequestsWrapper(backend=heroes_backend)
+    api_tool = Tool.from_function(
+        api_chain.run,
+        name="api",
+        description="an API that can answer questions about win rates for Heroes of the Storm",
+    )
+    retrieval_chain = RetrievalQA.from_llm(
+        llm=llm,
+        retriever=retriever,
+    )
+    retrieval_tool = Tool.from_function(
+        retrieval_chain.run,
+        name="search",
+        description="a index that can be searched to find information about hotels, and only hotels, not general knowledge questions",
+    )
+
+    return [chat_tool, retrieval_tool, api_tool]
+
+
+prompt_template = ChatPromptTemplate.from_messages(
+    [
+        # We would place the system message here, if we had one.
+        MessagesPlaceholder(variable_name="chat_history"),
+        HumanMessagePromptTemplate.from_template("{human_input}"),
+    ]
+)
+
+
+def create_agent():
+    # Reused for a session's turns, to save building the tools each time.  It
+    # has no memory: the history goes in with each prompt (see run_agent), and
+    # a memory would store that whole prompt again every turn.
+    #
+    # OPENAI_FUNCTIONS should take advantage of the "function calling" feature in the newest
+    # gpt3.5 and gpt4 models.
+    return initialize_agent(
+        tools=get_tools(),
+        agent_type=AgentType.OPENAI_FUNCTIONS,
+        llm=llm,
+    )
+
+
+def run_agent(history, prompt, agent=None):
+    # history holds the turns before this prompt.  Pass the session's agent
+    # to reuse it, otherwise we make a new one.  Returns the response, the
+    # callback events and counters for the run, including where the time
+    # went: setupMs is building the agent and prompt, llmMs is waiting on
+    # the LLM and frameworkMs is everything else.
+    start = time.perf_counter()
+
+    with deadline(app_settings.turn_deadline_seconds), span(
+        "turn", backend="langchain"
+    ) as turn_span:
+        if agent is None:
+            agent = create_agent()
+
+        with span("prompt assembly", messages=len(history)):
+            conversation = get_conversation(history)
+            full_prompt = prompt_template.format(
+                human_input=prompt, chat_history=conversation
+            )
+
+        setup_finished = time.perf_counter()
+
+        # A fresh handler per run, so each message only keeps its own events.
+        handler = CustomCallbackHandler(
+            spill_path=app_settings.langchain_event_spill_path
+        )
+        stats_handler = RunStatsCallbackHandler()
+        response = agent.run(
+            input=full_prompt,
+            callbacks=[handler, stats_handler, TracingCallbackHandler()],
+        )
+
+        stats = stats_handler.stats
+        stats["totalMs"] = round((time.perf_counter() - start) * 1000)
+        stats["setupMs"] = round((setup_finished - start) * 1000)
+        stats["frameworkMs"] = stats["totalMs"] - stats["setupMs"] - stats["llmMs"]
+        turn_span.set(**stats)
+
+    return response, handler.get_events(), stats
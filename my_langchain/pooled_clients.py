@@ -0,0 +1,105 @@
+from typing import Any, List, Optional
+
+from langchain.callbacks.manager import (
+    CallbackManagerForLLMRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain.chat_models import AzureChatOpenAI
+from langchain.schema import BaseRetriever, Document
+from langchain.utilities.requests import TextRequestsWrapper
+
+from shared.clients import get_http_session
+from shared.llm_scheduler import estimate_chat_tokens, total_tokens
+
+
+class PooledRequestsWrapper(TextRequestsWrapper):
+    """Sends APIChain GETs through the shared keep-alive session.
+
+    With a backend (see shared/deadlines.py) each GET gets its timeout, and
+    may be hedged.
+    """
+
+    backend: Any = None
+
+    def get(self, url: str, **kwargs: Any) -> str:
+        def get(timeout=None):
+            return get_http_session().get(
+                url, headers=self.headers, timeout=timeout, **kwargs
+            )
+
+        response = get() if self.backend is None else self.backend.call(get)
+        return response.text
+
+
+class SearchClientRetriever(BaseRetriever):
+    """Retriever over a shared azure SearchClient (or LocalHotelIndex).
+
+    AzureCognitiveSearchRetriever opens its own connection for every query,
+    this lets us hand it the process-wide client instead.
+    """
+
+    client: Any
+    top_k: int = 5
+    content_key: str = "Description"
+    # Timeouts (and hedging) for the search, see shared/deadlines.py.
+    backend: Any = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        def search(timeout=None):
+            results = self.client.search(
+                search_text=query,
+                top=self.top_k,
+                connection_timeout=timeout,
+                read_timeout=timeout,
+            )
+            # The results are fetched as we read them, so read them here.
+            return list(results)
+
+        results = search() if self.backend is None else self.backend.call(search)
+        return [
+            Document(page_content=result.pop(self.content_key), metadata=result)
+            for result in results
+        ]
+
+
+class RoutedAzureChatOpenAI(AzureChatOpenAI):
+    """AzureChatOpenAI that sends its calls through a shared DeploymentRouter.
+
+    The router picks the deployment for each call, and its schedulers do the
+    waiting and retrying on 429s (see shared/deployment_router.py), in place
+    of LangChain's own retry loop.  The deployment settings on the model are
+    only used without a router.  With a backend each call's request_timeout
+    is cut down to what's left of the turn, see shared/deadlines.py.
+    """
+
+    router: Any = None
+    backend: Any = None
+
+    def completion_with_retry(
+        self, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any
+    ) -> Any:
+        if self.router is None:
+            return super().completion_with_retry(run_manager=run_manager, **kwargs)
+
+        def create(deployment):
+            def send(timeout=kwargs.get("request_timeout")):
+                return self.client.create(
+                    **{
+                        **kwargs,
+                        "engine": deployment.model,
+                        "api_base": deployment.endpoint,
+                        "api_key": deployment.api_key,
+                        "request_timeout": timeout,
+                    }
+                )
+
+            return send() if self.backend is None else self.backend.call(send)
+
+        return self.router.call(
+            create,
+            estimate_chat_tokens(kwargs.get("messages") or []),
+            # A stream doesn't say, the estimate stands.
+            actual_tokens=None if kwargs.get("stream") else total_tokens,
+        )
@@ -0,0 +1,141 @@
+import numpy as np
+
+# Answers hero questions locally so the LLM gets a handful of rows back
+# instead of all ~90 heroes.  The rows from HeroStatsCache are turned into
+# one array per column, and each operation is a mask plus a sort over those.
+
+ROLES = [
+    "Ranged Assassin",
+    "Melee Assassin",
+    "Healer",
+    "Tank",
+    "Bruiser",
+    "Support",
+]
+
+
+def normalize_role(role):
+    # The LLM isn't always careful about case ("healer", "ranged assassin").
+    if not role:
+        return None
+
+    for known_role in ROLES:
+        if known_role.lower() == role.strip().lower():
+            return known_role
+
+    raise ValueError(f"Unknown role {role}, pick one of {', '.join(ROLES)}.")
+
+
+class HeroStatsTable:
+    def __init__(self, names, roles, win_rates, games_played):
+        self.names = names
+        self.roles = roles
+        self.win_rates = win_rates
+        self.games_played = games_played
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls(
+            names=np.array([row["name"] for row in rows], dtype=object),
+            roles=np.array([row["role"] for row in rows], dtype=object),
+            win_rates=np.array([row["winRate"] for row in rows], dtype=np.float64),
+            games_played=np.array(
+                [row["gamesPlayed"] for row in rows], dtype=np.int64
+            ),
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    def mask(self, role=None, min_games=0, heroes=None):
+        selected = self.games_played >= int(min_games or 0)
+
+        if role:
+            selected &= self.roles == normalize_role(role)
+
+        if heroes:
+            wanted = {name.lower() for name in heroes}
+            selected &= np.array(
+                [name.lower() in wanted for name in self.names], dtype=bool
+            )
+
+        return selected
+
+    def rows(self, indexes):
+        return [
+            {
+                "name": self.names[i],
+                "role": self.roles[i],
+                "winRate": float(self.win_rates[i]),
+                "gamesPlayed": int(self.games_played[i]),
+            }
+            for i in indexes
+        ]
+
+    def top(self, role=None, count=5, min_games=0, worst=False, heroes=None):
+        indexes = np.flatnonzero(self.mask(role, min_games, heroes))
+        win_rates = self.win_rates[indexes]
+        # Ties go to the hero with more games, it's the more reliable number.
+        order = np.lexsort(
+            (-self.games_played[indexes], win_rates if worst else -win_rates)
+        )
+
+        return self.rows(indexes[order[: int(count)]])
+
+    def role_averages(self, min_games=0):
+        selected = self.mask(min_games=min_games)
+        averages = []
+
+        for role in ROLES:
+            in_role = selected & (self.roles == role)
+            games = int(self.games_played[in_role].sum())
+
+            if not in_role.any():
+                continue
+
+            averages.append(
+                {
+                    "role": role,
+                    "heroes": int(in_role.sum()),
+                    "gamesPlayed": games,
+                    # Weighted by games, falling back to a plain mean if there
+                    # are no game counts.
+                    "winRate": float(
+                        np.average(
+                            self.win_rates[in_role],
+                            weights=self.games_played[in_role] if games else None,
+                        )
+                    ),
+                }
+            )
+
+        return sorted(averages, key=lambda a: a["winRate"], reverse=True)
+
+    def compare(self, other, role=None, count=5, min_games=0):
+        # Heroes that moved the most between self (the earlier range) and
+        # other (the later one).  A hero has to meet min_games in both.
+        positions = {name: i for i, name in enumerate(other.names)}
+        mine = np.flatnonzero(self.mask(role, min_games))
+        mine = np.array([i for i in mine if self.names[i] in positions], dtype=np.int64)
+
+        if not len(mine):
+            return []
+
+        theirs = np.array([positions[self.names[i]] for i in mine], dtype=np.int64)
+        keep = other.games_played[theirs] >= int(min_games or 0)
+        mine, theirs = mine[keep], theirs[keep]
+        change = other.win_rates[theirs] - self.win_rates[mine]
+        order = np.argsort(-np.abs(change), kind="stable")[: int(count)]
+
+        return [
+            {
+                "name": self.names[mine[i]],
+                "role": self.roles[mine[i]],
+                "firstWinRate": float(self.win_rates[mine[i]]),
+                "secondWinRate": float(other.win_rates[theirs[i]]),
+                "change": float(change[i]),
+                "firstGamesPlayed": int(self.games_played[mine[i]]),
+                "secondGamesPlayed": int(other.games_played[theirs[i]]),
+            }
+            for i in order
+        ]
@@ -0,0 +1,177 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import date, timedelta
+
+
+# The stats API aggregates over whatever range we ask for, so we can't split a
+# multi-day response back into days.  Instead we ask for one day at a time and
+# keep those rows around, then build any requested range out of cached days.
+# A day fetched after it ended can't change any more, so it never expires.  A
+# day fetched while it was still filling in (today, or later) expires after a
+# TTL, even once it is over, so its partial stats get replaced.
+#
+# Ranges longer than max_range_days would be that many requests, so those are
+# asked for in one go and not cached.
+
+
+def extract_hero_rows(data):
+    # The spec says the API returns an array, but our captured sample wraps it
+    # in {"heroes": [...]}, so accept either shape.
+    rows = data["heroes"] if isinstance(data, dict) else data
+
+    return [
+        {
+            "name": row["name"],
+            "role": row["role"],
+            "winRate": row["winRate"],
+            "gamesPlayed": row.get("gamesPlayed") or 0,
+        }
+        for row in rows
+    ]
+
+
+def combine_hero_rows(days_of_rows):
+    # Win rates are weighted by games played.  If the API didn't give us game
+    # counts for a hero, fall back to a plain average of the daily rates.
+    totals = {}
+
+    for rows in days_of_rows:
+        for row in rows:
+            total = totals.get(row["name"])
+
+            if total is None:
+                total = {
+                    "role": row["role"],
+                    "wins": 0.0,
+                    "games": 0,
+                    "rateSum": 0.0,
+                    "days": 0,
+                }
+                totals[row["name"]] = total
+
+            total["wins"] += row["winRate"] * row["gamesPlayed"]
+            total["games"] += row["gamesPlayed"]
+            total["rateSum"] += row["winRate"]
+            total["days"] += 1
+
+    return [
+        {
+            "name": name,
+            "role": total["role"],
+            "winRate": total["wins"] / total["games"]
+            if total["games"]
+            else total["rateSum"] / total["days"],
+            "gamesPlayed": total["games"],
+        }
+        for name, total in totals.items()
+    ]
+
+
+class HeroStatsCache:
+    def __init__(
+        self, fetch_range, ttl_seconds=300, fetch_workers=8, max_range_days=92
+    ):
+        # fetch_range(start_date, end_date) takes YYYY-MM-DD strings and
+        # returns the decoded JSON from the /hero-stats endpoint.
+        self.fetch_range = fetch_range
+        self.ttl_seconds = ttl_seconds
+        self.fetch_workers = fetch_workers
+        self.max_range_days = max_range_days
+        self.hits = 0
+        self.misses = 0
+        self.range_fetches = 0
+        self._days = {}
+        self._lock = threading.Lock()
+
+    def get_range(self, start_date, end_date):
+        start = date.fromisoformat(start_date)
+        end = date.fromisoformat(end_date)
+
+        if end < start:
+            raise ValueError(f"start_date {start_date} is after end_date {end_date}")
+
+        if (end - start).days + 1 > self.max_range_days:
+            with self._lock:
+                self.range_fetches += 1
+
+            return extract_hero_rows(self.fetch_range(start_date, end_date))
+
+        days = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+        rows_by_day = {}
+        missing = []
+
+        with self._lock:
+            for day in days:
+                rows = self._get_cached_day(day)
+
+                if rows is None:
+                    missing.append(day)
+                else:
+                    rows_by_day[day] = rows
+
+            self.hits += len(days) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            rows_by_day.update(self._fetch_days(missing))
+
+        return combine_hero_rows(rows_by_day[day] for day in days)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cachedDays": len(self._days),
+                "dayHits": self.hits,
+                "dayMisses": self.misses,
+                "rangeFetches": self.range_fetches,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._days.clear()
+
+    def _get_cached_day(self, day):
+        entry = self._days.get(day)
+
+        if entry is None:
+            return None
+
+        rows, fetched_at, complete = entry
+
+        if not complete and time.monotonic() - fetched_at > self.ttl_seconds:
+            del self._days[day]
+            return None
+
+        return rows
+
+    def _fetch_day(self, day):
+        iso_day = day.isoformat()
+        return extract_hero_rows(self.fetch_range(iso_day, iso_day))
+
+    def _fetch_days(self, days):
+        # Before fetching, a day that ends while we wait is still partial.
+        today = date.today()
+
+        if len(days) == 1:
+            fetched = {days[0]: self._fetch_day(days[0])}
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(self.fetch_workers, len(days))
+            ) as executor:
+                # Each in a copy of our context, so they keep the turn's
+                # deadline and their spans nest under ours.
+                futures = [
+                    executor.submit(copy_context().run, self._fetch_day, day)
+                    for day in days
+                ]
+                fetched = {day: f.result() for day, f in zip(days, futures)}
+
+        fetched_at = time.monotonic()
+
+        with self._lock:
+            for day, rows in fetched.items():
+                self._days[day] = (rows, fetched_at, day < today)
+
+        return fetched
@@ -1,232 +1,96 @@
-import json
-
-from dotenv import load_dotenv
 import streamlit as st
-import openai
-import requests
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-
-from settings import AppSettings
-
-load_dotenv()
 
-app_settings = AppSettings()
+from shared.chat_rendering import show_detail, show_paged
+from shared.clients import get_pool_stats
+from shared.deadlines import get_timeout_stats
+from shared.session_log import get_session_id
+from shared.streaming import ThrottledTextWriter
+from my_openai.openai_pipeline import (
+    app_settings,
+    append_to_chat_history,
+    chat_router,
+    create_chat_history,
+    make_llm_call,
+    tool_prefetcher,
+)
 
 st.set_page_config(page_title="Tool Comparison - Raw OpenAI", page_icon="ocelot.ico")
 
-if "chat_history" not in st.session_state:
-    st.session_state["chat_history"] = []
-
-
-def append_to_chat_history(
-    role, content=None, function_call=None, function_name=None, detail=None
-):
-    st.session_state["chat_history"].append(
-        {
-            "role": role,
-            "content": content,
-            "function_call": function_call,
-            "function_name": function_name,
-            "detail": detail,
-        }
-    )
-
-
-def get_heroes_stats(start_date, end_date):
-    url = f"{app_settings.heroes_api_endpoint}/hero-stats"
-    params = {"startDate": start_date, "endDate": end_date}
-    req = requests.get(url, params)
-    return req.json()
-
-
-# https://learn.microsoft.com/en-us/python/api/overview/azure/search-documents-readme?view=azure-python
-
-
-def search_for_hotel_information(query, count=3):
-    credential = AzureKeyCredential(app_settings.search_api_key)
-    client = SearchClient(
-        endpoint=app_settings.search_api_endpoint,
-        index_name=app_settings.search_index,
-        credential=credential,
-    )
-
-    results = list(
-        client.search(
-            search_text=query,
-            top=int(count),
-            select=[
-                "HotelName",
-                "Description",
-                "Address",
-                "Rating",
-                "Rooms",
-            ],
-        )
-    )
-
-    # Trim down the data we return to save on tokens.
-    for result in results:
-        del result["@search.score"]
-        del result["@search.highlights"]
-
-        result["Rooms"] = [
-            {
-                "Description": room["Description"],
-                "BaseRate": room["BaseRate"],
-                "SleepsCount": room["SleepsCount"],
-            }
-            for room in result["Rooms"]
-        ]
-
-    return results
-
-
-# See this link for more about function calling:
-#
-# https://platform.openai.com/docs/api-reference/chat/create
-
-available_functions = [
-    {
-        "name": "get_heroes_winrate_stats",
-        "description": "Pass in a date range and get statistics for all heroes over that date range.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "start_date": {
-                    "type": "string",
-                    "description": "first day of the date range as YYYY-MM-DD",
-                },
-                "end_date": {
-                    "type": "string",
-                    "description": "last day of the date range as YYYY-MM-DD",
-                },
-            },
-            "required": ["start_date", "end_date"],
-        },
-    },
-    {
-        "name": "get_hotel_information",
-        "description": "Perform a search for current information about hotels.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "query": {
-                    "type": "string",
-                    "description": "a query to use to find information about hotels",
-                },
-                "count": {
-                    "type": "string",
-                    "description": "the number of results to find",
-                },
-            },
-            "required": ["query"],
-        },
-    },
-]
-
-# All of these functions return a dictionary created from a JSON response.
-# The data will be serialized and sent back to the LLM.
-map_of_available_functions = {
-    "get_heroes_winrate_stats": get_heroes_stats,
-    "get_hotel_information": search_for_hotel_information,
-}
-
-openai.api_base = app_settings.chat_api_endpoint
-openai.api_type = "azure"
-openai.api_key = app_settings.chat_api_key
-openai.api_version = "2023-07-01-preview"
+if app_settings.chat_history_dir:
+    # Fetched on every rerun, so a session that was evicted is read back and
+    # anything another worker added is picked up.
+    st.session_state["chat_history"] = create_chat_history(get_session_id())
+elif "chat_history" not in st.session_state:
+    st.session_state["chat_history"] = create_chat_history()
 
 
-def show_chat_history():
-    for message in st.session_state["chat_history"]:
-        role = message["role"]
-        content = message.get("content")
-        detail = message.get("detail")
+def show_message(index, message):
+    role = message.role
+    content = message.content
 
-        avatar = None
+    avatar = None
 
-        if role == "system":
-            avatar = "🤖"
+    if role == "system":
+        avatar = "🤖"
 
-        if role == "function":
-            avatar = "⚡"
-            content = "Here's the data you asked for.  (Actual content is serialized JSON, see the detail below.)"
+    if role == "tool":
+        avatar = "⚡"
+        content = "Here's the data you asked for.  (Actual content is serialized JSON, see the detail below.)"
 
-        if content is None:
-            content = "Please call a function for me."
+    if content is None:
+        content = "Please call these functions for me."
 
-        with st.chat_message(name=role, avatar=avatar):
-            st.write(content)
+    with st.chat_message(name=role, avatar=avatar):
+        st.write(content)
 
-        if detail:
-            st.json(detail, expanded=False)
+    show_detail(message, "tool_calls", key=f"tool-calls-{index}")
+    show_detail(message, "detail", key=f"detail-{index}")
+    show_detail(message, "usage", key=f"usage-{index}", label="Show usage")
 
 
-def get_conversation():
-    def make_message(dict):
-        role = dict.get("role")
-        content = dict.get("content")
-        function_call = dict.get("function_call")
-        function_name = dict.get("function_name")
-
-        # content is required, even if it's None
-        message = {"role": role, "content": content}
-
-        if function_call is not None:
-            message["function_call"] = function_call
-
-        if function_name is not None:
-            message["name"] = function_name
+def show_chat_history():
+    show_paged(st.session_state["chat_history"], show_message)
 
-        return message
 
-    return [make_message(m) for m in st.session_state["chat_history"]]
+def new_content_writer():
+    with st.chat_message(name="assistant"):
+        placeholder = st.empty()
 
+    return ThrottledTextWriter(placeholder.write)
 
-def make_llm_call(max_recursion, recursion_count=0):
-    # Protect against the LLM asking for lots of function calls in a row.
-    if recursion_count > max_recursion:
-        raise ValueError("Too many recursive calls to LLM.")
 
-    messages = get_conversation()
-    llm_response = openai.ChatCompletion.create(
-        engine=app_settings.chat_model,
-        messages=messages,
-        functions=available_functions,
-        function_call="auto",
-    )
-    response_message = llm_response.choices[0].message
-    role = response_message["role"]
-    content = response_message.get("content")
-    function_call = response_message.get("function_call")
+prompt = st.chat_input("Ask a question")
 
-    if function_call:
-        function_name = function_call["name"]
-        python_function_to_call = map_of_available_functions[function_name]
-        function_args = json.loads(function_call["arguments"])
-        function_response = python_function_to_call(**function_args)
-        append_to_chat_history(
-            role,
-            function_call=response_message["function_call"],
-            detail=function_call,
-        )
-        append_to_chat_history(
-            "function",
-            content=json.dumps(function_response),
-            function_name=function_name,
-            detail=function_response,
+if prompt:
+    chat_history = st.session_state["chat_history"]
+    append_to_chat_history(chat_history, "user", content=prompt)
+
+    if app_settings.stream_completions:
+        # Draw what we have so far so the answer can stream in underneath,
+        # then start over so everything is drawn from the history.
+        show_chat_history()
+        make_llm_call(
+            chat_history,
+            max_round_trips=6,
+            stream=True,
+            new_content_writer=new_content_writer,
         )
-        make_llm_call(max_recursion, recursion_count + 1)
+        st.rerun()
     else:
-        append_to_chat_history(role, content=content, detail=llm_response)
+        make_llm_call(chat_history, max_round_trips=6)
 
 
-prompt = st.chat_input("Ask a question")
+show_chat_history()
 
-if prompt:
-    append_to_chat_history("user", content=prompt)
-    make_llm_call(max_recursion=5)
+with st.sidebar.expander("Connection pools"):
+    st.json(get_pool_stats())
 
+with st.sidebar.expander("Chat deployments"):
+    st.json(chat_router.get_stats())
 
-show_chat_history()
+with st.sidebar.expander("Timeouts and hedges"):
+    st.json(get_timeout_stats())
+
+if app_settings.speculative_tools:
+    with st.sidebar.expander("Speculative tool calls"):
+        st.json(tool_prefetcher.get_stats())
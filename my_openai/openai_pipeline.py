@@ -0,0 +1,532 @@
+import os
+import time
+
+from dotenv import load_dotenv
+import streamlit as st
+import openai
+
+from settings import AppSettings
+from shared.clients import (
+    get_chat_router,
+    get_hotel_search_client,
+    get_http_session,
+    get_session_registry,
+)
+from shared.deadlines import deadline, get_backend
+from shared.history import fit_to_budget
+from shared.llm_scheduler import estimate_chat_tokens, total_tokens
+from shared.message_store import MessageStore, as_openai_message
+from shared.streaming import collect_stream
+from shared.tracing import span
+from my_openai.hero_analytics import ROLES, HeroStatsTable
+from my_openai.hero_stats_cache import HeroStatsCache
+from my_openai.result_encoding import ToolResultEncoder
+from my_openai.tool_executor import ToolExecutor, as_plain_tool_call
+from my_openai.tool_prefetch import ToolPrefetcher
+
+# Everything the raw OpenAI app does, minus the Streamlit UI, so the same code
+# can be driven headless (see benchmarks/replay.py).  The chat history is a
+# MessageStore from create_chat_history() that the caller owns.
+
+load_dotenv()
+
+app_settings = AppSettings()
+
+# Timeouts for everything we call out to, see shared/deadlines.py.  The
+# lookups are safe to send twice, so they may be hedged.
+heroes_backend = get_backend(
+    "heroes", app_settings.heroes_timeout_seconds, hedge=app_settings.hedge_lookups
+)
+search_backend = get_backend(
+    "search", app_settings.search_timeout_seconds, hedge=app_settings.hedge_lookups
+)
+chat_backend = get_backend("chat", app_settings.chat_timeout_seconds)
+
+
+def append_to_chat_history(
+    history,
+    role,
+    content=None,
+    tool_calls=None,
+    tool_call_id=None,
+    function_name=None,
+    detail=None,
+    completion_id=None,
+    usage=None,
+):
+    history.append(
+        role,
+        content,
+        tool_calls=tool_calls,
+        tool_call_id=tool_call_id,
+        function_name=function_name,
+        detail=detail,
+        completion_id=completion_id,
+        usage=usage,
+    )
+
+
+def fetch_heroes_stats(start_date, end_date):
+    url = f"{app_settings.heroes_api_endpoint}/hero-stats"
+    params = {"startDate": start_date, "endDate": end_date}
+
+    def get(timeout):
+        req = get_http_session().get(url, params=params, timeout=timeout)
+        req.raise_for_status()
+        return req.json()
+
+    return heroes_backend.call(get)
+
+
+# One cache for the whole process, so every session and every rerun shares it.
+@st.cache_resource(show_spinner=False)
+def get_hero_stats_cache():
+    return HeroStatsCache(
+        fetch_heroes_stats, ttl_seconds=app_settings.heroes_cache_ttl_seconds
+    )
+
+
+hero_stats_cache = get_hero_stats_cache()
+
+
+def get_hero_table(start_date, end_date):
+    return HeroStatsTable.from_rows(hero_stats_cache.get_range(start_date, end_date))
+
+
+# The hero tools answer the question here and only hand the LLM the rows it
+# needs, rather than every hero for it to read through.
+
+
+def get_heroes_stats(
+    start_date,
+    end_date,
+    role=None,
+    count=10,
+    min_games=0,
+    order="best",
+    heroes=None,
+):
+    table = get_hero_table(start_date, end_date)
+    return table.top(
+        role=role,
+        count=count,
+        min_games=min_games,
+        worst=order == "worst",
+        heroes=heroes,
+    )
+
+
+def get_role_averages(start_date, end_date, min_games=0):
+    return get_hero_table(start_date, end_date).role_averages(min_games=min_games)
+
+
+def compare_heroes_stats(
+    first_start_date,
+    first_end_date,
+    second_start_date,
+    second_end_date,
+    role=None,
+    count=10,
+    min_games=0,
+):
+    first = get_hero_table(first_start_date, first_end_date)
+    second = get_hero_table(second_start_date, second_end_date)
+    return first.compare(second, role=role, count=count, min_games=min_games)
+
+
+# https://learn.microsoft.com/en-us/python/api/overview/azure/search-documents-readme?view=azure-python
+
+
+def search_for_hotel_information(query, count=3):
+    client = get_hotel_search_client(app_settings)
+
+    def search(timeout):
+        results = client.search(
+            search_text=query,
+            top=int(count),
+            # Only ask for what we send on, to save on tokens.
+            select=[
+                "HotelName",
+                "Description",
+                "Address",
+                "Rating",
+                "Rooms/Description",
+                "Rooms/BaseRate",
+                "Rooms/SleepsCount",
+            ],
+            connection_timeout=timeout,
+            read_timeout=timeout,
+        )
+
+        # The results are fetched as we read them, so read them here.
+        return [
+            {key: value for key, value in result.items() if not key.startswith("@")}
+            for result in results
+        ]
+
+    return search_backend.call(search)
+
+
+# See this link for more about function calling:
+#
+# https://platform.openai.com/docs/api-reference/chat/create
+
+hero_filter_properties = {
+    "role": {
+        "type": "string",
+        "enum": ROLES,
+        "description": "only include heroes with this role",
+    },
+    "count": {
+        "type": "integer",
+        "description": "the number of heroes to return, defaults to 10",
+    },
+    "min_games": {
+        "type": "integer",
+        "description": "leave out heroes with fewer games played than this",
+    },
+}
+
+# We use "tools" rather than the older "functions" parameter so the LLM can ask
+# for more than one call in a single response.
+available_functions = [
+    {
+        "name": "get_heroes_winrate_stats",
+        "description": "Get the heroes with the best (or worst) win rates over a date range, optionally only for one role or for specific heroes.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "start_date": {
+                    "type": "string",
+                    "description": "first day of the date range as YYYY-MM-DD",
+                },
+                "end_date": {
+                    "type": "string",
+                    "description": "last day of the date range as YYYY-MM-DD",
+                },
+                **hero_filter_properties,
+                "order": {
+                    "type": "string",
+                    "enum": ["best", "worst"],
+                    "description": "return the best win rates first, or the worst",
+                },
+                "heroes": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "only return these heroes, by name",
+                },
+            },
+            "required": ["start_date", "end_date"],
+        },
+    },
+    {
+        "name": "get_role_winrate_averages",
+        "description": "Get the average win rate of each hero role over a date range, weighted by games played.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "start_date": {
+                    "type": "string",
+                    "description": "first day of the date range as YYYY-MM-DD",
+                },
+                "end_date": {
+                    "type": "string",
+                    "description": "last day of the date range as YYYY-MM-DD",
+                },
+                "min_games": hero_filter_properties["min_games"],
+            },
+            "required": ["start_date", "end_date"],
+        },
+    },
+    {
+        "name": "compare_heroes_winrates",
+        "description": "Compare two date ranges and get the heroes whose win rates changed the most between them.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "first_start_date": {
+                    "type": "string",
+                    "description": "first day of the earlier date range as YYYY-MM-DD",
+                },
+                "first_end_date": {
+                    "type": "string",
+                    "description": "last day of the earlier date range as YYYY-MM-DD",
+                },
+                "second_start_date": {
+                    "type": "string",
+                    "description": "first day of the later date range as YYYY-MM-DD",
+                },
+                "second_end_date": {
+                    "type": "string",
+                    "description": "last day of the later date range as YYYY-MM-DD",
+                },
+                **hero_filter_properties,
+            },
+            "required": [
+                "first_start_date",
+                "first_end_date",
+                "second_start_date",
+                "second_end_date",
+            ],
+        },
+    },
+    {
+        "name": "get_hotel_information",
+        "description": "Perform a search for current information about hotels.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "a query to use to find information about hotels",
+                },
+                "count": {
+                    "type": "string",
+                    "description": "the number of results to find",
+                },
+            },
+            "required": ["query"],
+        },
+    },
+]
+
+available_tools = [
+    {"type": "function", "function": function} for function in available_functions
+]
+
+# All of these functions return a dictionary created from a JSON response.
+# The data will be serialized and sent back to the LLM.
+map_of_available_functions = {
+    "get_heroes_winrate_stats": get_heroes_stats,
+    "get_role_winrate_averages": get_role_averages,
+    "compare_heroes_winrates": compare_heroes_stats,
+    "get_hotel_information": search_for_hotel_information,
+}
+
+# Seconds to wait for each tool before we give up and tell the LLM it failed.
+tool_timeouts = {
+    "get_heroes_winrate_stats": 20,
+    "get_role_winrate_averages": 20,
+    "compare_heroes_winrates": 30,
+    "get_hotel_information": 10,
+}
+
+# Most tokens a tool result may take up in the prompt, see result_encoding.py.
+tool_token_caps = {
+    "get_heroes_winrate_stats": 600,
+    "get_role_winrate_averages": 300,
+    "compare_heroes_winrates": 800,
+    "get_hotel_information": 1200,
+}
+
+tool_result_encoder = ToolResultEncoder(tool_token_caps)
+
+tool_executor = ToolExecutor(
+    map_of_available_functions, tool_timeouts, encode=tool_result_encoder.encode
+)
+
+# One for the whole process, so its hit and waste rates cover every session.
+@st.cache_resource(show_spinner=False)
+def get_tool_prefetcher():
+    return ToolPrefetcher(
+        tool_executor, hero_stats_cache.get_range, search_for_hotel_information
+    )
+
+
+tool_prefetcher = get_tool_prefetcher()
+
+openai.api_base = app_settings.chat_api_endpoint
+openai.api_type = "azure"
+openai.api_key = app_settings.chat_api_key
+openai.api_version = "2023-12-01-preview"
+
+chat_router = get_chat_router(app_settings)
+
+
+def create_chat_history(session_id=None):
+    # With CHAT_HISTORY_DIR set, each session's history lives on disk.
+    if app_settings.chat_history_dir and session_id:
+        registry = get_session_registry(
+            os.path.join(app_settings.chat_history_dir, "openai"),
+            app_settings.chat_history_max_sessions,
+            as_openai_message,
+        )
+        return registry.get(session_id)
+
+    return MessageStore()
+
+
+def get_conversation(history):
+    with span("prompt assembly") as assembly_span:
+        conversation = history.as_wire(
+            fit_to_budget(history.messages, app_settings.history_token_budget)
+        )
+        assembly_span.set(messages=len(conversation))
+
+    return conversation
+
+
+def call_llm(history, submit=tool_executor.submit):
+    conversation = get_conversation(history)
+
+    with span("llm call", model=app_settings.chat_model) as llm_span:
+        llm_response = chat_router.call(
+            lambda deployment: chat_backend.call(
+                lambda timeout: openai.ChatCompletion.create(
+                    engine=deployment.model,
+                    api_base=deployment.endpoint,
+                    api_key=deployment.api_key,
+                    messages=conversation,
+                    tools=available_tools,
+                    tool_choice="auto",
+                    request_timeout=timeout,
+                )
+            ),
+            estimate_chat_tokens(conversation),
+            actual_tokens=total_tokens,
+        )
+        llm_span.set(usage=llm_response.get("usage"))
+
+    response_message = llm_response.choices[0].message
+    tool_calls = [
+        as_plain_tool_call(tool_call)
+        for tool_call in response_message.get("tool_calls") or []
+    ]
+    pending_calls = [submit(tool_call) for tool_call in tool_calls]
+
+    return (
+        response_message["role"],
+        response_message.get("content"),
+        pending_calls,
+        llm_response["id"],
+        llm_response.get("usage") or {},
+    )
+
+
+def stream_llm_call(history, on_content=None, submit=tool_executor.submit):
+    # Each tool starts as soon as its arguments have finished streaming.
+    pending_calls = []
+    conversation = get_conversation(history)
+
+    with span("llm call", model=app_settings.chat_model, streamed=True) as llm_span:
+        started = time.perf_counter()
+        # A 429 comes back before the first chunk, so only this is retried.
+        chunks = chat_router.call(
+            lambda deployment: chat_backend.call(
+                lambda timeout: openai.ChatCompletion.create(
+                    engine=deployment.model,
+                    api_base=deployment.endpoint,
+                    api_key=deployment.api_key,
+                    messages=conversation,
+                    tools=available_tools,
+                    tool_choice="auto",
+                    stream=True,
+                    # Applies to each chunk as well as the first.
+                    request_timeout=timeout,
+                )
+            ),
+            estimate_chat_tokens(conversation),
+        )
+        streamed = collect_stream(
+            chunks,
+            started,
+            on_content=on_content,
+            on_tool_call=lambda tool_call: pending_calls.append(submit(tool_call)),
+        )
+
+        # Streaming doesn't report usage, Azure sends about one token per chunk.
+        usage = {"completion_tokens": streamed["content_chunks"]}
+        llm_span.set(usage=usage, timeToFirstToken=streamed["time_to_first_token"])
+
+    return streamed["role"], streamed["content"], pending_calls, streamed["id"], usage
+
+
+def make_llm_call(history, max_round_trips, stream=False, new_content_writer=None):
+    # new_content_writer() is called at the start of each streamed completion
+    # and returns the on_content for collect_stream(), which is given each new
+    # piece of content.
+    # Returns counters for the whole turn.
+    stats = {
+        "llmCalls": 0,
+        "toolCalls": 0,
+        "promptTokens": 0,
+        "completionTokens": 0,
+        "toolResultTokens": 0,
+        "toolResultTokensSaved": 0,
+        "toolResultTokensTruncated": 0,
+    }
+    speculation = None
+    submit = tool_executor.submit
+
+    with deadline(app_settings.turn_deadline_seconds), span(
+        "turn", backend="openai"
+    ) as turn_span:
+        if app_settings.speculative_tools and history[-1].role == "user":
+            # Get the tool we expect the LLM to ask for going alongside it.
+            speculation = tool_prefetcher.start(history[-1].content or "")
+            submit = speculation.submit
+
+        try:
+            # Protect against the LLM asking for lots of function calls in a row.
+            for _ in range(max_round_trips):
+                if stream:
+                    on_content = new_content_writer() if new_content_writer else None
+                    role, content, pending_calls, completion_id, usage = (
+                        stream_llm_call(history, on_content, submit)
+                    )
+                else:
+                    role, content, pending_calls, completion_id, usage = call_llm(
+                        history, submit
+                    )
+
+                stats["llmCalls"] += 1
+                stats["promptTokens"] += usage.get("prompt_tokens", 0)
+                stats["completionTokens"] += usage.get("completion_tokens", 0)
+
+                if not pending_calls:
+                    append_to_chat_history(
+                        history,
+                        role,
+                        content=content,
+                        completion_id=completion_id,
+                        usage=dict(usage),
+                    )
+                    return stats
+
+                # Every tool the LLM asked for is already running side by side.
+                # Wait for all of them, then send the results back in the next
+                # completion.
+                tool_calls = [pending.tool_call for pending in pending_calls]
+                stats["toolCalls"] += len(tool_calls)
+                append_to_chat_history(
+                    history,
+                    role,
+                    content=content,
+                    tool_calls=tool_calls,
+                    completion_id=completion_id,
+                    usage=dict(usage),
+                )
+
+                for result in tool_executor.collect(pending_calls):
+                    encoding = result["encoding"] or {}
+                    stats["toolResultTokens"] += encoding.get("tokens", 0)
+                    stats["toolResultTokensSaved"] += encoding.get("savedTokens", 0)
+                    stats["toolResultTokensTruncated"] += encoding.get(
+                        "truncatedTokens", 0
+                    )
+                    append_to_chat_history(
+                        history,
+                        "tool",
+                        content=result["content"],
+                        tool_call_id=result["tool_call_id"],
+                        function_name=result["name"],
+                        detail=result["detail"],
+                    )
+
+            raise ValueError("Too many round trips to LLM.")
+        finally:
+            if speculation is not None:
+                # Whatever the LLM didn't ask for was wasted.
+                stats.update(speculation.finish())
+
+            turn_span.set(**stats)
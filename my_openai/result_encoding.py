@@ -0,0 +1,166 @@
+import json
+
+from shared.history import count_tokens
+
+# Tool results are the biggest part of most prompts, so they are sent back to
+# the LLM in a compact form rather than as plain json.dumps:
+#
+#   - floats are rounded, nobody needs a win rate to 16 places,
+#   - a list of objects that all have the same keys becomes a table,
+#     {"columns": ["name", "winRate"], "rows": [["Alarak", 0.5032], ...]},
+#     so each key is written once rather than once per row (nested lists,
+#     like a hotel's rooms, get the same treatment),
+#   - the result has to fit in a per-tool token cap.  Table rows are dropped
+#     from the end until it does, anything else is cut off, and either way a
+#     marker says what was left out.  Only a cap too small for the marker
+#     itself (a few tokens) is ever exceeded.
+#
+# Every call reports how many bytes and tokens the compact form saved
+# compared to the plain JSON, and separately how many were cut to fit the
+# cap.
+
+DEFAULT_DIGITS = 4
+DEFAULT_MAX_TOKENS = 1000
+
+
+def compact(value, digits=DEFAULT_DIGITS):
+    if isinstance(value, float):
+        return round(value, digits)
+
+    if isinstance(value, dict):
+        return {key: compact(item, digits) for key, item in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        items = [compact(item, digits) for item in value]
+
+        if items and all(isinstance(item, dict) for item in items):
+            columns = list(items[0])
+
+            if all(list(item) == columns for item in items[1:]):
+                return {
+                    "columns": columns,
+                    "rows": [[item[column] for column in columns] for item in items],
+                }
+
+        return items
+
+    return value
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), default=str)
+
+
+def _is_table(value):
+    return isinstance(value, dict) and set(value) == {"columns", "rows"}
+
+
+def truncate_to_tokens(value, max_tokens):
+    # Returns the JSON to send and whether anything was left out.
+    content = _dumps(value)
+
+    if count_tokens(content) <= max_tokens:
+        return content, False
+
+    if _is_table(value):
+        rows = value["rows"]
+        # Find the most rows that fit, the marker itself costs a few tokens.
+        low, high = 0, len(rows)
+
+        while low < high:
+            middle = (low + high + 1) // 2
+            candidate = _dumps(
+                {
+                    **value,
+                    "rows": rows[:middle],
+                    "truncated": f"{len(rows) - middle} of {len(rows)} rows left out",
+                }
+            )
+
+            if count_tokens(candidate) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+
+        table = _dumps(
+            {
+                **value,
+                "rows": rows[:low],
+                "truncated": f"{len(rows) - low} of {len(rows)} rows left out",
+            }
+        )
+
+        # Even no rows can be too much when the columns are long, then we
+        # cut it like anything else.
+        if count_tokens(table) <= max_tokens:
+            return table, True
+
+    return _cut_text(content, max_tokens), True
+
+
+def _cut_text(content, max_tokens):
+    # Not something we can cut cleanly, so cut the text: the longest start of
+    # it that fits along with the marker.  A small cap gets the short marker.
+    markers = [
+        lambda keep: f"...[truncated, {len(content) - keep} more characters]",
+        lambda keep: "...[truncated]",
+    ]
+
+    for marker in markers:
+        if count_tokens(marker(0)) > max_tokens:
+            continue
+
+        low, high = 0, len(content)
+
+        while low < high:
+            middle = (low + high + 1) // 2
+
+            if count_tokens(content[:middle] + marker(middle)) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+
+        return content[:low] + marker(low)
+
+    return markers[-1](0)
+
+
+class ToolResultEncoder:
+    def __init__(
+        self, max_tokens=None, default_max_tokens=DEFAULT_MAX_TOKENS, digits=None
+    ):
+        # max_tokens maps tool names to their token cap.
+        self.max_tokens = max_tokens or {}
+        self.default_max_tokens = default_max_tokens
+        self.digits = DEFAULT_DIGITS if digits is None else digits
+
+    def encode(self, name, value):
+        # Returns the content to send, the compact value (which is what we
+        # keep as the detail), and the savings.
+        raw = json.dumps(value, default=str)
+        compact_value = compact(value, self.digits)
+        content, truncated = truncate_to_tokens(
+            compact_value, self.max_tokens.get(name, self.default_max_tokens)
+        )
+        # What the compact form would have been whole, so the data cut to fit
+        # the cap isn't counted as saved by the encoding.
+        whole = _dumps(compact_value) if truncated else content
+        raw_tokens = count_tokens(raw)
+        whole_tokens = count_tokens(whole)
+        tokens = count_tokens(content)
+
+        return (
+            content,
+            compact_value,
+            {
+                "rawBytes": len(raw),
+                "bytes": len(content),
+                "rawTokens": raw_tokens,
+                "tokens": tokens,
+                "savedBytes": len(raw) - len(whole),
+                "savedTokens": raw_tokens - whole_tokens,
+                "truncated": truncated,
+                "truncatedBytes": len(whole) - len(content),
+                "truncatedTokens": whole_tokens - tokens,
+            },
+        )
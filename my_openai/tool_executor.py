@@ -0,0 +1,139 @@
+import contextvars
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from shared.deadlines import count, remaining
+from shared.tracing import span
+
+# One pool for the whole process.  Streamlit reruns the app script on every
+# interaction, so anything created there would be thrown away each time.
+_pool = None
+_pool_lock = threading.Lock()
+MAX_WORKERS = 16
+
+
+def get_tool_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix="tool-call"
+            )
+
+        return _pool
+
+
+def as_plain_tool_call(tool_call):
+    # The openai objects serialize fine, but we keep plain dicts in the chat
+    # history so they can be sent straight back to the API.
+    return {
+        "id": tool_call["id"],
+        "type": "function",
+        "function": {
+            "name": tool_call["function"]["name"],
+            "arguments": tool_call["function"]["arguments"],
+        },
+    }
+
+
+class PendingToolCall:
+    def __init__(self, tool_call, future, timeout):
+        self.tool_call = tool_call
+        self.future = future
+        self.deadline = time.monotonic() + timeout
+        self.started = time.monotonic()
+
+
+def encode_as_json(name, value):
+    return json.dumps(value), value, None
+
+
+class ToolExecutor:
+    def __init__(self, functions, timeouts=None, default_timeout=30, encode=None):
+        # functions maps the names the LLM knows about to python callables.
+        # timeouts maps the same names to seconds.  encode(name, value)
+        # returns (content, detail, encoding stats), see result_encoding.py.
+        self.functions = functions
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+        self.encode = encode or encode_as_json
+
+    def submit(self, tool_call, after=None):
+        # after is a list of futures to wait for first, see tool_prefetch.py.
+        timeout = self.get_timeout(tool_call["function"]["name"])
+        # Run it in a copy of our context, so its span nests under ours and it
+        # sees the turn's deadline.
+        context = contextvars.copy_context()
+        future = get_tool_pool().submit(context.run, self._call, tool_call, after)
+        return PendingToolCall(tool_call, future, timeout)
+
+    def get_timeout(self, name):
+        # No longer than the turn has left, see shared/deadlines.py.
+        timeout = self.timeouts.get(name, self.default_timeout)
+        left = remaining()
+        return timeout if left is None else min(timeout, left)
+
+    def collect(self, pending_calls):
+        # Every call has been running since it was submitted, so waiting on
+        # them in order costs no more than waiting on the slowest one.
+        return [self._wait(pending) for pending in pending_calls]
+
+    def run(self, tool_calls):
+        return self.collect([self.submit(tool_call) for tool_call in tool_calls])
+
+    def _call(self, tool_call, after=None):
+        name = tool_call["function"]["name"]
+
+        for future in after or []:
+            # Its errors aren't ours, if it failed we'll find out ourselves.
+            try:
+                future.result()
+            except Exception:
+                pass
+
+        python_function_to_call = self.functions.get(name)
+
+        if python_function_to_call is None:
+            raise ValueError(f"Unknown function {name}.")
+
+        function_args = json.loads(tool_call["function"]["arguments"] or "{}")
+
+        with span("tool call", tool=name):
+            return python_function_to_call(**function_args)
+
+    def _wait(self, pending):
+        name = pending.tool_call["function"]["name"]
+        timeout = max(0, pending.deadline - time.monotonic())
+
+        try:
+            function_response = pending.future.result(timeout=timeout)
+            error = None
+        except TimeoutError:
+            # We can't stop a thread that is stuck in a request, but we don't
+            # have to wait for it either.
+            pending.future.cancel()
+            count(name, "timeouts")
+            error = f"{name} timed out."
+        except Exception as e:
+            error = f"{name} failed: {e}"
+
+        if error is not None:
+            # Tell the LLM what went wrong, it can usually work around it.
+            function_response = {"error": error}
+
+        with span("serialization", tool=name) as serialization_span:
+            content, detail, encoding = self.encode(name, function_response)
+            serialization_span.set(encoding=encoding)
+
+        return {
+            "tool_call_id": pending.tool_call["id"],
+            "name": name,
+            "content": content,
+            "detail": detail,
+            "encoding": encoding,
+            "error": error,
+            "elapsed": time.monotonic() - pending.started,
+        }
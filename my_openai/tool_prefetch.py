@@ -0,0 +1,347 @@
+import contextvars
+import json
+import re
+import threading
+from datetime import date
+
+from my_openai.hero_analytics import ROLES
+from my_openai.tool_executor import PendingToolCall, get_tool_pool
+from shared.tracing import span
+
+# Starts the tool we think the LLM is about to ask for at the same time as the
+# first completion, so the tool's latency overlaps the LLM's instead of
+# following it.
+#
+# The guess is made from the user's question alone, with keywords and some
+# date parsing, no LLM:
+#
+#   - a question about heroes or win rates that names its dates ("from
+#     2024-01-01 to 2024-01-07") fetches that range into the hero stats
+#     cache.  All three hero tools read from it, so whichever the LLM picks,
+#     and whatever role or count it passes, a call for days we fetched is a
+#     hit.  It waits for the prefetch rather than asking the API for the same
+#     days again.  Only explicit dates count: the LLM isn't told today's date,
+#     so we can't know what it will make of "last week".  Ranges longer than
+#     MAX_SPECULATIVE_DAYS aren't worth that many requests on a guess.
+#   - a question about hotels runs the search with the question's words.  If
+#     the LLM's query has the same words (give or take stop words and
+#     plurals) the result is used as is.
+#
+# A guess nobody asked for is wasted.  We can't stop a thread that's already
+# running, so it finishes in the background (warming the cache, at least).
+# Hits, misses and waste are counted per process, see get_stats().
+
+HERO_TOOLS = {
+    "get_heroes_winrate_stats": [("start_date", "end_date")],
+    "get_role_winrate_averages": [("start_date", "end_date")],
+    "compare_heroes_winrates": [
+        ("first_start_date", "first_end_date"),
+        ("second_start_date", "second_end_date"),
+    ],
+}
+HOTEL_TOOL = "get_hotel_information"
+DEFAULT_HOTEL_COUNT = 3
+MAX_SPECULATIVE_DAYS = 31
+
+HERO_WORDS = {
+    "hero",
+    "heroes",
+    "winrate",
+    "winrates",
+    "meta",
+    "tier",
+    "healer",
+    "healers",
+    "tank",
+    "tanks",
+    "bruiser",
+    "bruisers",
+    "assassin",
+    "assassins",
+    "support",
+    "supports",
+} | {role.lower() for role in ROLES}
+HOTEL_WORDS = {
+    "hotel",
+    "hotels",
+    "motel",
+    "motels",
+    "inn",
+    "resort",
+    "resorts",
+    "lodging",
+    "accommodation",
+    "accommodations",
+    "suite",
+    "suites",
+}
+STOP_WORDS = {
+    "a",
+    "about",
+    "an",
+    "and",
+    "any",
+    "are",
+    "can",
+    "could",
+    "do",
+    "find",
+    "for",
+    "give",
+    "i",
+    "in",
+    "is",
+    "it",
+    "looking",
+    "me",
+    "near",
+    "of",
+    "on",
+    "please",
+    "search",
+    "show",
+    "some",
+    "tell",
+    "that",
+    "the",
+    "there",
+    "to",
+    "want",
+    "what",
+    "which",
+    "with",
+    "would",
+    "you",
+}
+
+WORD = re.compile(r"[a-z0-9]+")
+SENTENCE = re.compile(r"[.?!;\n]+|\band\b")
+ISO_DATE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+
+
+def parse_date_range(text):
+    # Returns (start, end) for the dates the text names, or None if it names
+    # none or they span more than MAX_SPECULATIVE_DAYS.
+    dates = []
+
+    for match in ISO_DATE.findall(text):
+        try:
+            dates.append(date.fromisoformat(match))
+        except ValueError:
+            pass
+
+    if not dates:
+        return None
+
+    start, end = min(dates), max(dates)
+
+    if (end - start).days + 1 > MAX_SPECULATIVE_DAYS:
+        return None
+
+    return start, end
+
+
+def get_terms(text):
+    # The words that matter for a search, plurals folded, in order.
+    terms = []
+
+    for word in WORD.findall(text.lower()):
+        if word in STOP_WORDS:
+            continue
+
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+
+        if word not in terms:
+            terms.append(word)
+
+    return terms
+
+
+def hotel_key(query, count):
+    try:
+        count = int(count or DEFAULT_HOTEL_COUNT)
+    except ValueError:
+        count = DEFAULT_HOTEL_COUNT
+
+    return frozenset(get_terms(query)), count
+
+
+def guess(prompt):
+    # Returns ("heroes", (start, end)) and/or ("hotels", query) guesses.
+    words = set(WORD.findall(prompt.lower()))
+    guesses = []
+
+    if words & HERO_WORDS or "win rate" in prompt.lower():
+        date_range = parse_date_range(prompt)
+
+        if date_range is not None:
+            guesses.append(("heroes", date_range))
+
+    if words & HOTEL_WORDS:
+        # Only the part of the question about hotels.
+        parts = [
+            part
+            for part in SENTENCE.split(prompt.lower())
+            if set(WORD.findall(part)) & HOTEL_WORDS
+        ]
+        guesses.append(("hotels", " ".join(get_terms(" ".join(parts)))))
+
+    return guesses
+
+
+def _ranges_needed(tool_call):
+    # The (start, end) date ranges a hero tool call reads, or None.
+    name = tool_call["function"]["name"]
+
+    if name not in HERO_TOOLS:
+        return None
+
+    try:
+        arguments = json.loads(tool_call["function"]["arguments"] or "{}")
+        return [
+            (date.fromisoformat(arguments[start]), date.fromisoformat(arguments[end]))
+            for start, end in HERO_TOOLS[name]
+        ]
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class Speculation:
+    # The guesses for one turn.  submit() stands in for ToolExecutor.submit.
+
+    def __init__(self, prefetcher, hero_ranges, hotel_searches):
+        self.prefetcher = prefetcher
+        # [((start, end), future)] and {hotel key: future}
+        self.hero_ranges = hero_ranges
+        self.hotel_searches = hotel_searches
+        self.used = set()
+
+    @property
+    def guesses(self):
+        return len(self.hero_ranges) + len(self.hotel_searches)
+
+    def submit(self, tool_call):
+        executor = self.prefetcher.executor
+        name = tool_call["function"]["name"]
+
+        if name == HOTEL_TOOL:
+            try:
+                arguments = json.loads(tool_call["function"]["arguments"] or "{}")
+                key = hotel_key(arguments.get("query") or "", arguments.get("count"))
+            except ValueError:
+                key = None
+
+            future = self.hotel_searches.get(key)
+
+            if future is not None:
+                self._hit(key)
+                return PendingToolCall(
+                    tool_call, future, executor.get_timeout(name)
+                )
+
+        ranges = _ranges_needed(tool_call)
+
+        if ranges is not None:
+            covering = [self._covering(start, end) for start, end in ranges]
+
+            if all(future is not None for future in covering):
+                for future in covering:
+                    self._hit(future)
+
+                # The days are (or soon will be) cached, wait for them rather
+                # than fetching them again.
+                return executor.submit(tool_call, after=covering)
+
+        self.prefetcher.count("missed")
+        return executor.submit(tool_call)
+
+    def finish(self):
+        # Anything nobody asked for was wasted.  Returns the turn's counts.
+        futures = [future for _, future in self.hero_ranges]
+        futures += self.hotel_searches.values()
+        wasted = 0
+
+        for future in futures:
+            if id(future) not in self.used:
+                # Only stops it if it hasn't started yet.
+                future.cancel()
+                wasted += 1
+
+        self.prefetcher.count("wasted", wasted)
+        return {
+            "speculated": self.guesses,
+            "speculationHits": self.guesses - wasted,
+            "speculationWasted": wasted,
+        }
+
+    def _covering(self, start, end):
+        for (fetched_start, fetched_end), future in self.hero_ranges:
+            if fetched_start <= start and end <= fetched_end:
+                return future
+
+        return None
+
+    def _hit(self, key_or_future):
+        future = self.hotel_searches.get(key_or_future, key_or_future)
+
+        if id(future) not in self.used:
+            self.used.add(id(future))
+            self.prefetcher.count("hits")
+
+
+class ToolPrefetcher:
+    def __init__(self, executor, fetch_hero_range, search_hotels):
+        # fetch_hero_range(start_date, end_date) warms the hero stats cache,
+        # search_hotels(query, count) is the hotel tool itself.
+        self.executor = executor
+        self.fetch_hero_range = fetch_hero_range
+        self.search_hotels = search_hotels
+        self.stats = {"turns": 0, "guesses": 0, "hits": 0, "wasted": 0, "missed": 0}
+        self._lock = threading.Lock()
+
+    def start(self, prompt):
+        hero_ranges = []
+        hotel_searches = {}
+
+        for kind, value in guess(prompt):
+            if kind == "heroes":
+                start, end = value
+                future = self._run(
+                    "heroes", self.fetch_hero_range, start.isoformat(), end.isoformat()
+                )
+                hero_ranges.append((value, future))
+            else:
+                key = hotel_key(value, DEFAULT_HOTEL_COUNT)
+                hotel_searches[key] = self._run(
+                    "hotels", self.search_hotels, value, DEFAULT_HOTEL_COUNT
+                )
+
+        speculation = Speculation(self, hero_ranges, hotel_searches)
+        self.count("turns")
+        self.count("guesses", speculation.guesses)
+        return speculation
+
+    def _run(self, kind, function, *args):
+        def call():
+            with span("speculative tool call", kind=kind):
+                return function(*args)
+
+        # In a copy of our context, so its span nests under the turn.
+        context = contextvars.copy_context()
+        return get_tool_pool().submit(context.run, call)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def get_stats(self):
+        with self._lock:
+            guesses = self.stats["guesses"]
+            return {
+                **self.stats,
+                "hitRate": round(self.stats["hits"] / guesses, 3) if guesses else None,
+                "wasteRate": round(self.stats["wasted"] / guesses, 3)
+                if guesses
+                else None,
+            }
@@ -0,0 +1,48 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Compiling a semantic function parses its template and sets up the request
+# settings, which we don't want to pay for on every message.  This keeps the
+# compiled functions in an LRU, keyed by template and settings.
+
+
+class SemanticFunctionCache:
+    def __init__(self, kernel, max_size=64):
+        self.kernel = kernel
+        self.max_size = max_size
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "compileMs": 0.0}
+        self._functions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, template, **settings):
+        key = (template, tuple(sorted(settings.items())))
+
+        with self._lock:
+            function = self._functions.get(key)
+
+            if function is not None:
+                self._functions.move_to_end(key)
+                self.stats["hits"] += 1
+                return function
+
+        # Compile outside the lock, two sessions compiling the same template
+        # at once just means one of them gets thrown away.
+        start = time.perf_counter()
+        function = self.kernel.create_semantic_function(template, **settings)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self.stats["misses"] += 1
+            self.stats["compileMs"] += compile_ms
+            self._functions[key] = function
+
+            while len(self._functions) > self.max_size:
+                self._functions.popitem(last=False)
+                self.stats["evictions"] += 1
+
+        return function
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "size": len(self._functions)}
@@ -1,24 +1,89 @@
 import logging
-import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
 
+# Logs are captured per kernel invocation: wrap the call in
+# `with handler.capture() as capture:` and everything logged inside it (on
+# that thread or its asyncio tasks) lands in capture, not anywhere else.
+# Records are stored as small dicts and both buffers are bounded, so a long
+# running server doesn't keep every record it has ever seen.
 
-class InMemoryHandler(logging.Handler):
-    messages = []
+MAX_RECORDS = 500
+MAX_MESSAGE_CHARS = 500
+
+_current_capture = ContextVar("in_memory_log_capture", default=None)
+
+
+class LogCapture:
+    def __init__(self, max_records=MAX_RECORDS):
+        self.records = deque(maxlen=max_records)
+        self.dropped_records = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            if len(self.records) == self.records.maxlen:
+                self.dropped_records += 1
+
+            self.records.append(record)
+
+    def get_logs(self):
+        with self._lock:
+            return list(self.records)
 
-    def __init__(self):
+
+class InMemoryHandler(logging.Handler):
+    def __init__(self, max_records=MAX_RECORDS, max_message_chars=MAX_MESSAGE_CHARS):
         super().__init__()
+        self.max_records = max_records
+        self.max_message_chars = max_message_chars
+        # Anything logged outside of a capture.
+        self.uncaptured = LogCapture(max_records)
 
     def emit(self, record):
-        self.messages.append(record)
+        capture = _current_capture.get() or self.uncaptured
+        message = record.getMessage()
+
+        if len(message) > self.max_message_chars:
+            message = f"{message[: self.max_message_chars]}... ({len(message)} chars)"
+
+        capture.add(
+            {
+                "atMs": round((record.created - capture.started) * 1000),
+                "level": record.levelname,
+                "logger": record.name,
+                "message": message,
+            }
+        )
+
+    @contextmanager
+    def capture(self):
+        capture = LogCapture(self.max_records)
+        token = _current_capture.set(capture)
+
+        try:
+            yield capture
+        finally:
+            _current_capture.reset(token)
 
     def get_logs(self):
-        return self.messages
+        return self.uncaptured.get_logs()
 
 
 def get_in_memory_logger():
     logger = logging.getLogger("json_logger")
     logger.setLevel(logging.DEBUG)
 
+    # Streamlit reruns call this over and over, only ever attach one handler
+    # or every record gets stored once per rerun.
+    for handler in logger.handlers:
+        if isinstance(handler, InMemoryHandler):
+            return logger, handler
+
     in_memory_handler = InMemoryHandler()
     logger.addHandler(in_memory_handler)
 
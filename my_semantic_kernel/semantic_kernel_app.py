@@ -1,74 +1,59 @@
-from dotenv import load_dotenv
-
-load_dotenv()
-
 import streamlit as st
-import semantic_kernel as sk
-from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
 
-from settings import AppSettings
-from my_semantic_kernel.in_memory_logger import get_in_memory_logger
-
-app_settings = AppSettings()
+from my_semantic_kernel.semantic_kernel_pipeline import (
+    app_settings,
+    append_to_chat_history,
+    chat_router,
+    create_chat_history,
+    function_caches,
+    run_prompt,
+)
+from shared.chat_rendering import show_detail, show_paged
+from shared.deadlines import get_timeout_stats
+from shared.session_log import get_session_id
 
 st.set_page_config(
     page_title="Tool Comparison - Semantic Kernel", page_icon="ocelot.ico"
 )
 
-if "chat_history" not in st.session_state:
-    st.session_state["chat_history"] = []
+if app_settings.chat_history_dir:
+    # Fetched on every rerun, so a session that was evicted is read back and
+    # anything another worker added is picked up.
+    st.session_state["chat_history"] = create_chat_history(get_session_id())
+elif "chat_history" not in st.session_state:
+    st.session_state["chat_history"] = create_chat_history()
 
-logger, handler = get_in_memory_logger()
 
-kernel = sk.Kernel(log=logger)
-kernel.add_chat_service(
-    "chat",
-    AzureChatCompletion(
-        "ocelot-gpt4", app_settings.chat_api_endpoint, app_settings.chat_api_key
-    ),
-)
-
-
-def show_chat_history():
-    for message in st.session_state["chat_history"]:
-        role = message["role"]
-        content = message["content"]
-        logs = message["logs"]
+def show_message(index, message):
+    with st.chat_message(name=message.role):
+        st.write(message.content)
 
-        with st.chat_message(name=role):
-            st.write(content)
+    show_detail(message, "detail", key=f"logs-{index}", label="Show logs")
 
-        if logs:
-            st.json(logs, expanded=False)
 
-
-def append_to_chat_history(role, content, logs=None):
-    st.session_state["chat_history"].append(
-        {
-            "role": role,
-            "content": content,
-            "logs": logs,
-        }
-    )
-
-
-def get_conversation():
-    return [
-        {"role": m["role"], "content": m["content"]}
-        for m in st.session_state["chat_history"]
-    ]
+def show_chat_history():
+    show_paged(st.session_state["chat_history"], show_message)
 
 
 prompt = st.chat_input("Ask a question")
 
 if prompt:
-    append_to_chat_history("user", prompt)
+    chat_history = st.session_state["chat_history"]
 
-    prompt_fn = kernel.create_semantic_function(prompt)
-    llm_response = prompt_fn()
+    # The history holds the earlier turns, the prompt goes in separately.
+    response, logs, _ = run_prompt(chat_history, prompt)
     role = "assistant"
-    response = llm_response.result
 
-    append_to_chat_history(role, response, handler.get_logs())
+    append_to_chat_history(chat_history, "user", prompt)
+    append_to_chat_history(chat_history, role, response, logs)
 
 show_chat_history()
+
+with st.sidebar.expander("Compiled functions"):
+    st.json({name: cache.get_stats() for name, cache in function_caches.items()})
+
+with st.sidebar.expander("Chat deployments"):
+    st.json(chat_router.get_stats())
+
+with st.sidebar.expander("Timeouts and hedges"):
+    st.json(get_timeout_stats())
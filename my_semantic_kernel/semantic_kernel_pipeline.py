@@ -0,0 +1,135 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import streamlit as st
+import semantic_kernel as sk
+from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
+from semantic_kernel.orchestration.context_variables import ContextVariables
+
+from settings import AppSettings
+from shared.clients import get_chat_router, get_session_registry
+from shared.deadlines import deadline, get_backend
+from shared.deployment_router import should_fail_over
+from shared.history import fit_to_budget
+from shared.llm_scheduler import estimate_chat_tokens
+from shared.message_store import MessageStore
+from shared.tracing import span
+from my_semantic_kernel.function_cache import SemanticFunctionCache
+from my_semantic_kernel.in_memory_logger import get_in_memory_logger
+
+# Everything the Semantic Kernel app does, minus the Streamlit UI, so the same
+# code can be driven headless (see benchmarks/replay.py).  The chat history is
+# a MessageStore from create_chat_history() that the caller owns.
+
+app_settings = AppSettings()
+
+# The user's text goes in as a variable, never as part of the template, so
+# it isn't parsed as one and the same compiled function serves every message.
+CHAT_TEMPLATE = """{{$history}}
+user: {{$input}}
+assistant:"""
+
+logger, handler = get_in_memory_logger()
+
+
+chat_router = get_chat_router(app_settings)
+
+# The kernel's chat service takes no timeout, so we stop waiting for it
+# instead, see shared/deadlines.py.
+chat_backend = get_backend("chat", app_settings.chat_timeout_seconds)
+
+
+# A kernel's chat service is tied to one deployment, and the functions it
+# compiles to that service, so each deployment gets its own kernel and function
+# cache, shared by the whole process.  The router picks which one to use.
+@st.cache_resource(show_spinner=False)
+def get_kernel(model, endpoint, api_key):
+    kernel = sk.Kernel(log=logger)
+    kernel.add_chat_service("chat", AzureChatCompletion(model, endpoint, api_key))
+
+    return kernel, SemanticFunctionCache(kernel)
+
+
+function_caches = {
+    deployment.name: get_kernel(
+        deployment.model, deployment.endpoint, deployment.api_key
+    )[1]
+    for deployment in chat_router.deployments
+}
+
+
+def append_to_chat_history(history, role, content, logs=None):
+    history.append(role, content, detail=logs)
+
+
+# The kernel takes the conversation as text, one line per message.
+def as_transcript_line(message):
+    return f"{message.role}: {message.content}"
+
+
+def create_chat_history(session_id=None):
+    # With CHAT_HISTORY_DIR set, each session's history lives on disk.
+    if app_settings.chat_history_dir and session_id:
+        registry = get_session_registry(
+            os.path.join(app_settings.chat_history_dir, "semantic-kernel"),
+            app_settings.chat_history_max_sessions,
+            as_transcript_line,
+        )
+        return registry.get(session_id)
+
+    return MessageStore(to_wire=as_transcript_line)
+
+
+def get_conversation(history):
+    return history.as_wire(
+        fit_to_budget(history.messages, app_settings.history_token_budget)
+    )
+
+
+def invoke(deployment, variables):
+    # The kernel catches errors and hands them back on the context, raise a
+    # 429 or an outage again so the router sees it and retries or fails over.
+    chat_function = function_caches[deployment.name].get(CHAT_TEMPLATE)
+    context = chat_function(variables=variables)
+
+    if context.error_occurred and should_fail_over(context.last_exception):
+        raise context.last_exception
+
+    return context
+
+
+def run_prompt(history, prompt):
+    # history holds the turns before this prompt.  Returns the response, the
+    # kernel logs and counters for the run.  The kernel doesn't call any tools
+    # and doesn't report usage back to us.
+    with deadline(app_settings.turn_deadline_seconds), span(
+        "turn", backend="semantic-kernel"
+    ) as turn_span:
+        with span("prompt assembly", messages=len(history)):
+            variables = ContextVariables()
+            variables["history"] = "\n".join(get_conversation(history))
+            variables["input"] = prompt
+
+        with span("llm call"), handler.capture() as capture:
+            llm_response = chat_router.call(
+                lambda deployment: chat_backend.call_bounded(
+                    lambda: invoke(deployment, variables)
+                ),
+                estimate_chat_tokens([variables["history"], prompt]),
+            )
+
+        stats = {
+            "llmCalls": 1,
+            "toolCalls": 0,
+            "promptTokens": 0,
+            "completionTokens": 0,
+            "functionCache": {
+                name: cache.get_stats() for name, cache in function_caches.items()
+            },
+        }
+        turn_span.set(**stats)
+
+    return llm_response.result, capture.get_logs(), stats
@@ -1,24 +1,139 @@
+import json
 import os
 
 
+def parse_chat_deployments(value, default):
+    # CHAT_DEPLOYMENTS is a JSON list of deployments, each like default
+    # (name, endpoint, apiKey, model, tokensPerMinute, requestsPerMinute)
+    # with anything it leaves out taken from default.  Unset is just default.
+    # See shared/deployment_router.py.
+    deployments = []
+
+    for entry in json.loads(value) if value else [{}]:
+        deployment = {**default, **entry}
+
+        if "name" not in entry:
+            deployment["name"] = deployment["model"]
+
+        deployments.append(deployment)
+
+    names = [deployment["name"] for deployment in deployments]
+
+    if len(set(names)) != len(names):
+        raise ValueError(f"CHAT_DEPLOYMENTS needs a different name for each: {names}")
+
+    return deployments
+
+
+def parse_stream_completions(value):
+    # STREAM_COMPLETIONS, off unless it's "true", so answers arrive whole
+    # the way they always have.  See shared/streaming.py.
+    return (value or "false").lower() == "true"
+
+
 class AppSettings:
     chat_api_endpoint: str
     chat_api_type: str
     chat_api_key: str
     chat_model: str
+    chat_tokens_per_minute: int
+    chat_requests_per_minute: int
+    chat_max_retries: int
+    chat_deployments: list
 
     search_api_endpoint: str
     search_index: str
     search_api_key: str
+    hotel_search_backend: str
+    hotel_snapshot_path: str
 
     heroes_api_endpoint: str
+    heroes_cache_ttl_seconds: int
+    heroes_timeout_seconds: float
+    search_timeout_seconds: float
+    chat_timeout_seconds: float
+    turn_deadline_seconds: float
+    hedge_lookups: bool
+    speculative_tools: bool
+
+    stream_completions: bool
+    history_token_budget: int
+
+    chat_history_dir: str
+    chat_history_max_sessions: int
+
+    langchain_event_spill_path: str
+    langchain_debug: bool
 
     def __init__(self):
         self.chat_api_endpoint = os.environ["CHAT_API_ENDPOINT"]
         self.chat_api_type = os.environ["CHAT_API_TYPE"]
         self.chat_api_key = os.environ["CHAT_API_KEY"]
         self.chat_model = os.environ["CHAT_MODEL"]
+        # This process's share of the deployment's quota, 0 doesn't limit.
+        # See shared/llm_scheduler.py.
+        self.chat_tokens_per_minute = int(os.environ.get("CHAT_TOKENS_PER_MINUTE", "0"))
+        self.chat_requests_per_minute = int(
+            os.environ.get("CHAT_REQUESTS_PER_MINUTE", "0")
+        )
+        self.chat_max_retries = int(os.environ.get("CHAT_MAX_RETRIES", "5"))
+        self.chat_deployments = parse_chat_deployments(
+            os.environ.get("CHAT_DEPLOYMENTS"),
+            {
+                "name": self.chat_model,
+                "endpoint": self.chat_api_endpoint,
+                "apiKey": self.chat_api_key,
+                "model": self.chat_model,
+                "tokensPerMinute": self.chat_tokens_per_minute,
+                "requestsPerMinute": self.chat_requests_per_minute,
+            },
+        )
         self.search_api_endpoint = os.environ["SEARCH_API_ENDPOINT"]
         self.search_api_key = os.environ["SEARCH_API_KEY"]
         self.search_index = os.environ["SEARCH_INDEX"]
+        # "azure" or "local", see shared/local_hotel_index.py.
+        self.hotel_search_backend = os.environ.get("HOTEL_SEARCH_BACKEND", "azure")
+        self.hotel_snapshot_path = os.environ.get(
+            "HOTEL_SNAPSHOT_PATH", "resources/hotels_snapshot.json"
+        )
         self.heroes_api_endpoint = os.environ["HEROES_API_ENDPOINT"]
+        self.heroes_cache_ttl_seconds = int(
+            os.environ.get("HEROES_CACHE_TTL_SECONDS", "300")
+        )
+        # How long each backend gets, and each user turn in all, see
+        # shared/deadlines.py.
+        self.heroes_timeout_seconds = float(
+            os.environ.get("HEROES_TIMEOUT_SECONDS", "10")
+        )
+        self.search_timeout_seconds = float(
+            os.environ.get("SEARCH_TIMEOUT_SECONDS", "10")
+        )
+        self.chat_timeout_seconds = float(os.environ.get("CHAT_TIMEOUT_SECONDS", "60"))
+        self.turn_deadline_seconds = float(
+            os.environ.get("TURN_DEADLINE_SECONDS", "120")
+        )
+        # Send a second hero stats or hotel search request when the first is
+        # slower than usual.
+        self.hedge_lookups = (
+            os.environ.get("HEDGE_LOOKUPS", "false").lower() == "true"
+        )
+        # Start likely tool calls with the first completion, see
+        # my_openai/tool_prefetch.py.
+        self.speculative_tools = (
+            os.environ.get("SPECULATIVE_TOOLS", "false").lower() == "true"
+        )
+        self.stream_completions = parse_stream_completions(
+            os.environ.get("STREAM_COMPLETIONS")
+        )
+        self.history_token_budget = int(
+            os.environ.get("HISTORY_TOKEN_BUDGET", "3000")
+        )
+        # Unset keeps chat history in memory, see shared/session_log.py.
+        self.chat_history_dir = os.environ.get("CHAT_HISTORY_DIR")
+        self.chat_history_max_sessions = int(
+            os.environ.get("CHAT_HISTORY_MAX_SESSIONS", "100")
+        )
+        self.langchain_event_spill_path = os.environ.get("LANGCHAIN_EVENT_SPILL_PATH")
+        self.langchain_debug = (
+            os.environ.get("LANGCHAIN_DEBUG", "false").lower() == "true"
+        )
@@ -0,0 +1,71 @@
+import json
+
+import streamlit as st
+
+from shared.tracing import span
+
+# Helpers for drawing a chat history without redrawing all of it on every
+# rerun:
+#
+#   - show_paged only draws the last few turns, with a button to load older
+#     ones a page at a time, and only looks at the messages it draws,
+#   - show_detail puts the JSON behind a toggle, so nothing is serialized or
+#     sent to the browser until someone asks for it,
+#   - get_detail_json serializes a message's detail once and keeps the text
+#     on the message, finished messages don't change so it never goes stale,
+#   - fragment reruns just one message when something inside it (like a
+#     feedback button) is clicked, on Streamlit versions that support it.
+
+DEFAULT_PAGE_TURNS = 10
+
+fragment = (
+    getattr(st, "fragment", None)
+    or getattr(st, "experimental_fragment", None)
+    or (lambda function: function)
+)
+
+
+def _show_more(shown_key, page_turns):
+    st.session_state[shown_key] += page_turns
+
+
+def show_paged(history, show_message, key="chat_history", page_turns=None):
+    # show_message(index, message) draws one message, index is stable so it
+    # can be used in widget keys.
+    page_turns = page_turns or DEFAULT_PAGE_TURNS
+    shown_key = f"{key}_shown_turns"
+    shown_turns = st.session_state.setdefault(shown_key, page_turns)
+    # From the store's index, so the hidden turns are never decoded.
+    turn_starts = history.turn_starts()
+    hidden_turns = max(0, len(turn_starts) - shown_turns)
+    start = turn_starts[hidden_turns] if hidden_turns else 0
+
+    if hidden_turns:
+        st.button(
+            f"Load older messages ({hidden_turns} earlier questions)",
+            on_click=_show_more,
+            args=(shown_key, page_turns),
+            key=f"{key}_load_older",
+        )
+
+    with span("rendering", messages=len(history) - start):
+        for index in range(start, len(history)):
+            show_message(index, history[index])
+
+
+def get_detail_json(message, field):
+    if message.rendered is None:
+        message.rendered = {}
+
+    if field not in message.rendered:
+        message.rendered[field] = json.dumps(getattr(message, field), default=str)
+
+    return message.rendered[field]
+
+
+def show_detail(message, field, key, label="Show details"):
+    if not getattr(message, field):
+        return
+
+    if st.toggle(label, key=key):
+        st.json(get_detail_json(message, field), expanded=False)
@@ -0,0 +1,169 @@
+import threading
+import time
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import RequestsTransport
+from azure.search.documents import SearchClient
+
+from shared.deadlines import remaining
+from shared.deployment_router import DeploymentRouter
+from shared.local_hotel_index import LocalHotelIndex
+from shared.message_store import as_openai_message
+from shared.session_log import SessionRegistry
+
+# How many hosts we keep pools for, and how many connections we allow per
+# host.  Streamlit serves every session from one process, so the per-host
+# size is roughly "how many tool calls can be in flight at once".  The pools
+# block: a request that finds all of them busy waits for one to come back
+# rather than opening a connection we'd throw away afterwards, and that wait
+# is what waitSeconds measures.  It's no longer than POOL_TIMEOUT_SECONDS, or
+# what the turn has left (see shared/deadlines.py).
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 32
+POOL_TIMEOUT_SECONDS = 10
+
+# Counters per host, shared by every pool in the process.
+_pool_stats = {}
+_pool_stats_lock = threading.Lock()
+
+
+def _record(host, new_connection=False, checkout=False, wait=0.0):
+    with _pool_stats_lock:
+        stats = _pool_stats.get(host)
+
+        if stats is None:
+            stats = {
+                "checkouts": 0,
+                "newConnections": 0,
+                "waitSeconds": 0.0,
+                "maxWaitSeconds": 0.0,
+            }
+            _pool_stats[host] = stats
+
+        if new_connection:
+            stats["newConnections"] += 1
+
+        if checkout:
+            stats["checkouts"] += 1
+            stats["waitSeconds"] += wait
+            stats["maxWaitSeconds"] = max(stats["maxWaitSeconds"], wait)
+
+
+class _TimedPoolMixin:
+    def _get_conn(self, timeout=None):
+        if timeout is None:
+            left = remaining()
+            timeout = POOL_TIMEOUT_SECONDS
+            timeout = timeout if left is None else max(0, min(timeout, left))
+
+        start = time.perf_counter()
+
+        try:
+            return super()._get_conn(timeout=timeout)
+        finally:
+            # Waits that ran out count too, they're the longest ones.
+            _record(self.host, checkout=True, wait=time.perf_counter() - start)
+
+    def _new_conn(self):
+        _record(self.host, new_connection=True)
+        return super()._new_conn()
+
+
+class TimedHTTPConnectionPool(_TimedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class TimedHTTPSConnectionPool(_TimedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+def create_http_session():
+    session = requests.Session()
+    adapter = PooledHTTPAdapter(
+        pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, pool_block=True
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# st.cache_resource keeps these alive across reruns and across sessions, so we
+# only pay for TCP/TLS setup the first time we talk to a host.
+@st.cache_resource(show_spinner=False)
+def get_http_session():
+    return create_http_session()
+
+
+@st.cache_resource(show_spinner=False)
+def get_search_client(endpoint, index_name, api_key):
+    # Route the SDK through our session so search traffic shares the pool
+    # (and shows up in the pool stats).
+    return SearchClient(
+        endpoint=endpoint,
+        index_name=index_name,
+        credential=AzureKeyCredential(api_key),
+        transport=RequestsTransport(session=get_http_session(), session_owner=False),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_local_hotel_index(snapshot_path):
+    return LocalHotelIndex.from_snapshot(snapshot_path)
+
+
+# One router for the whole process, shared by every session, so they all see
+# the same latencies, quotas and circuits.
+@st.cache_resource(show_spinner=False)
+def get_deployment_router(configs, max_retries):
+    return DeploymentRouter(configs, max_retries)
+
+
+def get_chat_router(app_settings):
+    return get_deployment_router(
+        app_settings.chat_deployments, app_settings.chat_max_retries
+    )
+
+
+# One session registry per directory for the whole process.  to_wire isn't
+# part of the cache key (that's the leading underscore), each app has its own
+# directory.
+@st.cache_resource(show_spinner=False)
+def get_session_registry(directory, max_sessions, _to_wire=as_openai_message):
+    return SessionRegistry(directory, _to_wire, max_sessions)
+
+
+def get_hotel_search_client(app_settings):
+    # Both have the same search(), callers don't need to know which they got.
+    if app_settings.hotel_search_backend == "local":
+        return get_local_hotel_index(app_settings.hotel_snapshot_path)
+
+    return get_search_client(
+        app_settings.search_api_endpoint,
+        app_settings.search_index,
+        app_settings.search_api_key,
+    )
+
+
+def get_pool_stats():
+    # A checkout that didn't need a new connection reused a kept-alive one.
+    with _pool_stats_lock:
+        return {
+            host: {
+                **stats,
+                "reuses": max(0, stats["checkouts"] - stats["newConnections"]),
+            }
+            for host, stats in _pool_stats.items()
+        }
@@ -0,0 +1,289 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+from shared.tracing import span
+
+# Keeps one slow backend from holding a session (and a worker) forever.
+#
+# Each user turn runs under a deadline:
+#
+#   with deadline(app_settings.turn_deadline_seconds):
+#       ...
+#
+# It's kept in a ContextVar, so the tool and LLM calls the turn makes see it
+# without it being passed along (the tool pool runs each call in a copy of
+# the caller's context).  Nested deadlines only ever get shorter.
+#
+# Every backend we call out to has its own timeout too:
+#
+#   heroes = get_backend("heroes", 10, hedge=True)
+#   rows = heroes.call(lambda timeout: session.get(url, timeout=timeout).json())
+#
+# The function is given whichever is shorter, the backend's timeout or what
+# is left of the deadline, and a call made after the deadline has passed
+# fails with DeadlineExceeded without being sent.
+#
+# Lookups that are safe to repeat can be hedged.  If an attempt is still
+# running after the backend's recent p95 latency (of every attempt, failed
+# and timed out ones too), a second one is sent and whichever answers first
+# wins.  The loser can't be stopped, it just finishes
+# in the background.  Our p99 is set by the odd request that gets stuck, and a
+# second try usually isn't stuck.  Hedging waits for HEDGE_MIN_SAMPLES
+# latencies first, so there's a p95 to go on.
+#
+# A client that takes no timeout of its own (Semantic Kernel's) goes through
+# call_bounded() instead: the call runs on another thread and we stop waiting
+# for it when its time is up.  The thread can't be stopped, but the session
+# (and its worker) can move on.
+#
+# get_timeout_stats() has the timeouts, deadline misses and hedges for every
+# backend.
+
+HEDGE_MIN_SAMPLES = 20
+RECENT_LATENCIES = 200
+HEDGE_WORKERS = 16
+BOUNDED_WORKERS = 16
+
+# Timeouts from requests, urllib3, azure-core and openai, by class name so we
+# don't depend on which of them raised it.
+TIMEOUT_ERRORS = {
+    "DeadlineExceeded",
+    "TimeoutError",
+    "Timeout",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "ServiceRequestTimeoutError",
+    "ServiceResponseTimeoutError",
+}
+
+_deadline = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def deadline(seconds):
+    # None (or 0) leaves whatever deadline there already is.
+    if not seconds:
+        yield
+        return
+
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    # Seconds left before the deadline, or None if there isn't one.
+    at = _deadline.get()
+    return None if at is None else max(0.0, at - time.monotonic())
+
+
+def is_timeout(error):
+    while error is not None:
+        if type(error).__name__ in TIMEOUT_ERRORS:
+            return True
+
+        error = error.__cause__ or error.__context__
+
+    return False
+
+
+# Counters for everything we time out, one entry per backend or tool.
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def count(name, counter, amount=1):
+    with _stats_lock:
+        stats = _stats.setdefault(
+            name,
+            {"timeouts": 0, "deadlineExceeded": 0, "hedges": 0, "hedgeWins": 0},
+        )
+        stats[counter] += amount
+
+
+def timeout_for(name, seconds):
+    # The backend's timeout cut down to what's left of the deadline.
+    left = remaining()
+
+    if left is None:
+        return seconds
+
+    if left <= 0:
+        count(name, "deadlineExceeded")
+        raise DeadlineExceeded(f"Out of time before calling {name}.")
+
+    return left if seconds is None else min(seconds, left)
+
+
+# Hedges and bounded calls get pools of their own: the callers usually run on
+# the tool pool, and waiting there for work queued behind them could deadlock.
+# The bounded calls are kept apart from the hedges so that calls stuck past
+# their timeout can't starve the hedges.
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def _get_pool(name, max_workers):
+    with _pool_lock:
+        pool = _pools.get(name)
+
+        if pool is None:
+            pool = _pools[name] = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=name
+            )
+
+        return pool
+
+
+def get_hedge_pool():
+    return _get_pool("hedge", HEDGE_WORKERS)
+
+
+class Backend:
+    def __init__(self, name, timeout_seconds, hedge=False):
+        self.name = name
+        self.timeout_seconds = timeout_seconds
+        self.hedge = hedge
+        self.latencies = deque(maxlen=RECENT_LATENCIES)
+        self._lock = threading.Lock()
+
+    def call(self, function):
+        # function(timeout) makes the call, giving up after timeout seconds.
+        delay = self.hedge_delay()
+
+        if delay is None:
+            return self._attempt(function)
+
+        return self._hedged(function, delay)
+
+    def call_bounded(self, function):
+        # function() can't be told a timeout, so we stop waiting for it.
+        def bounded(timeout):
+            pool = _get_pool("bounded", BOUNDED_WORKERS)
+            future = pool.submit(copy_context().run, function)
+            done, _ = wait([future], timeout=timeout)
+
+            if not done:
+                future.cancel()
+                raise TimeoutError(f"{self.name} took longer than {timeout:.1f}s.")
+
+            return future.result()
+
+        return self.call(bounded)
+
+    def hedge_delay(self):
+        # The recent p95, or None if we aren't hedging (yet).
+        if not self.hedge:
+            return None
+
+        with self._lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+
+            latencies = sorted(self.latencies)
+            return latencies[int(len(latencies) * 0.95)]
+
+    def _attempt(self, function):
+        # Out of time raises here, before there's a call to time.
+        timeout = timeout_for(self.name, self.timeout_seconds)
+        started = time.monotonic()
+
+        try:
+            return function(timeout)
+        except Exception as e:
+            if is_timeout(e) and not isinstance(e, DeadlineExceeded):
+                count(self.name, "timeouts")
+
+            raise
+        finally:
+            # Failures and timeouts too, or the p95 would only describe the
+            # calls that went well and we'd hedge too early.
+            with self._lock:
+                self.latencies.append(time.monotonic() - started)
+
+    def _hedged(self, function, delay):
+        pool = get_hedge_pool()
+        # In copies of our context, so the attempts see the deadline.
+        first = pool.submit(copy_context().run, self._attempt, function)
+        left = remaining()
+        done, _ = wait([first], timeout=delay if left is None else min(delay, left))
+
+        if done:
+            return first.result()
+
+        with span("hedge", backend=self.name, afterMs=round(delay * 1000)):
+            count(self.name, "hedges")
+            second = pool.submit(copy_context().run, self._attempt, function)
+            attempts = [first, second]
+            error = None
+
+            # Whichever answers first, unless it failed and the other may not.
+            while attempts:
+                done, _ = wait(
+                    attempts, timeout=remaining(), return_when=FIRST_COMPLETED
+                )
+
+                if not done:
+                    count(self.name, "deadlineExceeded")
+                    raise DeadlineExceeded(f"Out of time waiting for {self.name}.")
+
+                for attempt in done:
+                    attempts.remove(attempt)
+
+                    if attempt.exception() is None:
+                        if attempt is second:
+                            count(self.name, "hedgeWins")
+
+                        return attempt.result()
+
+                    error = error or attempt.exception()
+
+            raise error
+
+
+# One per backend for the whole process, so the latencies outlive Streamlit's
+# reruns.  Everyone asking for a backend must agree on its settings.
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name, timeout_seconds, hedge=False):
+    with _backends_lock:
+        backend = _backends.get(name)
+
+        if backend is None:
+            backend = _backends[name] = Backend(name, timeout_seconds, hedge)
+        elif (backend.timeout_seconds, backend.hedge) != (timeout_seconds, hedge):
+            # Someone would silently get the other caller's settings.
+            raise ValueError(
+                f"Backend {name} already has timeout {backend.timeout_seconds} "
+                f"and hedge {backend.hedge}, not {timeout_seconds} and {hedge}."
+            )
+
+        return backend
+
+
+def get_timeout_stats():
+    with _stats_lock:
+        stats = {name: dict(counters) for name, counters in _stats.items()}
+
+    for name, backend in list(_backends.items()):
+        delay = backend.hedge_delay()
+        stats.setdefault(name, {})["hedgeAfterMs"] = (
+            round(delay * 1000) if delay is not None else None
+        )
+
+    return stats
@@ -0,0 +1,285 @@
+import random
+import threading
+import time
+from collections import deque
+
+from shared.llm_scheduler import (
+    LlmScheduler,
+    get_status,
+    iter_causes,
+    rate_limit_retry_after,
+)
+from shared.tracing import span
+
+# Spreads chat completions over a pool of deployments (see CHAT_DEPLOYMENTS
+# in settings.py), so we can use capacity in more than one region and steer
+# around a slow or broken one.
+#
+#   response = router.call(
+#       lambda deployment: openai.ChatCompletion.create(
+#           engine=deployment.model,
+#           api_base=deployment.endpoint,
+#           api_key=deployment.api_key,
+#           ...
+#       ),
+#       estimate_chat_tokens(messages),
+#   )
+#
+# Each deployment has its own LlmScheduler for its own quota.  For every call
+# we pick the deployment with the lowest score, which is its recent latency
+# (an exponentially weighted moving average) plus how long the call would
+# wait there for quota, scaled up a little for every call already in flight
+# there.  Deployments we haven't heard from yet score zero, so each gets
+# tried, and now and then we pick one at random so a deployment that was slow
+# once gets another chance to show it has recovered.
+#
+# A call that fails with a 429, a 5xx, a timeout or a connection error moves
+# on to the next best deployment.  While there's somewhere else to go a 429
+# isn't retried in place, the scheduler just holds that deployment back until
+# Retry-After.  On the last one left the scheduler retries as usual.  Other
+# errors (a bad request, a content filter) would fail anywhere, so they're
+# raised straight away.
+#
+# After FAILURE_THRESHOLD failures in a row (not counting 429s, those are
+# about quota rather than health) a deployment's circuit opens and it isn't
+# used for COOLDOWN_SECONDS.  Then one call is let through to try it, and it
+# goes back into use if that works.  If every circuit is open we still try the
+# one that has been resting longest, rather than failing without asking, and
+# the same goes for a call that has run out of healthy deployments to fail
+# over to.
+
+EWMA_WEIGHT = 0.2
+IN_FLIGHT_WEIGHT = 0.1
+EXPLORE_RATE = 0.05
+FAILURE_THRESHOLD = 3
+COOLDOWN_SECONDS = 30
+RECENT_LATENCIES = 200
+
+# Errors worth trying another deployment for, by class name, so we don't
+# depend on which client library raised them.
+FAILOVER_ERRORS = {
+    "APIConnectionError",
+    "ServiceUnavailableError",
+    "Timeout",
+    "TimeoutError",
+    "ConnectionError",
+    "ConnectTimeout",
+    "ReadTimeout",
+}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+def should_fail_over(error):
+    for cause in iter_causes(error):
+        status = get_status(cause)
+
+        if status == 429 or (isinstance(status, int) and status >= 500):
+            return True
+
+        if type(cause).__name__ in FAILOVER_ERRORS:
+            return True
+
+    return False
+
+
+class Deployment:
+    def __init__(self, config, max_retries):
+        self.name = config["name"]
+        self.endpoint = config["endpoint"]
+        self.api_key = config["apiKey"]
+        self.model = config["model"]
+        self.scheduler = LlmScheduler(
+            config.get("tokensPerMinute"),
+            config.get("requestsPerMinute"),
+            max_retries,
+        )
+        self.ewma_ms = None
+        self.in_flight = 0
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.stats = {
+            "calls": 0,
+            "ok": 0,
+            "errors": 0,
+            "throttled": 0,
+            "failovers": 0,
+            "circuitOpened": 0,
+        }
+        self.latencies = deque(maxlen=RECENT_LATENCIES)
+
+    def score(self, estimated_tokens):
+        latency_ms = self.ewma_ms or 0.0
+        wait_ms = self.scheduler.expected_wait(estimated_tokens) * 1000
+        return (latency_ms + wait_ms) * (1 + IN_FLIGHT_WEIGHT * self.in_flight)
+
+    def get_stats(self):
+        latencies = sorted(self.latencies)
+        scheduler_stats = self.scheduler.get_stats()
+
+        return {
+            **self.stats,
+            "state": self.state,
+            "inFlight": self.in_flight,
+            "ewmaMs": round(self.ewma_ms, 1) if self.ewma_ms is not None else None,
+            "p50Ms": latencies[len(latencies) // 2] if latencies else None,
+            "p95Ms": latencies[int(len(latencies) * 0.95)] if latencies else None,
+            "queueDepth": scheduler_stats["queueDepth"],
+            "maxWaitSeconds": scheduler_stats["maxWaitSeconds"],
+            "tokensAvailable": scheduler_stats["tokensAvailable"],
+            "requestsAvailable": scheduler_stats["requestsAvailable"],
+        }
+
+
+class DeploymentRouter:
+    def __init__(self, configs, max_retries=5, seed=None):
+        self.deployments = [Deployment(config, max_retries) for config in configs]
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def call(self, function, estimated_tokens, actual_tokens=None):
+        # function(deployment) makes the call against that deployment.
+        tried = set()
+
+        while True:
+            deployment, last = self._choose(tried, estimated_tokens)
+            tried.add(deployment.name)
+            timing = {}
+
+            def timed_call():
+                # Only the call itself, the queueing is scored separately.
+                started = time.perf_counter()
+
+                try:
+                    return function(deployment)
+                finally:
+                    timing["ms"] = (time.perf_counter() - started) * 1000
+
+            settled = False
+
+            try:
+                with span("deployment", deployment=deployment.name):
+                    result = deployment.scheduler.call(
+                        timed_call,
+                        estimated_tokens,
+                        actual_tokens=actual_tokens,
+                        # Somewhere else to go beats waiting out a 429 here.
+                        max_retries=None if last else 0,
+                    )
+
+                settled = True
+            except Exception as e:
+                settled = True
+                failing_over = should_fail_over(e)
+                self._failed(deployment, e, failing_over and not last)
+
+                if not failing_over or last:
+                    raise
+
+                continue
+            finally:
+                # Here rather than in _succeeded and _failed, so a
+                # KeyboardInterrupt or a cancelled worker doesn't leave it
+                # counted forever.
+                self._release(deployment, settled)
+
+            self._succeeded(deployment, timing["ms"])
+            return result
+
+    def _choose(self, tried, estimated_tokens):
+        # Returns the deployment and whether it's the last one left to try.
+        # A deployment whose circuit is open still counts as left, once the
+        # others are used up we try it anyway (see below).
+        with self._lock:
+            now = time.monotonic()
+            candidates = [d for d in self.deployments if d.name not in tried]
+            usable = [d for d in candidates if self._usable(d, now)]
+
+            if usable:
+                if len(usable) > 1 and self._rng.random() < EXPLORE_RATE:
+                    chosen = self._rng.choice(usable)
+                else:
+                    chosen = min(usable, key=lambda d: d.score(estimated_tokens))
+            else:
+                # Every circuit is open, try the one that has rested longest.
+                chosen = min(candidates, key=lambda d: d.opened_at)
+
+            if chosen.state == OPEN:
+                # The trial call, nobody else gets in until we know.
+                chosen.state = HALF_OPEN
+
+            chosen.in_flight += 1
+            chosen.stats["calls"] += 1
+            return chosen, len(candidates) == 1
+
+    def _usable(self, deployment, now):
+        if deployment.state == CLOSED:
+            return True
+
+        if deployment.state == OPEN:
+            return now - deployment.opened_at >= COOLDOWN_SECONDS
+
+        # Half open, its trial call is still out.
+        return False
+
+    def _release(self, deployment, finished):
+        with self._lock:
+            deployment.in_flight -= 1
+
+            if not finished and deployment.state == HALF_OPEN:
+                # The trial call was given up on before we learned anything,
+                # let the next call try instead.
+                deployment.state = OPEN
+
+    def _succeeded(self, deployment, elapsed_ms):
+        with self._lock:
+            deployment.stats["ok"] += 1
+            deployment.consecutive_failures = 0
+            deployment.state = CLOSED
+            deployment.latencies.append(round(elapsed_ms))
+            deployment.ewma_ms = (
+                elapsed_ms
+                if deployment.ewma_ms is None
+                else EWMA_WEIGHT * elapsed_ms + (1 - EWMA_WEIGHT) * deployment.ewma_ms
+            )
+
+    def _failed(self, deployment, error, failing_over):
+        with self._lock:
+            deployment.stats["errors"] += 1
+
+            if failing_over:
+                deployment.stats["failovers"] += 1
+
+            throttled = rate_limit_retry_after(error) is not None
+
+            if throttled:
+                deployment.stats["throttled"] += 1
+
+            if throttled or not should_fail_over(error):
+                # It answered, so it's up, just busy or unhappy with the call.
+                deployment.consecutive_failures = 0
+
+                if deployment.state == HALF_OPEN:
+                    deployment.state = CLOSED
+
+                return
+
+            deployment.consecutive_failures += 1
+
+            if (
+                deployment.state == HALF_OPEN
+                or deployment.consecutive_failures >= FAILURE_THRESHOLD
+            ):
+                if deployment.state != OPEN:
+                    deployment.stats["circuitOpened"] += 1
+
+                deployment.state = OPEN
+                deployment.opened_at = time.monotonic()
+
+    def get_stats(self):
+        with self._lock:
+            return {d.name: d.get_stats() for d in self.deployments}
+
@@ -0,0 +1,225 @@
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# A local stand-in for the Hero Stats API described in
+# resources/hots_api_spec.json, so the tools can run (and be benchmarked)
+# without the network.
+#
+#   python -m shared.hero_stats_server --port 8081 --latency-ms 80 --jitter-ms 40
+#
+# then point HEROES_API_ENDPOINT at http://127.0.0.1:8081.
+#
+# GET /hero-stats?startDate=YYYY-MM-DD&lastDate=YYYY-MM-DD returns an array of
+# HeroStats, like the spec says.  Our own client sends endDate rather than
+# lastDate, so that is accepted too.
+#
+# The numbers are made up from resources/fake_hero_stats.json: every hero gets
+# a slice of its games and a nudged win rate for each day, seeded by the date,
+# so the same day always gives the same answer and a range is the
+# games-weighted total of its days, just like the real thing.
+
+FAKE_STATS_PATH = "resources/fake_hero_stats.json"
+
+# The sample is roughly a month of games.
+SAMPLE_DAYS = 30
+MAX_RANGE_DAYS = 366
+
+
+def load_base_heroes(path=FAKE_STATS_PATH):
+    with open(path) as stats_file:
+        data = json.load(stats_file)
+
+    return data["heroes"] if isinstance(data, dict) else data
+
+
+def generate_day(base_heroes, day):
+    rows = []
+
+    for hero in base_heroes:
+        rng = random.Random(f"{day.isoformat()}:{hero['name']}")
+        # More people play on the weekend.
+        weekend = 1.3 if day.weekday() >= 5 else 1.0
+        daily_games = (hero.get("gamesPlayed") or 0) / SAMPLE_DAYS
+        games = round(daily_games * weekend * rng.uniform(0.7, 1.3))
+        win_rate = min(0.7, max(0.3, hero["winRate"] + rng.gauss(0, 0.02)))
+        rows.append(
+            {
+                "name": hero["name"],
+                "role": hero["role"],
+                "winRate": win_rate,
+                "gamesPlayed": games,
+            }
+        )
+
+    return rows
+
+
+def generate_range(base_heroes, start, end):
+    totals = {}
+
+    for offset in range((end - start).days + 1):
+        for row in generate_day(base_heroes, start + timedelta(days=offset)):
+            total = totals.setdefault(
+                row["name"], {"role": row["role"], "wins": 0.0, "games": 0}
+            )
+            total["wins"] += row["winRate"] * row["gamesPlayed"]
+            total["games"] += row["gamesPlayed"]
+
+    return [
+        {
+            "name": name,
+            "role": total["role"],
+            "winRate": total["wins"] / total["games"] if total["games"] else 0.0,
+            "gamesPlayed": total["games"],
+        }
+        for name, total in totals.items()
+    ]
+
+
+class HeroStatsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        latency_ms=0,
+        jitter_ms=0,
+        error_rate=0.0,
+        seed=None,
+        stats_path=FAKE_STATS_PATH,
+    ):
+        super().__init__(address, HeroStatsRequestHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.base_heroes = load_base_heroes(stats_path)
+        self.stats = {"requests": 0, "ok": 0, "badRequests": 0, "injectedErrors": 0}
+        # Only drives the latency and the injected errors, the data is seeded
+        # by date.
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_delay_and_error(self):
+        with self._lock:
+            self.stats["requests"] += 1
+            delay = self.latency_ms + self._rng.uniform(0, self.jitter_ms)
+            failed = self._rng.random() < self.error_rate
+
+        return max(0.0, delay) / 1000, failed
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+class HeroStatsRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep the connection alive between requests,
+    # otherwise pooling would make no difference.
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        if url.path.rstrip("/") != "/hero-stats":
+            self._send_json(404, {"error": f"{url.path} not found"})
+            return
+
+        delay, failed = self.server.next_delay_and_error()
+        time.sleep(delay)
+
+        if failed:
+            self.server.count("injectedErrors")
+            self._send_json(500, {"error": "injected failure"})
+            return
+
+        query = parse_qs(url.query)
+        start_date = query.get("startDate", [None])[0]
+        last_date = (query.get("lastDate") or query.get("endDate") or [None])[0]
+
+        try:
+            start = date.fromisoformat(start_date)
+            end = date.fromisoformat(last_date)
+        except (TypeError, ValueError):
+            self.server.count("badRequests")
+            self._send_json(
+                400, {"error": "startDate and lastDate are required, as YYYY-MM-DD"}
+            )
+            return
+
+        if end < start or (end - start).days >= MAX_RANGE_DAYS:
+            self.server.count("badRequests")
+            self._send_json(
+                400, {"error": f"the range must be 1 to {MAX_RANGE_DAYS} days"}
+            )
+            return
+
+        self.server.count("ok")
+        self._send_json(200, generate_range(self.server.base_heroes, start, end))
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # One line per request to stderr would dominate a load test.
+        pass
+
+
+def start_server(host="127.0.0.1", port=0, **kwargs):
+    # Port 0 picks a free port, read it back from server.endpoint.
+    server = HeroStatsServer((host, port), **kwargs)
+    thread = threading.Thread(
+        target=server.serve_forever, name="hero-stats-server", daemon=True
+    )
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake hero stats locally.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    server = HeroStatsServer(
+        (args.host, args.port),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    print(f"Serving hero stats on {server.endpoint}/hero-stats")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import json
+
+from shared.message_store import Message
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Keeps the conversation we send to the LLM inside a token budget.  The full
+# history stays in the session, this only decides what goes over the wire:
+#
+#   - the most recent turn is always sent as is,
+#   - tool results from earlier turns are collapsed into a one line note,
+#   - older turns are dropped once the budget runs out, and replaced by a
+#     short system message saying how many messages were left out.
+#
+# A turn is a user message plus everything that answered it.  We only ever
+# drop whole turns, so a tool call is never separated from its result.
+#
+# We walk back from the newest message and stop as soon as the budget is
+# spent, so older messages aren't even looked at.  A history read from disk
+# (shared/session_log.py) only decodes the messages we send, plus one turn.
+#
+# History entries are shared.message_store.Message records.  Token counts are
+# cached on them, so each message is only tokenized once no matter how many
+# times the conversation is rebuilt.
+
+# Every message costs a few tokens for the role and separators.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+
+def count_tokens(text):
+    global _encoding
+
+    if not text:
+        return 0
+
+    if tiktoken is None:
+        # Roughly four characters per token for English text.
+        return len(text) // 4 + 1
+
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+
+    return len(_encoding.encode(text))
+
+
+def get_message_tokens(entry):
+    tokens = entry.tokens
+
+    if tokens is None:
+        text = entry.content or ""
+
+        for tool_call in entry.tool_calls or []:
+            text += json.dumps(tool_call["function"])
+
+        tokens = count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+        entry.tokens = tokens
+
+    return tokens
+
+
+def collapse_tool_result(entry):
+    collapsed = entry.collapsed
+
+    if collapsed is None:
+        name = entry.function_name or "the tool"
+        detail = entry.detail
+
+        if isinstance(detail, dict) and "error" in detail:
+            description = f"an error: {detail['error']}"
+        elif isinstance(detail, list):
+            description = f"{len(detail)} rows"
+        elif isinstance(detail, dict) and "rows" in detail:
+            description = f"{len(detail['rows'])} rows"
+        else:
+            description = f"{len(entry.content or '')} characters of data"
+
+        content = (
+            f"[{name} returned {description}.  "
+            "It has been left out to save space, call it again if you need it.]"
+        )
+        collapsed = entry.copy(content=content, detail=None)
+        collapsed.tokens = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        entry.collapsed = collapsed
+
+    return collapsed
+
+
+def describe_dropped_messages(count):
+    return (
+        f"[{count} earlier messages in this conversation have been left out "
+        "to save space.]"
+    )
+
+
+def fit_to_budget(history, token_budget, describe_dropped=describe_dropped_messages):
+    # Returns the history entries to send, in order.  Collapsed tool results
+    # and the dropped messages note are new messages.  The entries in history
+    # only gain the cached token counts and collapsed copies.
+    pinned = []
+
+    # Anything before the first question (a system prompt, say) is always
+    # kept.
+    for entry in history:
+        if entry.role == "user":
+            break
+
+        pinned.append(entry)
+
+    if len(pinned) == len(history):
+        return list(history)
+
+    used = sum(get_message_tokens(entry) for entry in pinned)
+    kept = []
+    turn = []
+    oldest_kept = len(history)
+
+    for index in range(len(history) - 1, len(pinned) - 1, -1):
+        entry = history[index]
+        turn.insert(0, entry)
+
+        if entry.role != "user":
+            continue
+
+        # The latest turn goes no matter what, without it there's no question.
+        if kept:
+            turn = [
+                collapse_tool_result(entry) if entry.role == "tool" else entry
+                for entry in turn
+            ]
+            turn_tokens = sum(get_message_tokens(entry) for entry in turn)
+
+            if used + turn_tokens > token_budget:
+                break
+        else:
+            turn_tokens = sum(get_message_tokens(entry) for entry in turn)
+
+        kept[0:0] = turn
+        used += turn_tokens
+        oldest_kept = index
+        turn = []
+
+    messages = list(pinned)
+    dropped = oldest_kept - len(pinned)
+
+    if dropped:
+        messages.append(Message("system", describe_dropped(dropped)))
+
+    return messages + kept
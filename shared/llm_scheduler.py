@@ -0,0 +1,401 @@
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+
+from shared.deadlines import DeadlineExceeded, count, remaining
+from shared.history import MESSAGE_OVERHEAD_TOKENS, count_tokens
+from shared.tracing import span
+
+# Decides when each chat completion may go to the deployment, so a burst
+# queues on our side instead of turning into 429s.
+#
+#   response = scheduler.call(
+#       lambda: openai.ChatCompletion.create(...),
+#       estimate_chat_tokens(messages),
+#       actual_tokens=total_tokens,
+#   )
+#
+# Azure counts a deployment's quota in tokens per minute and requests per
+# minute.  We keep a token bucket for each, refilled continuously.  A call
+# takes its estimated tokens up front, and once the response says how many it
+# really used the difference is given back (or taken).
+#
+# Waiting calls are served in priority order, then first come first served.
+# Interactive calls (the default) go ahead of batch ones; code running batch
+# work wraps it in "with priority(BATCH):", which the call picks up through a
+# ContextVar so nothing in between has to pass it along.
+#
+# If the deployment answers 429 anyway (someone else shares it, or our
+# estimate was low) nobody is admitted until it has recovered: we wait for
+# whatever Retry-After said, or an exponential backoff with jitter if it
+# didn't say, and then retry the call with its original place in the queue.
+# That holds even for a call that has run out of retries (or was given none),
+# the next call still has to wait.
+#
+# A call that is still waiting when the turn's deadline passes (see
+# shared/deadlines.py) gives up its place and fails with DeadlineExceeded.
+#
+# The limits are per process, and Streamlit runs each app as its own process,
+# so give each one its share of the deployment's quota.
+
+INTERACTIVE = 0
+BATCH = 1
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Azure reserves max_tokens for the completion when it counts the quota.  We
+# don't set max_tokens, so this is our guess at how long an answer runs.
+DEFAULT_COMPLETION_TOKENS = 500
+
+# Azure enforces the per-minute quota over short windows, so a full minute's
+# worth at once still gets refused.  The buckets only hold this many seconds'
+# worth.
+BURST_SECONDS = 10
+
+# How many recent waits we keep for the percentiles.
+RECENT_WAITS = 1000
+
+_priority = ContextVar("llm_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level):
+    token = _priority.set(level)
+
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def estimate_chat_tokens(messages, completion_tokens=DEFAULT_COMPLETION_TOKENS):
+    # messages can be OpenAI dicts, LangChain messages or transcript lines.
+    tokens = completion_tokens
+
+    for message in messages:
+        if isinstance(message, str):
+            text = message
+        elif isinstance(message, dict):
+            text = message.get("content") or ""
+
+            for tool_call in message.get("tool_calls") or []:
+                text += json.dumps(tool_call.get("function"))
+        else:
+            text = getattr(message, "content", None) or ""
+
+        tokens += count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+    return tokens
+
+
+def total_tokens(response):
+    # For actual_tokens, what a (non-streamed) completion says it used.
+    usage = response.get("usage") if hasattr(response, "get") else None
+    return usage.get("total_tokens") if usage else None
+
+
+def _parse_retry_after(headers):
+    if not headers:
+        return 0.0
+
+    headers = {str(name).lower(): value for name, value in dict(headers).items()}
+
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+    except ValueError:
+        pass
+
+    value = headers.get("retry-after")
+
+    if value is None:
+        return 0.0
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        # It can also be an HTTP date.
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def iter_causes(error):
+    # The error and whatever it wraps.  The frameworks wrap the OpenAI error,
+    # so we have to look through them.
+    seen = set()
+
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def get_status(error):
+    return getattr(error, "http_status", None) or getattr(error, "status_code", None)
+
+
+def rate_limit_retry_after(error):
+    # None if error isn't a 429, otherwise how long the server asked us to
+    # wait (0 if it didn't say).
+    for cause in iter_causes(error):
+        if get_status(cause) == 429 or type(cause).__name__ == "RateLimitError":
+            return _parse_retry_after(getattr(cause, "headers", None))
+
+    return None
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst_seconds=BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = self.rate * burst_seconds
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        # A call bigger than the whole bucket goes when the bucket is full,
+        # otherwise it could never go.
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount, now):
+        # Can go below zero when a call used more than we guessed, later
+        # calls wait for it to pay that back.
+        self._refill(now)
+        self.level -= amount
+
+    def available(self, now):
+        self._refill(now)
+        return self.level
+
+    def give_back(self, amount, now):
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+
+class LlmScheduler:
+    def __init__(
+        self,
+        tokens_per_minute=None,
+        requests_per_minute=None,
+        max_retries=5,
+        base_delay=1.0,
+        max_delay=30.0,
+        seed=None,
+    ):
+        # A limit of None (or 0) isn't enforced, but calls still queue behind
+        # a 429 and get retried.
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.requests = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {
+            "admitted": 0,
+            "completed": 0,
+            "throttled": 0,
+            "retries": 0,
+            "failed": 0,
+            "maxQueueDepth": 0,
+            "waitSeconds": 0.0,
+            "maxWaitSeconds": 0.0,
+            "estimatedTokens": 0,
+            "actualTokens": 0,
+        }
+        self._queue = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._waits = deque(maxlen=RECENT_WAITS)
+        self._condition = threading.Condition()
+        self._rng = random.Random(seed)
+
+    def call(
+        self,
+        function,
+        estimated_tokens,
+        actual_tokens=None,
+        priority=None,
+        max_retries=None,
+    ):
+        # actual_tokens(result) returns what the call really used, or None
+        # if it can't tell (a stream, say) and the estimate stands.
+        ticket = (
+            _priority.get() if priority is None else priority,
+            next(self._sequence),
+        )
+        max_retries = self.max_retries if max_retries is None else max_retries
+
+        for attempt in range(max_retries + 1):
+            self._admit(ticket, estimated_tokens)
+
+            try:
+                result = function()
+            except Exception as e:
+                retry_after = rate_limit_retry_after(e)
+
+                if retry_after is not None:
+                    # Whether or not this call retries, the deployment wants
+                    # everyone to back off.
+                    self._throttled(attempt, retry_after, estimated_tokens)
+
+                if retry_after is None or attempt == max_retries:
+                    self._count("failed")
+                    raise
+
+                self._count("retries")
+                continue
+
+            used = actual_tokens(result) if actual_tokens else None
+            self._completed(estimated_tokens, used)
+            return result
+
+    def expected_wait(self, estimated_tokens):
+        # Roughly how long a new call would wait to be admitted, counting the
+        # calls already queued as the same size.
+        with self._condition:
+            needed = estimated_tokens * (len(self._queue) + 1)
+            return max(0.0, self._wait_time(needed, time.monotonic()))
+
+    def _admit(self, ticket, estimated_tokens):
+        with span(
+            "admission", priority=PRIORITY_NAMES.get(ticket[0], ticket[0])
+        ) as admission_span, self._condition:
+            started = time.monotonic()
+            heapq.heappush(self._queue, ticket)
+            self.stats["maxQueueDepth"] = max(
+                self.stats["maxQueueDepth"], len(self._queue)
+            )
+
+            try:
+                while True:
+                    timeout = None
+
+                    if self._queue[0] == ticket:
+                        timeout = self._wait_time(estimated_tokens, time.monotonic())
+
+                        if timeout <= 0:
+                            break
+
+                    left = remaining()
+
+                    if left is not None:
+                        if left <= 0:
+                            count("chat", "deadlineExceeded")
+                            raise DeadlineExceeded("Out of time waiting for quota.")
+
+                        timeout = left if timeout is None else min(timeout, left)
+
+                    self._condition.wait(timeout)
+            except BaseException:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._condition.notify_all()
+                raise
+
+            heapq.heappop(self._queue)
+            now = time.monotonic()
+
+            if self.tokens:
+                self.tokens.take(estimated_tokens, now)
+
+            if self.requests:
+                self.requests.take(1, now)
+
+            waited = now - started
+            self._waits.append(waited)
+            self.stats["admitted"] += 1
+            self.stats["estimatedTokens"] += estimated_tokens
+            self.stats["waitSeconds"] += waited
+            self.stats["maxWaitSeconds"] = max(self.stats["maxWaitSeconds"], waited)
+            admission_span.set(waitMs=round(waited * 1000, 3))
+            # The next one in line may be able to go now.
+            self._condition.notify_all()
+
+    def _wait_time(self, estimated_tokens, now):
+        waits = [self._paused_until - now]
+
+        if self.tokens:
+            waits.append(self.tokens.wait_time(estimated_tokens, now))
+
+        if self.requests:
+            waits.append(self.requests.wait_time(1, now))
+
+        return max(waits)
+
+    def _throttled(self, attempt, retry_after, estimated_tokens):
+        # Full jitter, so everyone who got a 429 doesn't come back at once.
+        # Retry-After wins when it asks for longer.
+        backoff = self._rng.uniform(
+            0, min(self.max_delay, self.base_delay * 2**attempt)
+        )
+        delay = max(retry_after, backoff)
+
+        with self._condition:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + delay)
+
+            # The deployment didn't count a refused call against the quota.
+            if self.tokens:
+                self.tokens.give_back(estimated_tokens, now)
+
+            if self.requests:
+                self.requests.give_back(1, now)
+
+            self.stats["throttled"] += 1
+            self._condition.notify_all()
+
+    def _completed(self, estimated_tokens, used):
+        with self._condition:
+            self.stats["completed"] += 1
+
+            if used is None:
+                self.stats["actualTokens"] += estimated_tokens
+                return
+
+            self.stats["actualTokens"] += used
+
+            if self.tokens:
+                self.tokens.give_back(estimated_tokens - used, time.monotonic())
+
+            self._condition.notify_all()
+
+    def _count(self, name):
+        with self._condition:
+            self.stats[name] += 1
+
+    def get_stats(self):
+        with self._condition:
+            waits = sorted(self._waits)
+            now = time.monotonic()
+
+            return {
+                **self.stats,
+                "queueDepth": len(self._queue),
+                "p50WaitSeconds": waits[len(waits) // 2] if waits else None,
+                "p95WaitSeconds": waits[int(len(waits) * 0.95)] if waits else None,
+                "pausedSeconds": max(0.0, self._paused_until - now),
+                "tokensAvailable": round(self.tokens.available(now))
+                if self.tokens
+                else None,
+                "requestsAvailable": round(self.requests.available(now), 1)
+                if self.requests
+                else None,
+            }
+
@@ -0,0 +1,288 @@
+import heapq
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+# An in-process stand-in for the Azure Cognitive Search hotels index.  It
+# loads a JSON snapshot of the documents (see benchmarks/hotel_search_recall.py
+# to export one) and scores queries with BM25 over the same text fields the
+# Azure index searches.  search() takes the arguments we pass to
+# SearchClient.search and returns results shaped the same way, so the two can
+# be swapped.
+#
+# filter is an OData string like Azure's, but only comparisons of a field
+# with a literal, joined by "and" and "or" (no parentheses, "and" binds
+# tighter), e.g. "Rating ge 4 and Address/City eq 'Seattle'".  Anything else
+# raises a ValueError rather than quietly matching the wrong documents.  A
+# callable taking a document also works, for filters OData can't say.
+
+SEARCHABLE_FIELDS = ["HotelName", "Description", "Category", "Tags"]
+ADDRESS_FIELDS = ["StreetAddress", "City", "StateProvince", "Country"]
+
+# The standard Lucene analyzer doesn't stem, so neither do we.  It does drop
+# a handful of very common words.
+# fmt: off
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in",
+    "into", "is", "it", "no", "not", "of", "on", "or", "such", "that", "the",
+    "their", "then", "there", "these", "they", "this", "to", "was", "will",
+    "with",
+}
+# fmt: on
+
+
+FILTER_TOKEN = re.compile(
+    r"\s*(?:'((?:[^']|'')*)'|(-?\d+(?:\.\d+)?)\b|([A-Za-z_][\w/]*))"
+)
+FILTER_OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "ne": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "ge": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "le": lambda a, b: a is not None and a <= b,
+}
+FILTER_KEYWORDS = {"true": True, "false": False, "null": None}
+
+
+def tokenize(text):
+    return [t for t in re.findall(r"\w+", text.lower()) if t not in STOP_WORDS]
+
+
+def _project(document, select):
+    # select is a list of fields like Azure takes, "Rooms/BaseRate" picks a
+    # field out of each item of a complex field.
+    fields = {}
+
+    for path in select:
+        field, _, subfield = path.partition("/")
+
+        if subfield:
+            fields.setdefault(field, []).append(subfield)
+        else:
+            fields[field] = None
+
+    projected = {}
+
+    for field, subfields in fields.items():
+        value = document.get(field)
+
+        if subfields is None or value is None:
+            projected[field] = value
+        elif isinstance(value, list):
+            projected[field] = [{s: item.get(s) for s in subfields} for item in value]
+        else:
+            projected[field] = {s: value.get(s) for s in subfields}
+
+    return projected
+
+
+def _tokenize_filter(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+
+    while position < len(expression):
+        match = FILTER_TOKEN.match(expression, position)
+
+        if match is None:
+            raise ValueError(f"Unsupported filter {expression!r}.")
+
+        string, number, word = match.groups()
+
+        if string is not None:
+            tokens.append(("literal", string.replace("''", "'")))
+        elif number is not None:
+            tokens.append(("literal", float(number) if "." in number else int(number)))
+        elif word in FILTER_KEYWORDS:
+            tokens.append(("literal", FILTER_KEYWORDS[word]))
+        else:
+            tokens.append(("word", word))
+
+        position = match.end()
+
+    return tokens
+
+
+def _field_value(document, path):
+    value = document
+
+    for field in path.split("/"):
+        value = value.get(field) if isinstance(value, dict) else None
+
+    return value
+
+
+def compile_filter(expression):
+    # Turns the OData subset described at the top into a callable.
+    tokens = _tokenize_filter(expression)
+    alternatives = [[]]
+
+    for start in range(0, len(tokens), 4):
+        comparison = tokens[start : start + 3]
+        joiner = tokens[start + 3] if start + 3 < len(tokens) else None
+
+        if (
+            len(comparison) != 3
+            or comparison[0][0] != "word"
+            or comparison[1] not in {("word", op) for op in FILTER_OPERATORS}
+            or comparison[2][0] != "literal"
+            or joiner not in (None, ("word", "and"), ("word", "or"))
+            or (joiner is not None and start + 4 >= len(tokens))
+        ):
+            raise ValueError(f"Unsupported filter {expression!r}.")
+
+        alternatives[-1].append(
+            (comparison[0][1], FILTER_OPERATORS[comparison[1][1]], comparison[2][1])
+        )
+
+        if joiner == ("word", "or"):
+            alternatives.append([])
+
+    def matches(document):
+        return any(
+            all(op(_field_value(document, field), value) for field, op, value in terms)
+            for terms in alternatives
+        )
+
+    return matches
+
+
+def _document_text(document):
+    parts = []
+
+    for field in SEARCHABLE_FIELDS:
+        value = document.get(field)
+
+        if isinstance(value, list):
+            parts.extend(str(v) for v in value)
+        elif value:
+            parts.append(str(value))
+
+    address = document.get("Address") or {}
+    parts.extend(str(address[f]) for f in ADDRESS_FIELDS if address.get(f))
+
+    for room in document.get("Rooms") or []:
+        if room.get("Description"):
+            parts.append(room["Description"])
+
+    return " ".join(parts)
+
+
+class LocalHotelIndex:
+    def __init__(self, documents, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents = documents
+        self.stats = {"queries": 0, "queryMs": 0.0}
+        self._stats_lock = threading.Lock()
+
+        start = time.perf_counter()
+
+        # term -> [(document index, term frequency)]
+        self._postings = defaultdict(list)
+        self._lengths = []
+
+        for index, document in enumerate(documents):
+            terms = tokenize(_document_text(document))
+            self._lengths.append(len(terms))
+
+            for term, frequency in Counter(terms).items():
+                self._postings[term].append((index, frequency))
+
+        self._postings = dict(self._postings)
+        # or 1 so a snapshot of empty documents doesn't divide by zero.
+        self._average_length = (
+            sum(self._lengths) / len(self._lengths) if self._lengths else 0
+        ) or 1
+        count = len(documents)
+        self._idf = {
+            term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+        self.stats["buildMs"] = (time.perf_counter() - start) * 1000
+        self.stats["documents"] = count
+        self.stats["terms"] = len(self._postings)
+        self.stats["postings"] = sum(len(p) for p in self._postings.values())
+
+    @classmethod
+    def from_snapshot(cls, path):
+        start = time.perf_counter()
+
+        with open(path) as snapshot_file:
+            documents = json.load(snapshot_file)
+
+        index = cls(documents)
+        index.stats["loadMs"] = (time.perf_counter() - start) * 1000
+        return index
+
+    def search(self, search_text, top=50, select=None, filter=None, **kwargs):
+        # filter is an OData string (the subset at the top) or a callable.
+        start = time.perf_counter()
+
+        if isinstance(filter, str):
+            filter = compile_filter(filter)
+
+        scores = defaultdict(float)
+
+        # Like Azure, "*" matches everything.
+        if (search_text or "").strip() == "*":
+            scores.update((index, 1.0) for index in range(len(self.documents)))
+
+        for term in set(tokenize(search_text or "")):
+            idf = self._idf.get(term)
+
+            if idf is None:
+                continue
+
+            for index, frequency in self._postings[term]:
+                length_norm = 1 - self.b + self.b * (
+                    self._lengths[index] / self._average_length
+                )
+                scores[index] += (
+                    idf
+                    * frequency
+                    * (self.k1 + 1)
+                    / (frequency + self.k1 * length_norm)
+                )
+
+        if filter is not None:
+            candidates = (
+                (score, index)
+                for index, score in scores.items()
+                if filter(self.documents[index])
+            )
+        else:
+            candidates = ((score, index) for index, score in scores.items())
+
+        best = heapq.nlargest(int(top), candidates)
+        results = []
+
+        for score, index in best:
+            document = self.documents[index]
+
+            if select:
+                document = _project(document, select)
+
+            results.append(
+                {**document, "@search.score": score, "@search.highlights": None}
+            )
+
+        with self._stats_lock:
+            self.stats["queries"] += 1
+            self.stats["queryMs"] += (time.perf_counter() - start) * 1000
+
+        return results
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+
+        stats["averageQueryMs"] = (
+            stats["queryMs"] / stats["queries"] if stats["queries"] else None
+        )
+        return stats
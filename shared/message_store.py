@@ -0,0 +1,131 @@
+# The chat history for a session, shared by all the apps.
+#
+# Every message is a small fixed-shape record (no per-message __dict__), and
+# only holds what we use later: the text, tool call bookkeeping, ids and
+# usage, plus whatever compact detail the app shows under it.  Whole
+# completion objects are not kept.
+#
+# The store is append only.  Messages with a completion id are indexed, so
+# feedback for one is a dict lookup rather than a scan, and so are the
+# positions of the user messages, where each turn starts.  Each message's wire
+# format (what goes to the LLM) is built the first time it is sent and kept,
+# so building the conversation for the next call is mostly list appends.
+
+
+class Message:
+    __slots__ = (
+        "role",
+        "content",
+        "tool_calls",
+        "tool_call_id",
+        "function_name",
+        "completion_id",
+        "usage",
+        "feedback",
+        "detail",
+        "stats",
+        # Caches, filled in as the message is used.
+        "tokens",
+        "collapsed",
+        "wire",
+        "rendered",
+    )
+
+    def __init__(self, role, content=None, **fields):
+        self.role = role
+        self.content = content
+
+        for name in self.__slots__[2:]:
+            setattr(self, name, fields.pop(name, None))
+
+        if fields:
+            raise TypeError(f"Unknown message fields: {', '.join(fields)}")
+
+    def copy(self, **changes):
+        # The caches describe this message, the copy starts without them.
+        fields = {
+            name: getattr(self, name)
+            for name in self.__slots__
+            if name not in ("tokens", "collapsed", "wire", "rendered")
+        }
+        fields.update(changes)
+        return Message(**fields)
+
+
+def as_openai_message(message):
+    # content is required, even if it's None
+    wire = {"role": message.role, "content": message.content}
+
+    if message.tool_calls is not None:
+        wire["tool_calls"] = message.tool_calls
+
+    if message.tool_call_id is not None:
+        wire["tool_call_id"] = message.tool_call_id
+
+    if message.function_name is not None:
+        wire["name"] = message.function_name
+
+    return wire
+
+
+class MessageStore:
+    def __init__(self, to_wire=as_openai_message):
+        self.to_wire = to_wire
+        self._messages = []
+        self._by_completion_id = {}
+        self._turn_starts = []
+
+    @property
+    def messages(self):
+        return self._messages
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+    def append(self, role, content=None, **fields):
+        message = Message(role, content, **fields)
+        self._add(message)
+        return message
+
+    def turn_starts(self):
+        # The index of every user message, oldest first.
+        return self._turn_starts
+
+    def _add(self, message):
+        if message.role == "user":
+            self._turn_starts.append(len(self.messages))
+
+        self.messages.append(message)
+
+        if message.completion_id is not None:
+            self._by_completion_id[message.completion_id] = message
+
+    def find(self, completion_id):
+        return self._by_completion_id.get(completion_id)
+
+    def set_feedback(self, completion_id, feedback):
+        message = self.find(completion_id)
+
+        if message is not None:
+            message.feedback = feedback
+
+        return message
+
+    def as_wire(self, messages):
+        # messages is some selection of ours (see shared/history.py), which
+        # may include collapsed copies and a summary.  They all get cached.
+        wire_messages = []
+
+        for message in messages:
+            if message.wire is None:
+                message.wire = self.to_wire(message)
+
+            wire_messages.append(message.wire)
+
+        return wire_messages
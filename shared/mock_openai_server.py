@@ -0,0 +1,258 @@
+import argparse
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# A local stand-in for an Azure OpenAI deployment with a quota, so the
+# scheduler in shared/llm_scheduler.py can be tried (and benchmarked) against
+# real 429s without spending any of ours.
+#
+#   python -m shared.mock_openai_server --port 8082 --tokens-per-minute 20000
+#
+# then point the apps' chat endpoint at http://127.0.0.1:8082.
+#
+# POST /openai/deployments/{name}/chat/completions answers with a short canned
+# completion, streamed if asked.  Like Azure, the per-minute quota is enforced
+# in short windows (a sixth of it every 10 seconds by default), and a request
+# over it gets a 429 with Retry-After (and retry-after-ms) saying when the
+# window ends.  Tokens are counted as the prompt (about four characters a
+# token) plus max_tokens, or completion_tokens if the request doesn't say.
+
+WINDOW_SECONDS = 10
+
+
+def count_prompt_tokens(messages):
+    return sum(len(m.get("content") or "") // 4 + 5 for m in messages)
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The whole point is bursts, don't refuse connections at the default of 5.
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        address,
+        tokens_per_minute=None,
+        requests_per_minute=None,
+        latency_ms=0,
+        completion_tokens=50,
+        window_seconds=WINDOW_SECONDS,
+    ):
+        super().__init__(address, MockOpenAIRequestHandler)
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.latency_ms = latency_ms
+        self.completion_tokens = completion_tokens
+        self.window_seconds = window_seconds
+        self.stats = {"requests": 0, "ok": 0, "throttled": 0, "tokens": 0}
+        self._window_start = time.monotonic()
+        self._window_tokens = 0
+        self._window_requests = 0
+        self._completion_ids = 0
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def admit(self, tokens):
+        # Returns (completion id, None) or (None, seconds to wait).
+        with self._lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            elapsed = now - self._window_start
+
+            if elapsed >= self.window_seconds:
+                self._window_start = now - elapsed % self.window_seconds
+                self._window_tokens = 0
+                self._window_requests = 0
+
+            share = self.window_seconds / 60
+            over_tokens = (
+                self.tokens_per_minute
+                and self._window_tokens + tokens > self.tokens_per_minute * share
+                # One request bigger than the window still goes in an empty one.
+                and self._window_tokens
+            )
+            over_requests = (
+                self.requests_per_minute
+                and self._window_requests + 1
+                > max(1, self.requests_per_minute * share)
+            )
+
+            if over_tokens or over_requests:
+                self.stats["throttled"] += 1
+                return None, self._window_start + self.window_seconds - now
+
+            self._window_tokens += tokens
+            self._window_requests += 1
+            self._completion_ids += 1
+            self.stats["ok"] += 1
+            self.stats["tokens"] += tokens
+            return f"chatcmpl-mock-{self._completion_ids}", None
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+class MockOpenAIRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        if (
+            len(parts) != 5
+            or parts[:2] != ["openai", "deployments"]
+            or parts[3:] != ["chat", "completions"]
+        ):
+            self._send_json(404, {"error": {"code": "404", "message": "Not found"}})
+            return
+
+        deployment = parts[2]
+        messages = body.get("messages") or []
+        prompt_tokens = count_prompt_tokens(messages)
+        completion_tokens = body.get("max_tokens") or self.server.completion_tokens
+        completion_id, retry_after = self.server.admit(
+            prompt_tokens + completion_tokens
+        )
+
+        if completion_id is None:
+            self._send_json(
+                429,
+                {
+                    "error": {
+                        "code": "429",
+                        "message": "Requests to the ChatCompletions_Create "
+                        f"Operation under deployment {deployment} have exceeded "
+                        "the rate limit.  Please retry after "
+                        f"{math.ceil(retry_after)} seconds.",
+                    }
+                },
+                {
+                    "Retry-After": str(math.ceil(retry_after)),
+                    "retry-after-ms": str(round(retry_after * 1000)),
+                },
+            )
+            return
+
+        time.sleep(self.server.latency_ms / 1000)
+        question = (messages[-1].get("content") or "") if messages else ""
+        content = f"This is a mock answer to: {question[:80]}"
+        completion = {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+        if body.get("stream"):
+            self._send_stream(completion)
+        else:
+            self._send_json(200, completion)
+
+    def _send_stream(self, completion):
+        # No Content-Length, so the end of the stream is the end of the
+        # connection.
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        message = completion["choices"][0]["message"]
+
+        for delta, finish_reason in [
+            ({"role": message["role"]}, None),
+            ({"content": message["content"]}, None),
+            ({}, "stop"),
+        ]:
+            chunk = {
+                "id": completion["id"],
+                "object": "chat.completion.chunk",
+                "created": completion["created"],
+                "model": completion["model"],
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host="127.0.0.1", port=0, **kwargs):
+    # Port 0 picks a free port, read it back from server.endpoint.
+    server = MockOpenAIServer((host, port), **kwargs)
+    thread = threading.Thread(
+        target=server.serve_forever, name="mock-openai-server", daemon=True
+    )
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve a rate limited fake Azure OpenAI deployment locally."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--tokens-per-minute", type=int)
+    parser.add_argument("--requests-per-minute", type=int)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--completion-tokens", type=int, default=50)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(
+        (args.host, args.port),
+        tokens_per_minute=args.tokens_per_minute,
+        requests_per_minute=args.requests_per_minute,
+        latency_ms=args.latency_ms,
+        completion_tokens=args.completion_tokens,
+    )
+    print(f"Serving a mock Azure OpenAI deployment on {server.endpoint}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
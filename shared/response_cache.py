@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import openai
+
+# A two level cache for chat completions.
+#
+#   1. Exact: a hash of the model, the messages and the functions.  Only hits
+#      when the whole conversation is identical.
+#   2. Semantic: an embedding of the question, compared against the questions
+#      we've already answered with a cosine search.  Hits when someone asks
+#      nearly the same thing.
+#
+# The semantic level only looks at conversations that are a single question.
+# A follow up like "is it cheap?" means something different in every
+# conversation, so matching it against someone else's would be wrong.
+#
+# Entries are evicted least recently used first, and expire after a TTL.
+# With a path, every new entry is appended to a JSONL file and the cache is
+# reloaded from it on startup.
+
+
+class AzureOpenAIEmbedder:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def __call__(self, text):
+        response = openai.Embedding.create(engine=self.engine, input=[text])
+        return np.asarray(response["data"][0]["embedding"], dtype=np.float32)
+
+
+class HashingEmbedder:
+    """Deterministic local embedder, for tests and running without Azure.
+
+    Words are hashed into buckets (with a sign, so collisions tend to cancel
+    out).  Texts that share most of their words end up close together.
+    """
+
+    def __init__(self, dimensions=256):
+        self.dimensions = dimensions
+
+    def __call__(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode()).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+
+        return vector
+
+
+def _hash(value):
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def _scope_id(scope):
+    # Scopes are hex digests, the first 15 digits fit in an int64, which lets
+    # us filter slots by scope with one array comparison.
+    return int(scope[:15], 16)
+
+
+def _normalize(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class CacheLookup:
+    def __init__(self, key, scope, text):
+        self.key = key
+        self.scope = scope
+        self.text = text
+        self.embedding = None
+        self.response = None
+        self.level = "miss"
+        self.similarity = None
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        embedder,
+        threshold=0.95,
+        max_entries=1000,
+        ttl_seconds=24 * 60 * 60,
+        path=None,
+    ):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.stats = {"exact": 0, "semantic": 0, "miss": 0, "embedErrors": 0}
+
+        # key -> {"response", "created", "slot"}, oldest use first.
+        self._entries = OrderedDict()
+        # One row per slot, rows are normalized so a dot product is the
+        # cosine similarity.  Allocated when we see the first embedding.
+        self._matrix = None
+        self._slot_keys = [None] * max_entries
+        self._slot_scopes = np.zeros(max_entries, dtype=np.int64)
+        self._slot_created = np.zeros(max_entries, dtype=np.float64)
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self._load()
+
+    def lookup(self, model, messages, functions=None):
+        lookup = CacheLookup(
+            key=_hash([model, messages, functions]),
+            scope=_hash([model, functions]),
+            text=self._semantic_text(messages),
+        )
+
+        with self._lock:
+            entry = self._get_entry(lookup.key)
+
+            if entry is not None:
+                lookup.response = entry["response"]
+                lookup.level = "exact"
+                self.stats["exact"] += 1
+                return lookup
+
+        if lookup.text is not None:
+            try:
+                lookup.embedding = _normalize(self.embedder(lookup.text))
+            except Exception:
+                # The cache is an optimization, a failed embedding shouldn't
+                # stop the completion.
+                with self._lock:
+                    self.stats["embedErrors"] += 1
+
+        with self._lock:
+            if lookup.embedding is not None and self._matrix is not None:
+                self._semantic_match(lookup)
+
+            self.stats[lookup.level] += 1
+
+        return lookup
+
+    def put(self, lookup, response):
+        record = {
+            "key": lookup.key,
+            "scope": lookup.scope,
+            "embedding": None
+            if lookup.embedding is None
+            else lookup.embedding.tolist(),
+            "response": response,
+            "created": time.time(),
+        }
+
+        with self._lock:
+            self._add(record["key"], record["scope"], lookup.embedding, response)
+
+        if self.path:
+            with open(self.path, "a") as cache_file:
+                cache_file.write(json.dumps(record) + "\n")
+
+    def _semantic_text(self, messages):
+        user_messages = [m for m in messages if m["role"] == "user"]
+
+        if len(user_messages) != 1:
+            return None
+
+        return user_messages[0]["content"]
+
+    def _semantic_match(self, lookup):
+        if self._matrix.shape[1] != lookup.embedding.shape[0]:
+            return
+
+        scores = self._matrix @ lookup.embedding
+        # Expired entries are left out here, before picking the best, so one
+        # doesn't hide a fresh match that is nearly as close.
+        mask = (
+            self._valid
+            & (self._slot_scopes == _scope_id(lookup.scope))
+            & (self._slot_created >= time.time() - self.ttl_seconds)
+        )
+        scores = np.where(mask, scores, -np.inf)
+        slot = int(np.argmax(scores))
+
+        if scores[slot] < self.threshold:
+            return
+
+        entry = self._get_entry(self._slot_keys[slot])
+
+        if entry is not None:
+            lookup.response = entry["response"]
+            lookup.level = "semantic"
+            lookup.similarity = float(scores[slot])
+
+    def _get_entry(self, key):
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        if time.time() - entry["created"] > self.ttl_seconds:
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def _add(self, key, scope, embedding, response, created=None):
+        if key in self._entries:
+            self._remove(key)
+
+        if not self._free_slots:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+
+        slot = self._free_slots.pop()
+        created = created or time.time()
+        self._entries[key] = {"response": response, "created": created, "slot": slot}
+        self._slot_keys[slot] = key
+        self._slot_scopes[slot] = _scope_id(scope)
+        self._slot_created[slot] = created
+
+        if embedding is not None:
+            if self._matrix is None:
+                self._matrix = np.zeros(
+                    (self.max_entries, embedding.shape[0]), dtype=np.float32
+                )
+
+            if self._matrix.shape[1] == embedding.shape[0]:
+                self._matrix[slot] = embedding
+                self._valid[slot] = True
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        slot = entry["slot"]
+        self._valid[slot] = False
+        self._slot_keys[slot] = None
+        self._slot_scopes[slot] = 0
+        self._slot_created[slot] = 0
+        self._free_slots.append(slot)
+
+    def _load(self):
+        now = time.time()
+
+        with open(self.path) as cache_file:
+            records = [json.loads(line) for line in cache_file if line.strip()]
+
+        # Only the newest entries that are still fresh are worth keeping.
+        records = [r for r in records if now - r["created"] <= self.ttl_seconds]
+        records = records[-self.max_entries :]
+
+        for record in records:
+            embedding = record["embedding"]
+            self._add(
+                record["key"],
+                record["scope"],
+                None if embedding is None else np.asarray(embedding, np.float32),
+                record["response"],
+                created=record["created"],
+            )
+
+        # Rewrite the file with just what we kept, so it doesn't grow forever.
+        temp_path = self.path + ".tmp"
+
+        with open(temp_path, "w") as cache_file:
+            for record in records:
+                cache_file.write(json.dumps(record) + "\n")
+
+        os.replace(temp_path, self.path)
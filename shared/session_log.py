@@ -0,0 +1,416 @@
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from shared.message_store import Message, MessageStore, as_openai_message
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Keeps each session's chat history on disk, so it survives a restart, any
+# worker process can pick a session up, and idle sessions don't have to stay
+# in memory.
+#
+# Every session is one append-only file of records, each a 5 byte header (4
+# byte length, 1 byte kind) followed by that many bytes of JSON.  A message is
+# written once when it is added; feedback is written as its own record rather
+# than rewriting the message.  A message record starts with a line of its own
+# with the role and completion id, then the message.
+#
+# Opening a session maps the file and only reads the headers and those first
+# lines, which is enough to find where each turn starts and which message has
+# a completion id.  A message is decoded the first time something looks at it.
+# Appends take an exclusive flock, and first read anything other processes
+# have added since we last looked, so every process sees the same order.
+# Without fcntl (Windows) the locking is skipped, which is only safe with a
+# single process.
+#
+# SessionRegistry holds the open sessions and closes the least recently used
+# ones past max_sessions.  A closed store reopens itself if it is used again,
+# and anyone still reading its old messages carries on from the file.
+
+HEADER = struct.Struct(">IB")
+# Written before message records had the index line, decoded when the file is
+# opened.
+MESSAGE_RECORD = 1
+FEEDBACK_RECORD = 2
+INDEXED_MESSAGE_RECORD = 3
+
+PERSISTED_FIELDS = [
+    "role",
+    "content",
+    "tool_calls",
+    "tool_call_id",
+    "function_name",
+    "completion_id",
+    "usage",
+    "detail",
+    "stats",
+]
+
+SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+@contextmanager
+def _locked(file, exclusive):
+    if fcntl is None:
+        yield
+        return
+
+    fcntl.flock(file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    try:
+        yield
+    finally:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def _dumps(value):
+    # No indent, so newlines inside strings are escaped and the only newline
+    # in a message record is the one after its index line.
+    return json.dumps(value, separators=(",", ":"), default=str).encode()
+
+
+def _encode(kind, value):
+    payload = _dumps(value)
+    return HEADER.pack(len(payload), kind) + payload
+
+
+def _encode_message(record):
+    index = {"role": record["role"], "completionId": record["completion_id"]}
+    payload = _dumps(index) + b"\n" + _dumps(record)
+    return HEADER.pack(len(payload), INDEXED_MESSAGE_RECORD) + payload
+
+
+def _scan(buffer, start, end):
+    # Yields (kind, payload offset, payload length) for each complete record.
+    offset = start
+
+    while offset + HEADER.size <= end:
+        length, kind = HEADER.unpack_from(buffer, offset)
+
+        if offset + HEADER.size + length > end:
+            break
+
+        yield kind, offset + HEADER.size, length
+        offset += HEADER.size + length
+
+
+def _to_message(record):
+    return Message(**{field: record.get(field) for field in PERSISTED_FIELDS})
+
+
+class LazyMessages:
+    # A list of messages where the ones read from the file are kept as
+    # (offset, length) into the mapped file until someone looks at them.
+    #
+    # The registry may close the store (unmapping the file) while someone is
+    # still reading this list, so decoding takes the store's lock, and once
+    # the store has been closed the bytes are read from the file instead.  The
+    # file is only ever appended to, so the offsets stay good.
+
+    def __init__(self, path, buffer, lock, decoded):
+        self.path = path
+        self.buffer = buffer
+        self.lock = lock
+        self.items = []
+        # Called with every message as it's decoded, until the store closes.
+        self.decoded = decoded
+        self.closed = False
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.items)))]
+
+        with self.lock:
+            item = self.items[index]
+
+            if isinstance(item, tuple):
+                item = _to_message(json.loads(self._read(*item)))
+                self.items[index] = item
+
+                if not self.closed:
+                    self.decoded(item)
+
+            return item
+
+    def __iter__(self):
+        for index in range(len(self.items)):
+            yield self[index]
+
+    def append(self, item):
+        self.items.append(item)
+
+    def close(self):
+        self.closed = True
+        self.buffer = None
+
+    def _read(self, offset, length):
+        if not self.closed:
+            return self.buffer[offset : offset + length]
+
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            return file.read(length)
+
+
+class PersistentMessageStore(MessageStore):
+    def __init__(self, path, to_wire=as_openai_message):
+        super().__init__(to_wire)
+        self.path = path
+        self._lock = threading.RLock()
+        self._file = None
+        self._buffer = None
+        self._end = 0
+        self._pending_feedback = {}
+        # completion id -> position, for messages that aren't decoded yet.
+        self._completion_positions = {}
+
+    @property
+    def messages(self):
+        with self._lock:
+            if self._file is None:
+                self._open()
+
+            return self._messages
+
+    @property
+    def is_open(self):
+        return self._file is not None
+
+    def turn_starts(self):
+        with self._lock:
+            if self._file is None:
+                self._open()
+
+            return self._turn_starts
+
+    def refresh(self):
+        # Pick up anything other processes have written.  Cheap when nothing
+        # has changed, it's one fstat.
+        with self._lock:
+            if self._file is None:
+                self._open()
+                return
+
+            with _locked(self._file, exclusive=False):
+                self._catch_up()
+
+    def append(self, role, content=None, **fields):
+        message = Message(role, content, **fields)
+        record = {field: getattr(message, field) for field in PERSISTED_FIELDS}
+        self._write(_encode_message(record), lambda: self._add(message))
+        return message
+
+    def set_feedback(self, completion_id, feedback):
+        record = {"completionId": completion_id, "feedback": feedback}
+        self._write(
+            _encode(FEEDBACK_RECORD, record),
+            lambda: self._apply_feedback(completion_id, feedback),
+        )
+        return self.find(completion_id)
+
+    def find(self, completion_id):
+        with self._lock:
+            messages = self.messages
+            message = self._by_completion_id.get(completion_id)
+
+            if message is None:
+                position = self._completion_positions.get(completion_id)
+
+                if position is not None:
+                    # Decoding it indexes it.
+                    message = messages[position]
+
+            return message
+
+    def close(self):
+        # Drops everything we hold in memory, the next use reads it back.
+        with self._lock:
+            if isinstance(self._messages, LazyMessages):
+                # Anyone still holding the list reads from the file from now on.
+                self._messages.close()
+
+            if self._buffer is not None:
+                self._buffer.close()
+
+            if self._file is not None:
+                self._file.close()
+
+            self._file = None
+            self._buffer = None
+            self._messages = []
+            self._by_completion_id = {}
+            self._turn_starts = []
+            self._completion_positions = {}
+            self._pending_feedback = {}
+            self._end = 0
+
+    def _open(self):
+        self._file = open(self.path, "a+b")
+
+        with _locked(self._file, exclusive=False):
+            size = os.fstat(self._file.fileno()).st_size
+
+            if size:
+                self._buffer = mmap.mmap(
+                    self._file.fileno(), size, access=mmap.ACCESS_READ
+                )
+
+            self._messages = LazyMessages(
+                self.path, self._buffer, self._lock, self._index
+            )
+
+            for kind, offset, length in _scan(self._buffer, 0, size):
+                if kind == INDEXED_MESSAGE_RECORD:
+                    newline = self._buffer.find(b"\n", offset, offset + length)
+                    index = json.loads(self._buffer[offset:newline])
+                    self._add_unread(
+                        index["role"],
+                        index["completionId"],
+                        (newline + 1, offset + length - newline - 1),
+                    )
+                elif kind == MESSAGE_RECORD:
+                    record = json.loads(self._buffer[offset : offset + length])
+                    self._add(_to_message(record))
+                elif kind == FEEDBACK_RECORD:
+                    record = json.loads(self._buffer[offset : offset + length])
+                    self._apply_feedback(record["completionId"], record["feedback"])
+
+                self._end = offset + length
+
+    def _catch_up(self):
+        size = os.fstat(self._file.fileno()).st_size
+
+        if size <= self._end:
+            return
+
+        self._file.seek(self._end)
+        new_bytes = self._file.read(size - self._end)
+        consumed = 0
+
+        for kind, offset, length in _scan(new_bytes, 0, len(new_bytes)):
+            payload = new_bytes[offset : offset + length]
+
+            if kind == INDEXED_MESSAGE_RECORD:
+                # Skip the index line, we decode these straight away.
+                payload = payload[payload.index(b"\n") + 1 :]
+
+            record = json.loads(payload)
+
+            if kind in (MESSAGE_RECORD, INDEXED_MESSAGE_RECORD):
+                self._add(_to_message(record))
+            elif kind == FEEDBACK_RECORD:
+                self._apply_feedback(record["completionId"], record["feedback"])
+
+            consumed = offset + length
+
+        self._end += consumed
+
+    def _write(self, data, apply):
+        with self._lock:
+            if self._file is None:
+                self._open()
+
+            with _locked(self._file, exclusive=True):
+                self._catch_up()
+                # The file is opened for append, so this always lands at the
+                # end, in one write.
+                os.write(self._file.fileno(), data)
+                self._end += len(data)
+                apply()
+
+    def _index(self, message):
+        if message.completion_id is not None:
+            self._by_completion_id[message.completion_id] = message
+            feedback = self._pending_feedback.pop(message.completion_id, None)
+
+            if feedback is not None:
+                message.feedback = feedback
+
+    def _add(self, message):
+        super()._add(message)
+        self._index(message)
+
+    def _add_unread(self, role, completion_id, location):
+        if role == "user":
+            self._turn_starts.append(len(self._messages))
+
+        if completion_id is not None:
+            self._completion_positions[completion_id] = len(self._messages)
+
+        self._messages.append(location)
+
+    def _apply_feedback(self, completion_id, feedback):
+        message = self._by_completion_id.get(completion_id)
+
+        if message is None:
+            # Not decoded yet, it picks this up when it is.
+            self._pending_feedback[completion_id] = feedback
+        else:
+            message.feedback = feedback
+
+
+class SessionRegistry:
+    def __init__(self, directory, to_wire=as_openai_message, max_sessions=100):
+        self.directory = directory
+        self.to_wire = to_wire
+        self.max_sessions = max_sessions
+        self.stats = {"opened": 0, "evicted": 0}
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, session_id):
+        if not SESSION_ID_PATTERN.fullmatch(session_id):
+            raise ValueError(f"Bad session id {session_id}.")
+
+        with self._lock:
+            store = self._sessions.get(session_id)
+
+            if store is None:
+                store = PersistentMessageStore(
+                    os.path.join(self.directory, f"{session_id}.log"), self.to_wire
+                )
+                self._sessions[session_id] = store
+                self.stats["opened"] += 1
+
+            self._sessions.move_to_end(session_id)
+
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                evicted.close()
+                self.stats["evicted"] += 1
+
+        store.refresh()
+        return store
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "open": len(self._sessions)}
+
+
+def get_session_id():
+    # Kept in the URL, so a reload (or a different worker) finds the same
+    # session on disk.  Only the Streamlit apps call this, so only they need
+    # streamlit.
+    import streamlit as st
+
+    session_id = st.query_params.get("session")
+
+    if not session_id or not SESSION_ID_PATTERN.fullmatch(session_id):
+        session_id = uuid.uuid4().hex
+        st.query_params["session"] = session_id
+
+    return session_id
@@ -0,0 +1,180 @@
+import time
+
+from openai.util import convert_to_openai_object
+
+
+# Helpers for reading a ChatCompletion created with stream=True.  The chunks
+# carry small deltas: a bit of content, or a fragment of a tool call's
+# arguments.  We stitch them back together as they arrive.
+#
+# Content is handed on as deltas too.  Redrawing a Streamlit placeholder with
+# the whole answer on every chunk is quadratic in the length of the answer,
+# so ThrottledTextWriter collects the deltas and redraws at most every
+# WRITE_INTERVAL_SECONDS.
+
+WRITE_INTERVAL_SECONDS = 0.05
+
+
+def _finish_tool_call(tool_call, on_tool_call):
+    if tool_call is not None and on_tool_call is not None:
+        on_tool_call(tool_call)
+
+
+class ThrottledTextWriter:
+    # An on_content for collect_stream that shows the text so far with
+    # write(text), no more often than every interval seconds.
+
+    def __init__(self, write, interval=WRITE_INTERVAL_SECONDS):
+        self.write = write
+        self.interval = interval
+        self.parts = []
+        self.written = 0
+        self.last_write = 0.0
+
+    def __call__(self, delta):
+        self.parts.append(delta)
+        now = time.perf_counter()
+
+        if now - self.last_write >= self.interval:
+            self.last_write = now
+            self.flush()
+
+    def flush(self):
+        if len(self.parts) > self.written:
+            self.written = len(self.parts)
+            self.write("".join(self.parts))
+
+
+def collect_stream(chunks, started, on_content=None, on_tool_call=None):
+    # started is time.perf_counter() from just before the request was made.
+    # on_content(delta) gets each new piece of content.  If it has a flush()
+    # (like ThrottledTextWriter) that is called when the stream ends.
+    # on_tool_call(tool_call) gets each tool call as soon as its arguments are
+    # complete, so the caller can start running it while the rest streams in.
+    result = {
+        "id": None,
+        "role": "assistant",
+        "content": None,
+        "tool_calls": None,
+        "finish_reason": None,
+        "prompt_filter_results": {},
+        "content_filter_results": {},
+        "chunks": 0,
+        "content_chunks": 0,
+        "time_to_first_token": None,
+        "elapsed": None,
+    }
+    content_parts = []
+    tool_calls = []
+    current_tool_call = None
+
+    for chunk in chunks:
+        result["chunks"] += 1
+        result["id"] = result["id"] or chunk.get("id")
+
+        # Azure sends the prompt filter results in a chunk of their own.
+        prompt_results = chunk.get("prompt_filter_results") or chunk.get(
+            "prompt_annotations"
+        )
+
+        if prompt_results:
+            result["prompt_filter_results"] = prompt_results[0].get(
+                "content_filter_results", {}
+            )
+
+        if not chunk.get("choices"):
+            continue
+
+        choice = chunk["choices"][0]
+        delta = choice.get("delta") or {}
+
+        if choice.get("content_filter_results"):
+            result["content_filter_results"] = choice["content_filter_results"]
+
+        if delta.get("role"):
+            result["role"] = delta["role"]
+
+        if delta.get("content"):
+            if result["time_to_first_token"] is None:
+                result["time_to_first_token"] = time.perf_counter() - started
+
+            content_parts.append(delta["content"])
+            result["content_chunks"] += 1
+
+            if on_content is not None:
+                on_content(delta["content"])
+
+        for fragment in delta.get("tool_calls") or []:
+            if result["time_to_first_token"] is None:
+                result["time_to_first_token"] = time.perf_counter() - started
+
+            # Tool calls stream one after another, so the first fragment of
+            # the next call means the previous one is done.
+            if current_tool_call is None or fragment["index"] != current_tool_call[0]:
+                _finish_tool_call(
+                    current_tool_call and current_tool_call[1], on_tool_call
+                )
+                tool_call = {
+                    "id": fragment.get("id"),
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""},
+                }
+                tool_calls.append(tool_call)
+                current_tool_call = (fragment["index"], tool_call)
+
+            tool_call = current_tool_call[1]
+            function = fragment.get("function") or {}
+            tool_call["id"] = tool_call["id"] or fragment.get("id")
+            tool_call["function"]["name"] += function.get("name") or ""
+            tool_call["function"]["arguments"] += function.get("arguments") or ""
+
+        if choice.get("finish_reason"):
+            result["finish_reason"] = choice["finish_reason"]
+
+    _finish_tool_call(current_tool_call and current_tool_call[1], on_tool_call)
+
+    if hasattr(on_content, "flush"):
+        on_content.flush()
+
+    result["elapsed"] = time.perf_counter() - started
+    result["content"] = "".join(content_parts) if content_parts else None
+    result["tool_calls"] = tool_calls or None
+
+    return result
+
+
+def as_completion(streamed):
+    # Shape a streamed result like a regular ChatCompletion, so code that logs
+    # or displays completions doesn't need to care how it was created.
+    # Streaming doesn't report usage, but Azure sends one token per content
+    # chunk, which is close enough to count completion tokens.
+    message = {"role": streamed["role"], "content": streamed["content"]}
+
+    if streamed["tool_calls"]:
+        message["tool_calls"] = streamed["tool_calls"]
+
+    return convert_to_openai_object(
+        {
+            "id": streamed["id"],
+            "object": "chat.completion",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": streamed["finish_reason"],
+                    "content_filter_results": streamed["content_filter_results"],
+                }
+            ],
+            "prompt_annotations": [
+                {
+                    "prompt_index": 0,
+                    "content_filter_results": streamed["prompt_filter_results"],
+                }
+            ],
+            "usage": {
+                "completion_tokens": streamed["content_chunks"],
+                "estimated": True,
+            },
+            "time_to_first_token": streamed["time_to_first_token"],
+        }
+    )
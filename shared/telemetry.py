@@ -0,0 +1,130 @@
+import json
+import queue
+import threading
+import time
+
+# Ships telemetry from a background thread, so the request path only pays for
+# putting a record on a queue.
+#
+# The worker sends a batch when it has batch_size records or when
+# flush_interval seconds have passed since the first record in the batch,
+# whichever comes first.  If the queue is full (the sink is down or slow) new
+# records are dropped and counted rather than blocking the caller.
+#
+# A sink is anything with an export(records) method.  Each record is
+# {"message": str, "customDimensions": dict, "timestamp": float}.
+
+
+class AzureLogSink:
+    def __init__(self, logger, handler):
+        self.logger = logger
+        self.handler = handler
+
+    def export(self, records):
+        for record in records:
+            self.logger.info(
+                record["message"],
+                extra={"custom_dimensions": record["customDimensions"]},
+            )
+
+        # This is the slow part, a network call to Application Insights.
+        self.handler.flush()
+
+
+class FileSink:
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, records):
+        with open(self.path, "a") as telemetry_file:
+            for record in records:
+                telemetry_file.write(json.dumps(record, default=str) + "\n")
+
+
+class MemorySink:
+    def __init__(self):
+        self.records = []
+
+    def export(self, records):
+        self.records.extend(records)
+
+
+class TelemetryExporter:
+    def __init__(self, sink, max_queue=1000, batch_size=50, flush_interval=5.0):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "exported": 0,
+            "batches": 0,
+            "exportErrors": 0,
+        }
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stats_lock = threading.Lock()
+        self._worker = threading.Thread(
+            target=self._run, name="telemetry-exporter", daemon=True
+        )
+        self._worker.start()
+
+    def emit(self, message, custom_dimensions):
+        record = {
+            "message": message,
+            "customDimensions": custom_dimensions,
+            "timestamp": time.time(),
+        }
+
+        try:
+            self._queue.put_nowait(record)
+            self._count("enqueued")
+        except queue.Full:
+            self._count("dropped")
+
+    def flush(self, timeout=None):
+        # Wait until everything queued so far has been exported.  Only meant
+        # for tests and shutdown, the request path should never call this.
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+
+            time.sleep(0.01)
+
+        return True
+
+    def get_stats(self):
+        with self._stats_lock:
+            return {**self.stats, "queued": self._queue.qsize()}
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self.sink.export(batch)
+                self._count("exported", len(batch))
+                self._count("batches")
+            except Exception:
+                # Telemetry must never take the app down, count it and move on.
+                self._count("exportErrors")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+
+from shared.telemetry import FileSink, MemorySink, TelemetryExporter
+
+# Nested timing spans, so we can see where each framework spends its time:
+#
+#   with span("llm call", model=...) as llm_span:
+#       ...
+#       llm_span.set(promptTokens=..., completionTokens=...)
+#
+# A span started inside another one (on the same thread or asyncio task, or
+# on a worker started with contextvars.copy_context()) becomes its child.
+# Finished spans go through a TelemetryExporter, so writing them happens on a
+# background thread.
+#
+# TRACE_SINK picks where they go: "file:<path>" appends JSONL, "memory" keeps
+# them in a list (for tests and benchmarks).  Unset, tracing is off and span()
+# hands back one shared do-nothing object, which costs about a function call.
+
+_current_span = ContextVar("current_span", default=None)
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        self.tracer.export(
+            {
+                "name": self.name,
+                "traceId": self.trace_id,
+                "spanId": self.span_id,
+                "parentId": self.parent_id,
+                "startTime": self.started_at,
+                "durationMs": round((time.perf_counter() - self.started) * 1000, 3),
+                "error": error,
+                "attributes": self.attributes,
+            }
+        )
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        _current_span.reset(self._token)
+        self.end(f"{exc_type.__name__}: {exc}" if exc_type else None)
+        return False
+
+
+class Tracer:
+    def __init__(self, exporter=None):
+        # No exporter means tracing is off.
+        self.exporter = exporter
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def span(self, name, **attributes):
+        # Use with "with", it becomes the current span until it ends.
+        if self.exporter is None:
+            return NOOP_SPAN
+
+        return Span(self, name, _current_span.get(), attributes)
+
+    def start_span(self, name, parent=None, **attributes):
+        # For callbacks that get a start and an end rather than a block.  The
+        # span is not made current, call end() on it when it's done.
+        if self.exporter is None:
+            return NOOP_SPAN
+
+        if parent is None or parent is NOOP_SPAN:
+            parent = _current_span.get()
+
+        return Span(self, name, parent, attributes)
+
+    def export(self, record):
+        self.exporter.emit("span", record)
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def create_tracer(trace_sink):
+    if not trace_sink:
+        return Tracer()
+
+    if trace_sink == "memory":
+        sink = MemorySink()
+    elif trace_sink.startswith("file:"):
+        sink = FileSink(trace_sink[len("file:") :])
+    else:
+        raise ValueError(f"Unknown TRACE_SINK {trace_sink}.")
+
+    return Tracer(TelemetryExporter(sink, flush_interval=1.0))
+
+
+def get_tracer():
+    # Made on first use, after the apps have loaded their .env.
+    global _tracer
+
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = create_tracer(os.environ.get("TRACE_SINK"))
+
+    return _tracer
+
+
+def span(name, **attributes):
+    return get_tracer().span(name, **attributes)
+
+
+def start_span(name, parent=None, **attributes):
+    return get_tracer().start_span(name, parent, **attributes)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The apps import each other from the repo root (shared.*, my_openai.*), so
+# the tests do too, however pytest was started.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,157 @@
+import threading
+import time
+
+import pytest
+
+from shared.deadlines import (
+    HEDGE_MIN_SAMPLES,
+    Backend,
+    DeadlineExceeded,
+    deadline,
+    get_backend,
+    get_timeout_stats,
+    is_timeout,
+    remaining,
+    timeout_for,
+)
+
+
+def counters(name):
+    return get_timeout_stats().get(name, {})
+
+
+@pytest.fixture
+def unstuck():
+    # Set at the end of the test, so calls that were left "stuck" finish.
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def test_deadlines_nest_and_only_get_shorter():
+    assert remaining() is None
+
+    with deadline(10):
+        with deadline(60):
+            assert remaining() <= 10
+
+        with deadline(1):
+            assert remaining() <= 1
+
+        assert 1 < remaining() <= 10
+
+    assert remaining() is None
+
+
+def test_timeouts_are_cut_to_the_deadline():
+    assert timeout_for("deadlines-test", 30) == 30
+
+    with deadline(5):
+        assert timeout_for("deadlines-test", 30) <= 5
+        assert timeout_for("deadlines-test", 1) == 1
+
+
+def test_nothing_is_sent_after_the_deadline():
+    calls = []
+    backend = Backend("deadlines-expired", 10)
+
+    with deadline(0.01):
+        time.sleep(0.02)
+
+        with pytest.raises(DeadlineExceeded):
+            backend.call(calls.append)
+
+    assert calls == []
+    assert counters("deadlines-expired")["deadlineExceeded"] == 1
+
+
+def test_timeouts_are_recognized_through_wrapping():
+    try:
+        try:
+            raise TimeoutError("read timed out")
+        except TimeoutError as e:
+            raise RuntimeError("the framework's own error") from e
+    except RuntimeError as e:
+        assert is_timeout(e)
+
+    assert not is_timeout(ValueError("bad request"))
+
+
+def test_failed_and_timed_out_attempts_count_towards_the_latencies():
+    backend = Backend("deadlines-failures", 10)
+
+    def times_out(timeout):
+        time.sleep(0.05)
+        raise TimeoutError("too slow")
+
+    with pytest.raises(TimeoutError):
+        backend.call(times_out)
+
+    assert counters("deadlines-failures")["timeouts"] == 1
+    assert len(backend.latencies) == 1
+    assert backend.latencies[0] >= 0.05
+
+
+def test_hedging_waits_for_enough_samples():
+    backend = Backend("deadlines-samples", 10, hedge=True)
+    backend.latencies.extend([0.01] * (HEDGE_MIN_SAMPLES - 1))
+
+    assert backend.hedge_delay() is None
+
+    backend.latencies.append(0.02)
+
+    assert backend.hedge_delay() == 0.02
+
+
+def test_a_stuck_call_is_hedged_and_the_second_answer_used(unstuck):
+    backend = Backend("deadlines-hedged", 10, hedge=True)
+    backend.latencies.extend([0.01] * HEDGE_MIN_SAMPLES)
+    attempts = []
+
+    def lookup(timeout):
+        attempts.append(timeout)
+
+        if len(attempts) == 1:
+            unstuck.wait(5)
+            return "stuck"
+
+        return "hedge"
+
+    started = time.monotonic()
+
+    assert backend.call(lookup) == "hedge"
+    assert time.monotonic() - started < 1
+    assert counters("deadlines-hedged")["hedges"] == 1
+    assert counters("deadlines-hedged")["hedgeWins"] == 1
+
+
+def test_a_hedged_call_still_stops_at_the_deadline(unstuck):
+    backend = Backend("deadlines-hedged-out", 10, hedge=True)
+    backend.latencies.extend([0.01] * HEDGE_MIN_SAMPLES)
+
+    with deadline(0.2), pytest.raises(DeadlineExceeded):
+        backend.call(lambda timeout: unstuck.wait(5))
+
+    assert counters("deadlines-hedged-out")["hedges"] == 1
+    assert counters("deadlines-hedged-out")["deadlineExceeded"] == 1
+
+
+def test_bounded_calls_are_abandoned_at_the_timeout(unstuck):
+    backend = Backend("deadlines-bounded", 0.1)
+    started = time.monotonic()
+
+    with pytest.raises(TimeoutError):
+        backend.call_bounded(lambda: unstuck.wait(5))
+
+    assert time.monotonic() - started < 1
+    assert counters("deadlines-bounded")["timeouts"] == 1
+    assert backend.call_bounded(lambda: "quick") == "quick"
+
+
+def test_a_backend_is_shared_only_with_the_same_settings():
+    backend = get_backend("deadlines-shared", 5, hedge=True)
+
+    assert get_backend("deadlines-shared", 5, hedge=True) is backend
+
+    with pytest.raises(ValueError):
+        get_backend("deadlines-shared", 10)
@@ -0,0 +1,125 @@
+import time
+
+import pytest
+
+from shared import deployment_router
+from shared.deployment_router import (
+    CLOSED,
+    FAILURE_THRESHOLD,
+    HALF_OPEN,
+    OPEN,
+    DeploymentRouter,
+)
+
+
+class ServiceUnavailable(Exception):
+    status_code = 503
+
+
+@pytest.fixture(autouse=True)
+def no_exploring(monkeypatch):
+    # Otherwise now and then a call goes to a random deployment.
+    monkeypatch.setattr(deployment_router, "EXPLORE_RATE", 0)
+
+
+def make_router(*names):
+    return DeploymentRouter(
+        [{"name": n, "endpoint": "", "apiKey": "", "model": n} for n in names],
+        max_retries=0,
+        seed=1,
+    )
+
+
+def failing_on(*names):
+    calls = []
+
+    def function(deployment):
+        calls.append(deployment.name)
+
+        if deployment.name in names:
+            raise ServiceUnavailable()
+
+        return deployment.name
+
+    return function, calls
+
+
+def test_circuit_opens_after_repeated_failures():
+    router = make_router("east", "west")
+    east = router.deployments[0]
+    function, calls = failing_on("east")
+
+    for _ in range(FAILURE_THRESHOLD):
+        assert router.call(function, 100) == "west"
+
+    assert east.state == OPEN
+    assert east.stats["circuitOpened"] == 1
+
+    # Now it's left alone.
+    calls.clear()
+    assert router.call(function, 100) == "west"
+    assert calls == ["west"]
+    assert east.in_flight == 0
+
+
+def test_half_open_trial_closes_the_circuit_when_it_works():
+    router = make_router("east", "west")
+    east = router.deployments[0]
+    east.state = OPEN
+    east.opened_at -= deployment_router.COOLDOWN_SECONDS
+    seen = []
+
+    def function(deployment):
+        seen.append((deployment.name, deployment.state))
+
+        if deployment.name == "east":
+            # Only the trial call gets in while it's half open.
+            assert router.call(function, 100) == "west"
+
+        return deployment.name
+
+    assert router.call(function, 100) == "east"
+    assert seen == [("east", HALF_OPEN), ("west", CLOSED)]
+    assert east.state == CLOSED
+
+
+def test_half_open_trial_reopens_the_circuit_when_it_fails():
+    router = make_router("east", "west")
+    east = router.deployments[0]
+    east.state = OPEN
+    east.opened_at -= deployment_router.COOLDOWN_SECONDS
+    function, calls = failing_on("east")
+
+    assert router.call(function, 100) == "west"
+    assert calls == ["east", "west"]
+    assert east.state == OPEN
+    assert east.stats["circuitOpened"] == 1
+
+
+def test_open_circuits_are_still_tried_before_giving_up():
+    router = make_router("east", "west")
+    west = router.deployments[1]
+    # Still cooling down, so it wouldn't be picked while east looks fine.
+    west.state = OPEN
+    west.opened_at = time.monotonic()
+    function, calls = failing_on("east")
+
+    assert router.call(function, 100) == "west"
+    assert calls == ["east", "west"]
+    assert west.state == CLOSED
+
+
+def test_interrupted_trial_releases_the_deployment():
+    router = make_router("east")
+    east = router.deployments[0]
+    east.state = OPEN
+    east.opened_at -= deployment_router.COOLDOWN_SECONDS
+
+    def interrupted(deployment):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        router.call(interrupted, 100)
+
+    assert east.in_flight == 0
+    assert east.state == OPEN
@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+from my_openai import hero_stats_cache
+from my_openai.hero_stats_cache import HeroStatsCache
+
+# Long over, so complete, and not started yet, so still filling in.
+PAST = ["2020-01-01", "2020-01-02", "2020-01-03"]
+FUTURE = "2999-01-01"
+
+
+class FakeApi:
+    def __init__(self):
+        self.calls = []
+        self.games = {"2020-01-01": 10, "2020-01-02": 30}
+        self._lock = threading.Lock()
+
+    def __call__(self, start_date, end_date):
+        with self._lock:
+            self.calls.append((start_date, end_date))
+
+        # One hero, winning half of day one's games and all of day two's.
+        rates = {"2020-01-01": 0.5, "2020-01-02": 1.0}
+        return {
+            "heroes": [
+                {
+                    "name": "Li Li",
+                    "role": "Healer",
+                    "winRate": rates.get(start_date, 0.25),
+                    "gamesPlayed": self.games.get(start_date, 4),
+                }
+            ]
+        }
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_days_are_combined_weighted_by_games():
+    api = FakeApi()
+    cache = HeroStatsCache(api)
+
+    [row] = cache.get_range(PAST[0], PAST[1])
+
+    # (0.5 * 10 + 1.0 * 30) / 40
+    assert row["winRate"] == pytest.approx(0.875)
+    assert row["gamesPlayed"] == 40
+
+
+def test_days_without_game_counts_get_a_plain_average():
+    api = FakeApi()
+    api.games = {"2020-01-01": 0, "2020-01-02": 0}
+    cache = HeroStatsCache(api)
+
+    [row] = cache.get_range(PAST[0], PAST[1])
+
+    assert row["winRate"] == pytest.approx(0.75)
+
+
+def test_only_missing_days_are_fetched():
+    api = FakeApi()
+    cache = HeroStatsCache(api)
+    cache.get_range(PAST[0], PAST[1])
+    api.calls.clear()
+
+    cache.get_range(PAST[1], PAST[2])
+
+    assert api.calls == [(PAST[2], PAST[2])]
+    assert cache.stats() == {
+        "cachedDays": 3,
+        "dayHits": 1,
+        "dayMisses": 3,
+        "rangeFetches": 0,
+    }
+
+
+def test_finished_days_never_expire_but_unfinished_ones_do(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(hero_stats_cache, "time", clock)
+    api = FakeApi()
+    cache = HeroStatsCache(api, ttl_seconds=60)
+    cache.get_range(PAST[0], PAST[0])
+    cache.get_range(FUTURE, FUTURE)
+    api.calls.clear()
+
+    clock.now += 61
+    cache.get_range(PAST[0], PAST[0])
+    cache.get_range(FUTURE, FUTURE)
+
+    assert api.calls == [(FUTURE, FUTURE)]
+
+
+def test_long_ranges_are_fetched_whole_and_not_cached():
+    api = FakeApi()
+    cache = HeroStatsCache(api, max_range_days=2)
+
+    cache.get_range(PAST[0], PAST[2])
+
+    assert api.calls == [(PAST[0], PAST[2])]
+    assert cache.stats()["rangeFetches"] == 1
+    assert cache.stats()["cachedDays"] == 0
+
+
+def test_backwards_ranges_are_rejected():
+    with pytest.raises(ValueError):
+        HeroStatsCache(FakeApi()).get_range(PAST[1], PAST[0])
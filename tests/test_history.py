@@ -0,0 +1,104 @@
+import pytest
+
+from shared import history as history_module
+from shared.history import fit_to_budget
+from shared.message_store import Message
+
+COLLAPSED_TOKENS = 10
+
+
+@pytest.fixture(autouse=True)
+def fixed_token_counts(monkeypatch):
+    # The collapsed notes are counted when they're made, give them a known
+    # size whether or not tiktoken is installed.
+    monkeypatch.setattr(history_module, "count_tokens", lambda text: COLLAPSED_TOKENS)
+
+
+def message(role, tokens, **fields):
+    entry = Message(role, f"{role} message", **fields)
+    entry.tokens = tokens
+    return entry
+
+
+def turn(n, tool_tokens=100):
+    # 5 + 5 + tool_tokens + 5 tokens, or 29 with the tool result collapsed
+    # (the note and 4 tokens of message overhead).
+    tool_call = {"id": f"call{n}", "function": {"name": "get_hero_stats"}}
+    return [
+        message("user", 5),
+        message("assistant", 5, tool_calls=[tool_call]),
+        message(
+            "tool",
+            tool_tokens,
+            tool_call_id=f"call{n}",
+            function_name="get_hero_stats",
+            detail=[{"name": "Li Li"}],
+        ),
+        message("assistant", 5),
+    ]
+
+
+class CountingHistory(list):
+    # Remembers which entries were looked at, like a store decoding them.
+    def __init__(self, entries):
+        super().__init__(entries)
+        self.seen = set()
+
+    def __getitem__(self, index):
+        self.seen.add(index)
+        return super().__getitem__(index)
+
+
+def test_older_tool_results_are_collapsed_and_the_latest_turn_kept_whole():
+    history = turn(0) + turn(1)
+
+    fitted = fit_to_budget(history, 1000)
+
+    assert len(fitted) == 8
+    assert fitted[2] is not history[2]
+    assert "left out to save space" in fitted[2].content
+    assert fitted[2].tool_call_id == "call0"
+    assert fitted[4:] == history[4:]
+
+
+def test_oldest_whole_turns_are_dropped_with_a_note():
+    system = message("system", 20)
+    history = [system] + turn(0) + turn(1) + turn(2)
+
+    # The system prompt, the last turn in full, and one collapsed turn.
+    fitted = fit_to_budget(history, 20 + 115 + 29)
+
+    assert fitted[0] is system
+    assert fitted[1].role == "system"
+    assert fitted[1].content.startswith("[4 earlier messages")
+    assert [entry.role for entry in fitted[2:]] == [
+        "user",
+        "assistant",
+        "tool",
+        "assistant",
+    ] * 2
+    assert fitted[-4:] == history[-4:]
+
+
+def test_the_latest_turn_goes_even_over_budget():
+    history = turn(0) + turn(1, tool_tokens=5000)
+
+    fitted = fit_to_budget(history, 100)
+
+    assert fitted[0].content.startswith("[4 earlier messages")
+    assert fitted[1:] == history[4:]
+
+
+def test_a_history_without_questions_is_sent_as_is():
+    history = [message("system", 20)]
+
+    assert fit_to_budget(history, 0) == history
+
+
+def test_only_the_newest_turns_are_looked_at():
+    history = CountingHistory([entry for n in range(50) for entry in turn(n)])
+
+    fit_to_budget(history, 115 + 29)
+
+    # The two turns that fit, and the one that didn't.
+    assert history.seen == set(range(len(history) - 12, len(history)))
@@ -0,0 +1,121 @@
+import random
+import threading
+import time
+
+import pytest
+
+from shared.deadlines import DeadlineExceeded, deadline, get_timeout_stats
+from shared.llm_scheduler import BATCH, INTERACTIVE, LlmScheduler
+
+
+class RateLimitError(Exception):
+    def __init__(self, headers=None):
+        super().__init__("429")
+        self.status_code = 429
+        self.headers = headers or {}
+
+
+def drained(tokens_per_minute, **kwargs):
+    # A scheduler whose token bucket has just been emptied, so the next call
+    # has to queue.
+    scheduler = LlmScheduler(tokens_per_minute=tokens_per_minute, **kwargs)
+    scheduler.call(lambda: None, scheduler.tokens.capacity)
+    return scheduler
+
+
+def wait_for_queue(scheduler, depth):
+    for _ in range(500):
+        if scheduler.get_stats()["queueDepth"] == depth:
+            return
+
+        time.sleep(0.002)
+
+    raise AssertionError(f"queue never got to {depth}")
+
+
+def test_interactive_calls_are_admitted_before_batch_ones():
+    # 1000 tokens a second, so each 100 token call waits about 0.1s.
+    scheduler = drained(60000)
+    order = []
+
+    def run(level):
+        scheduler.call(lambda: order.append(level), 100, priority=level)
+
+    batch = threading.Thread(target=run, args=(BATCH,))
+    batch.start()
+    wait_for_queue(scheduler, 1)
+    interactive = threading.Thread(target=run, args=(INTERACTIVE,))
+    interactive.start()
+    batch.join(5)
+    interactive.join(5)
+
+    assert order == [INTERACTIVE, BATCH]
+    assert scheduler.get_stats()["maxQueueDepth"] == 2
+
+
+def test_retry_after_holds_back_every_call():
+    scheduler = LlmScheduler(max_retries=0)
+
+    def throttled():
+        raise RateLimitError({"Retry-After": "0.2"})
+
+    with pytest.raises(RateLimitError):
+        scheduler.call(throttled, 100)
+
+    # A different call, but the deployment asked us to back off.
+    started = time.monotonic()
+    scheduler.call(lambda: None, 100)
+
+    assert time.monotonic() - started >= 0.15
+    stats = scheduler.get_stats()
+    assert stats["throttled"] == 1
+    assert stats["failed"] == 1
+    assert stats["completed"] == 1
+
+
+def test_retries_after_a_jittered_backoff_without_retry_after():
+    scheduler = LlmScheduler(base_delay=0.2, seed=7)
+    expected_delay = random.Random(7).uniform(0, 0.2)
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+
+        if len(attempts) == 1:
+            raise RateLimitError()
+
+        return "ok"
+
+    assert scheduler.call(flaky, 100) == "ok"
+    assert attempts[1] - attempts[0] >= expected_delay - 0.01
+    assert scheduler.get_stats()["retries"] == 1
+
+
+def test_gives_up_after_max_retries():
+    scheduler = LlmScheduler(max_retries=2, base_delay=0.001)
+    attempts = []
+
+    def throttled():
+        attempts.append(1)
+        raise RateLimitError()
+
+    with pytest.raises(RateLimitError):
+        scheduler.call(throttled, 100)
+
+    assert len(attempts) == 3
+    assert scheduler.get_stats()["failed"] == 1
+
+
+def test_deadline_passing_while_queued_gives_up_the_place():
+    # 10 tokens a second, a 100 token call would wait 10s.
+    scheduler = drained(600)
+    before = get_timeout_stats().get("chat", {}).get("deadlineExceeded", 0)
+    started = time.monotonic()
+
+    with deadline(0.1), pytest.raises(DeadlineExceeded):
+        scheduler.call(lambda: None, 100)
+
+    assert time.monotonic() - started < 2
+    assert scheduler.get_stats()["queueDepth"] == 0
+    assert scheduler.get_stats()["admitted"] == 1
+    assert get_timeout_stats()["chat"]["deadlineExceeded"] == before + 1
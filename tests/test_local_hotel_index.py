@@ -0,0 +1,114 @@
+import pytest
+
+from shared.local_hotel_index import LocalHotelIndex, compile_filter, tokenize
+
+HOTELS = [
+    {
+        "HotelId": "1",
+        "HotelName": "Beach Resort",
+        "Description": "A resort on the beach with a pool, a spa and a pool bar.",
+        "Category": "Resort and Spa",
+        "Tags": ["pool", "beach"],
+        "Rating": 4.5,
+        "Address": {"City": "Miami"},
+    },
+    {
+        "HotelId": "2",
+        "HotelName": "City Inn",
+        "Description": "Downtown rooms, close to the airport.",
+        "Category": "Budget",
+        "Tags": ["free parking"],
+        "Rating": 3,
+        "Address": {"City": "Seattle"},
+    },
+    {
+        "HotelId": "3",
+        "HotelName": "Mountain Lodge",
+        "Description": "Rooms with a view of the mountains, and an indoor pool.",
+        "Category": "Boutique",
+        "Tags": ["view"],
+        "Rating": 4,
+        "Address": {"City": "O'Fallon"},
+        "Rooms": [{"Description": "Suite with fireplace", "BaseRate": 300}],
+    },
+]
+
+
+def ids(results):
+    return [r["HotelId"] for r in results]
+
+
+def test_tokenize_drops_stop_words_and_case():
+    assert tokenize("The Pool and THE Spa") == ["pool", "spa"]
+
+
+def test_more_matching_terms_score_higher():
+    index = LocalHotelIndex(HOTELS)
+
+    assert ids(index.search("pool spa")) == ["1", "3"]
+
+
+def test_rooms_and_address_are_searched_too():
+    index = LocalHotelIndex(HOTELS)
+
+    assert ids(index.search("fireplace")) == ["3"]
+    assert ids(index.search("seattle")) == ["2"]
+
+
+def test_star_matches_everything_and_top_limits():
+    index = LocalHotelIndex(HOTELS)
+
+    assert len(index.search("*")) == 3
+    assert len(index.search("*", top=2)) == 2
+
+
+def test_select_projects_fields_like_azure():
+    index = LocalHotelIndex(HOTELS)
+
+    [result] = index.search("fireplace", select=["HotelName", "Rooms/BaseRate"])
+
+    assert result["HotelName"] == "Mountain Lodge"
+    assert result["Rooms"] == [{"BaseRate": 300}]
+    assert "Description" not in result
+    assert result["@search.score"] > 0
+
+
+def test_empty_documents_dont_divide_by_zero():
+    index = LocalHotelIndex([{}, {}])
+
+    assert index.search("pool") == []
+    assert len(index.search("*")) == 2
+
+
+def test_odata_filters():
+    index = LocalHotelIndex(HOTELS)
+
+    assert ids(index.search("*", filter="Rating ge 4 and Rating le 4")) == ["3"]
+    assert ids(index.search("*", filter="Rooms ne null")) == ["3"]
+    assert ids(index.search("pool", filter="Rating gt 4.2")) == ["1"]
+    assert sorted(
+        ids(index.search("*", filter="Rating lt 4 or Address/City eq 'Miami'"))
+    ) == ["1", "2"]
+    assert ids(index.search("*", filter="Address/City eq 'O''Fallon'")) == ["3"]
+
+
+def test_callable_filters_still_work():
+    index = LocalHotelIndex(HOTELS)
+
+    assert ids(index.search("pool", filter=lambda d: d["HotelId"] == "3")) == ["3"]
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "Rating ge",
+        "Rating ge 4 and",
+        "(Rating ge 4)",
+        "Rating foo 4",
+        "Tags/any(t: t eq 'pool')",
+        "search.in(HotelId, '1,2')",
+    ],
+)
+def test_unsupported_filters_are_rejected(expression):
+    with pytest.raises(ValueError):
+        compile_filter(expression)
@@ -0,0 +1,142 @@
+import numpy as np
+
+from shared import response_cache
+from shared.response_cache import HashingEmbedder, ResponseCache
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FixedEmbedder:
+    # Embeddings picked by hand, so we know exactly how close each text is.
+    def __init__(self, vectors):
+        self.vectors = {text: np.asarray(v, np.float32) for text, v in vectors.items()}
+
+    def __call__(self, text):
+        return self.vectors[text]
+
+
+def ask(question):
+    return [
+        {"role": "system", "content": "Be brief."},
+        {"role": "user", "content": question},
+    ]
+
+
+def cache_answer(cache, messages, answer, model="gpt4"):
+    lookup = cache.lookup(model, messages)
+    cache.put(lookup, {"answer": answer})
+    return lookup
+
+
+def test_exact_hit():
+    cache = ResponseCache(HashingEmbedder())
+    cache_answer(cache, ask("what is the best hotel with a pool"), "the Grand")
+
+    lookup = cache.lookup("gpt4", ask("what is the best hotel with a pool"))
+
+    assert lookup.level == "exact"
+    assert lookup.response == {"answer": "the Grand"}
+    assert cache.stats["exact"] == 1
+
+
+def test_semantic_hit_above_the_threshold():
+    cache = ResponseCache(HashingEmbedder(), threshold=0.8)
+    cache_answer(cache, ask("what is the best hotel with a pool"), "the Grand")
+
+    lookup = cache.lookup("gpt4", ask("What is the best hotel with a pool?"))
+
+    assert lookup.level == "semantic"
+    assert lookup.response == {"answer": "the Grand"}
+    assert lookup.similarity >= 0.8
+
+
+def test_miss_below_the_threshold():
+    cache = ResponseCache(HashingEmbedder(), threshold=0.95)
+    cache_answer(cache, ask("what is the best hotel with a pool"), "the Grand")
+
+    lookup = cache.lookup("gpt4", ask("which hero has the best win rate"))
+
+    assert lookup.level == "miss"
+    assert lookup.response is None
+    # The first was the lookup before caching it.
+    assert cache.stats["miss"] == 2
+
+
+def test_other_models_dont_share_semantic_hits():
+    cache = ResponseCache(HashingEmbedder(), threshold=0.8)
+    cache_answer(cache, ask("what is the best hotel with a pool"), "the Grand")
+
+    lookup = cache.lookup("gpt35", ask("What is the best hotel with a pool?"))
+
+    assert lookup.level == "miss"
+
+
+def test_entries_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    cache = ResponseCache(HashingEmbedder(), ttl_seconds=60)
+    cache_answer(cache, ask("what is the best hotel with a pool"), "the Grand")
+
+    clock.now += 61
+
+    lookup = cache.lookup("gpt4", ask("what is the best hotel with a pool"))
+
+    assert lookup.level == "miss"
+
+
+def test_expired_best_match_doesnt_hide_a_fresh_one(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    embedder = FixedEmbedder(
+        {
+            "old question": [1.0, 0.0],
+            "new question": [0.98, 0.2],
+            "asked now": [1.0, 0.0],
+        }
+    )
+    cache = ResponseCache(embedder, threshold=0.9, ttl_seconds=60)
+    cache_answer(cache, ask("old question"), "old answer")
+    clock.now += 30
+    cache_answer(cache, ask("new question"), "new answer")
+    clock.now += 40
+
+    lookup = cache.lookup("gpt4", ask("asked now"))
+
+    assert lookup.level == "semantic"
+    assert lookup.response == {"answer": "new answer"}
+
+
+def test_least_recently_used_is_evicted_first():
+    cache = ResponseCache(HashingEmbedder(), max_entries=2)
+    cache_answer(cache, ask("first"), "1")
+    cache_answer(cache, ask("second"), "2")
+
+    # Using the first makes the second the oldest.
+    assert cache.lookup("gpt4", ask("first")).level == "exact"
+    cache_answer(cache, ask("third"), "3")
+
+    assert cache.lookup("gpt4", ask("first")).level == "exact"
+    assert cache.lookup("gpt4", ask("third")).level == "exact"
+    assert cache.lookup("gpt4", ask("second")).level == "miss"
+
+
+def test_follow_ups_only_get_exact_hits():
+    cache = ResponseCache(HashingEmbedder(), threshold=0.5)
+    conversation = ask("what is the best hotel with a pool") + [
+        {"role": "assistant", "content": "the Grand"},
+        {"role": "user", "content": "is it cheap"},
+    ]
+    cache_answer(cache, conversation, "no")
+
+    follow_up = cache.lookup(
+        "gpt4", conversation[:-1] + [{"role": "user", "content": "is it cheap?"}]
+    )
+    assert follow_up.text is None
+    assert follow_up.level == "miss"
+    assert cache.lookup("gpt4", conversation).level == "exact"
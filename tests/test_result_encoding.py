@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from my_openai.result_encoding import ToolResultEncoder, compact, truncate_to_tokens
+from shared.history import count_tokens
+
+HEROES = [
+    {"name": f"Hero {n}", "role": "Healer", "winRate": 0.5 + n / 3000}
+    for n in range(200)
+]
+
+
+def test_floats_are_rounded():
+    assert compact({"winRate": 0.123456789}) == {"winRate": 0.1235}
+    assert compact([1.0 / 3], digits=2) == [0.33]
+
+
+def test_lists_of_same_shaped_objects_become_tables():
+    rooms = [{"type": "Suite", "rate": 300}, {"type": "King", "rate": 200}]
+
+    value = compact({"hotel": "Inn", "rooms": rooms})
+
+    assert value == {
+        "hotel": "Inn",
+        "rooms": {"columns": ["type", "rate"], "rows": [["Suite", 300], ["King", 200]]},
+    }
+
+
+def test_lists_of_differently_shaped_objects_are_left_alone():
+    value = [{"a": 1}, {"b": 2}]
+
+    assert compact(value) == value
+
+
+def test_results_under_the_cap_are_sent_whole():
+    content, truncated = truncate_to_tokens({"name": "Li Li"}, 100)
+
+    assert json.loads(content) == {"name": "Li Li"}
+    assert not truncated
+
+
+def test_tables_lose_rows_from_the_end():
+    table = compact(HEROES)
+
+    content, truncated = truncate_to_tokens(table, 300)
+    sent = json.loads(content)
+
+    assert truncated
+    assert count_tokens(content) <= 300
+    assert 0 < len(sent["rows"]) < len(HEROES)
+    assert sent["rows"] == table["rows"][: len(sent["rows"])]
+    assert sent["truncated"].endswith(f"of {len(HEROES)} rows left out")
+
+
+@pytest.mark.parametrize("max_tokens", [5, 12, 50, 300])
+def test_anything_else_is_cut_to_fit_the_cap(max_tokens):
+    text = {"description": "a very long description " * 200}
+
+    content, truncated = truncate_to_tokens(text, max_tokens)
+
+    assert truncated
+    assert count_tokens(content) <= max_tokens
+    assert "truncated" in content
+
+
+def test_a_table_too_wide_for_any_rows_is_cut_as_text():
+    table = compact([{"description": "word " * 100}] * 3)
+
+    content, truncated = truncate_to_tokens(table, 20)
+
+    assert truncated
+    assert count_tokens(content) <= 20
+
+
+def test_savings_and_truncation_are_counted_apart():
+    encoder = ToolResultEncoder({"get_hero_stats": 300})
+
+    content, detail, stats = encoder.encode("get_hero_stats", HEROES)
+
+    assert detail == compact(HEROES)
+    assert stats["truncated"]
+    assert stats["tokens"] == count_tokens(content) <= 300
+    assert stats["savedTokens"] > 0
+    assert stats["truncatedTokens"] > 0
+    assert (
+        stats["rawTokens"] - stats["savedTokens"] - stats["truncatedTokens"]
+        == stats["tokens"]
+    )
+    assert (
+        stats["rawBytes"] - stats["savedBytes"] - stats["truncatedBytes"]
+        == stats["bytes"]
+    )
+
+
+def test_nothing_counts_as_truncated_under_the_cap():
+    encoder = ToolResultEncoder(default_max_tokens=100_000)
+
+    _, _, stats = encoder.encode("get_hero_stats", HEROES)
+
+    assert not stats["truncated"]
+    assert stats["truncatedTokens"] == 0
+    assert stats["rawTokens"] - stats["savedTokens"] == stats["tokens"]
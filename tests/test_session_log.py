@@ -0,0 +1,108 @@
+import pytest
+
+from shared.session_log import (
+    MESSAGE_RECORD,
+    PersistentMessageStore,
+    SessionRegistry,
+    _encode,
+)
+
+SESSION_ID = "0123456789abcdef0123456789abcdef"
+
+
+def write_conversation(store, turns):
+    for n in range(turns):
+        store.append("user", f"question {n}")
+        store.append("assistant", f"answer {n}\nwith a newline", completion_id=f"c{n}")
+
+
+def decoded(store):
+    return [not isinstance(item, tuple) for item in store.messages.items]
+
+
+def test_messages_survive_reopening(tmp_path):
+    path = str(tmp_path / "session.log")
+    write_conversation(PersistentMessageStore(path), 2)
+
+    store = PersistentMessageStore(path)
+
+    assert [(m.role, m.content) for m in store] == [
+        ("user", "question 0"),
+        ("assistant", "answer 0\nwith a newline"),
+        ("user", "question 1"),
+        ("assistant", "answer 1\nwith a newline"),
+    ]
+    assert store[1].completion_id == "c0"
+
+
+def test_paging_and_lookups_only_decode_what_they_use(tmp_path):
+    path = str(tmp_path / "session.log")
+    write_conversation(PersistentMessageStore(path), 3)
+    store = PersistentMessageStore(path)
+
+    assert store.turn_starts() == [0, 2, 4]
+    assert not any(decoded(store))
+
+    assert store.find("c1").content == "answer 1\nwith a newline"
+    assert decoded(store) == [False, False, False, True, False, False]
+    assert store.find("missing") is None
+
+
+def test_feedback_is_kept_for_messages_not_decoded_yet(tmp_path):
+    path = str(tmp_path / "session.log")
+    store = PersistentMessageStore(path)
+    write_conversation(store, 2)
+    store.set_feedback("c0", {"score": "👍"})
+
+    reopened = PersistentMessageStore(path)
+
+    assert reopened[3].feedback is None
+    assert reopened[1].feedback == {"score": "👍"}
+
+
+def test_other_writers_are_picked_up(tmp_path):
+    path = str(tmp_path / "session.log")
+    reader = PersistentMessageStore(path)
+    write_conversation(reader, 1)
+    writer = PersistentMessageStore(path)
+
+    writer.append("user", "from another process")
+    reader.refresh()
+
+    assert reader[-1].content == "from another process"
+    assert reader.turn_starts() == [0, 2]
+
+
+def test_older_message_records_still_load(tmp_path):
+    path = tmp_path / "session.log"
+    path.write_bytes(
+        _encode(MESSAGE_RECORD, {"role": "user", "content": "old"})
+        + _encode(MESSAGE_RECORD, {"role": "assistant", "completion_id": "c0"})
+    )
+
+    store = PersistentMessageStore(str(path))
+
+    assert store.turn_starts() == [0]
+    assert store.find("c0") is store[1]
+    assert store[0].content == "old"
+
+
+def test_registry_closes_the_least_recently_used(tmp_path):
+    registry = SessionRegistry(str(tmp_path), max_sessions=1)
+    first = registry.get(SESSION_ID)
+    write_conversation(first, 1)
+    held = first.messages
+
+    registry.get("f" * 32)
+
+    assert not first.is_open
+    assert registry.get_stats() == {"opened": 2, "evicted": 1, "open": 1}
+    # Whoever still has the old list reads from the file.
+    assert held[0].content == "question 0"
+    # And the store reopens when it's used again.
+    assert registry.get(SESSION_ID)[1].completion_id == "c0"
+
+
+def test_registry_rejects_bad_session_ids(tmp_path):
+    with pytest.raises(ValueError):
+        SessionRegistry(str(tmp_path)).get("../../etc/passwd")
@@ -0,0 +1,153 @@
+import time
+
+from settings import parse_stream_completions
+from shared import streaming
+from shared.streaming import ThrottledTextWriter, as_completion, collect_stream
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def perf_counter(self):
+        return self.now
+
+
+def chunk(finish_reason=None, **delta):
+    return {
+        "id": "chatcmpl-1",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def tool_fragment(index, id=None, name=None, arguments=None):
+    function = {}
+
+    if name is not None:
+        function["name"] = name
+
+    if arguments is not None:
+        function["arguments"] = arguments
+
+    return {"index": index, "id": id, "function": function}
+
+
+def test_streaming_is_off_unless_asked_for():
+    assert not parse_stream_completions(None)
+    assert not parse_stream_completions("")
+    assert not parse_stream_completions("false")
+    assert parse_stream_completions("True")
+
+
+def test_content_deltas_are_joined_and_handed_on():
+    deltas = []
+    chunks = [
+        {"prompt_filter_results": [{"content_filter_results": {"hate": "safe"}}]},
+        chunk(role="assistant"),
+        chunk(content="Li Li "),
+        chunk(content="is the best "),
+        chunk(content="healer."),
+        chunk(finish_reason="stop"),
+    ]
+
+    result = collect_stream(chunks, time.perf_counter(), on_content=deltas.append)
+
+    assert deltas == ["Li Li ", "is the best ", "healer."]
+    assert result["content"] == "Li Li is the best healer."
+    assert result["finish_reason"] == "stop"
+    assert result["prompt_filter_results"] == {"hate": "safe"}
+    assert result["content_chunks"] == 3
+    assert result["tool_calls"] is None
+    assert result["time_to_first_token"] is not None
+
+
+def test_tool_calls_are_assembled_and_handed_on_when_complete():
+    read = []
+    finished = []
+
+    def stream():
+        for n, fragment in enumerate(
+            [
+                tool_fragment(0, "call_1", "get_hero_stats", '{"start'),
+                tool_fragment(0, arguments='_date": "2024-01-01"}'),
+                tool_fragment(1, "call_2", "get_hotels", ""),
+                tool_fragment(1, arguments="{}"),
+            ]
+        ):
+            read.append(n)
+            yield chunk(tool_calls=[fragment])
+
+        yield chunk(finish_reason="tool_calls")
+
+    def on_tool_call(tool_call):
+        finished.append((tool_call["id"], len(read)))
+
+    result = collect_stream(stream(), time.perf_counter(), on_tool_call=on_tool_call)
+
+    # The first call was handed on as soon as the second one started.
+    assert finished == [("call_1", 3), ("call_2", 4)]
+    assert result["finish_reason"] == "tool_calls"
+    assert result["content"] is None
+    assert result["tool_calls"] == [
+        {
+            "id": "call_1",
+            "type": "function",
+            "function": {
+                "name": "get_hero_stats",
+                "arguments": '{"start_date": "2024-01-01"}',
+            },
+        },
+        {
+            "id": "call_2",
+            "type": "function",
+            "function": {"name": "get_hotels", "arguments": "{}"},
+        },
+    ]
+
+
+def test_the_writer_redraws_at_most_every_interval_and_flushes_at_the_end(
+    monkeypatch,
+):
+    clock = Clock()
+    monkeypatch.setattr(streaming, "time", clock)
+    writes = []
+    writer = ThrottledTextWriter(writes.append, interval=1)
+
+    for delta in ["a", "b", "c"]:
+        writer(delta)
+        clock.now += 0.4
+
+    assert writes == ["a"]
+
+    writer("d")
+
+    assert writes == ["a", "abcd"]
+
+    writer("e")
+    writer.flush()
+    writer.flush()
+
+    assert writes == ["a", "abcd", "abcde"]
+
+
+def test_the_writer_is_flushed_when_the_stream_ends():
+    writes = []
+    writer = ThrottledTextWriter(writes.append, interval=60)
+    writer.last_write = time.perf_counter()
+
+    collect_stream([chunk(content="a"), chunk(content="b")], 0, on_content=writer)
+
+    assert writes == ["ab"]
+
+
+def test_streamed_results_look_like_completions():
+    result = collect_stream(
+        [chunk(role="assistant", content="Hi"), chunk(finish_reason="stop")],
+        time.perf_counter(),
+    )
+
+    completion = as_completion(result)
+
+    assert completion.choices[0].message.content == "Hi"
+    assert completion.choices[0].finish_reason == "stop"
+    assert completion.usage.completion_tokens == 1
@@ -0,0 +1,53 @@
+import threading
+
+from shared.telemetry import MemorySink, TelemetryExporter
+
+
+class BlockingSink(MemorySink):
+    # Holds up the worker inside export() until released.
+    def __init__(self):
+        super().__init__()
+        self.exporting = threading.Event()
+        self.release = threading.Event()
+
+    def export(self, records):
+        self.exporting.set()
+        self.release.wait(5)
+        super().export(records)
+
+
+class BrokenSink:
+    def export(self, records):
+        raise ConnectionError("sink is down")
+
+
+def test_records_are_dropped_and_counted_when_the_queue_is_full():
+    sink = BlockingSink()
+    exporter = TelemetryExporter(sink, max_queue=2, batch_size=1, flush_interval=0)
+
+    exporter.emit("first", {})
+    assert sink.exporting.wait(5)
+
+    # The worker is stuck on the first, two fit in the queue.
+    for n in range(5):
+        exporter.emit(f"record {n}", {"n": n})
+
+    stats = exporter.get_stats()
+    assert stats["enqueued"] == 3
+    assert stats["dropped"] == 3
+    assert stats["queued"] == 2
+
+    sink.release.set()
+    assert exporter.flush(timeout=5)
+    assert [r["message"] for r in sink.records] == ["first", "record 0", "record 1"]
+    assert exporter.get_stats()["exported"] == 3
+
+
+def test_export_errors_are_counted_not_raised():
+    exporter = TelemetryExporter(BrokenSink(), batch_size=1, flush_interval=0)
+
+    exporter.emit("lost", {})
+
+    assert exporter.flush(timeout=5)
+    assert exporter.get_stats()["exportErrors"] == 1
+    assert exporter.get_stats()["exported"] == 0
@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+
+import pytest
+
+from my_openai.tool_executor import ToolExecutor, as_plain_tool_call
+from shared.deadlines import deadline, get_timeout_stats
+
+
+def tool_call(name, arguments):
+    return {"id": f"call_{name}", "function": {"name": name, "arguments": arguments}}
+
+
+@pytest.fixture
+def unstuck():
+    # Set at the end of the test, so calls that were left "stuck" finish.
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def test_results_come_back_in_order_and_as_json():
+    executor = ToolExecutor({"add": lambda a, b: a + b, "hello": lambda: "hi"})
+
+    results = executor.run(
+        [tool_call("add", json.dumps({"a": 1, "b": 2})), tool_call("hello", "")]
+    )
+
+    assert [r["tool_call_id"] for r in results] == ["call_add", "call_hello"]
+    assert [json.loads(r["content"]) for r in results] == [3, "hi"]
+    assert [r["error"] for r in results] == [None, None]
+
+
+def test_a_slow_call_times_out_without_holding_up_the_rest(unstuck):
+    executor = ToolExecutor(
+        {"executor_slow": lambda: unstuck.wait(5), "quick": lambda: "done"},
+        timeouts={"executor_slow": 0.1},
+    )
+    started = time.monotonic()
+
+    slow, quick = executor.run(
+        [tool_call("executor_slow", "{}"), tool_call("quick", "{}")]
+    )
+
+    assert time.monotonic() - started < 1
+    assert slow["error"] == "executor_slow timed out."
+    assert json.loads(slow["content"]) == {"error": "executor_slow timed out."}
+    assert quick["error"] is None
+    assert get_timeout_stats()["executor_slow"]["timeouts"] == 1
+
+
+def test_timeouts_are_cut_to_the_turn_deadline():
+    executor = ToolExecutor({}, timeouts={"search": 30})
+
+    with deadline(2):
+        assert executor.get_timeout("search") <= 2
+
+    assert executor.get_timeout("search") == 30
+    assert executor.get_timeout("other") == 30
+
+
+def test_unknown_functions_are_reported_to_the_llm():
+    executor = ToolExecutor({})
+
+    [result] = executor.run([tool_call("missing", "{}")])
+
+    assert result["error"] == "missing failed: Unknown function missing."
+
+
+def test_bad_arguments_are_reported_to_the_llm():
+    executor = ToolExecutor({"add": lambda a, b: a + b})
+
+    [bad_json, missing_argument] = executor.run(
+        [tool_call("add", "{'a': 1"), tool_call("add", json.dumps({"a": 1}))]
+    )
+
+    assert bad_json["error"].startswith("add failed:")
+    assert missing_argument["error"].startswith("add failed:")
+
+
+def test_calls_wait_for_the_futures_they_come_after():
+    order = []
+    executor = ToolExecutor(
+        {
+            "first": lambda: time.sleep(0.05) or order.append("first"),
+            "second": lambda: order.append("second"),
+        }
+    )
+    first = executor.submit(tool_call("first", "{}"))
+
+    second = executor.submit(tool_call("second", "{}"), after=[first.future])
+    executor.collect([second, first])
+
+    assert order == ["first", "second"]
+
+
+def test_a_failed_future_doesnt_fail_the_call_after_it():
+    def fail():
+        raise RuntimeError("boom")
+
+    executor = ToolExecutor({"fail": fail, "hello": lambda: "hi"})
+    failed = executor.submit(tool_call("fail", "{}"))
+
+    [result] = executor.collect(
+        [executor.submit(tool_call("hello", "{}"), after=[failed.future])]
+    )
+
+    assert result["error"] is None
+
+
+def test_results_go_through_the_encoder():
+    def encode(name, value):
+        return f"{name}={value}", {"value": value}, {"bytes": 1}
+
+    executor = ToolExecutor({"hello": lambda: "hi"}, encode=encode)
+
+    [result] = executor.run([tool_call("hello", "{}")])
+
+    assert result["content"] == "hello=hi"
+    assert result["detail"] == {"value": "hi"}
+    assert result["encoding"] == {"bytes": 1}
+
+
+def test_tool_calls_are_kept_as_plain_dicts():
+    call = tool_call("hello", "{}")
+
+    assert as_plain_tool_call(call) == {
+        "id": "call_hello",
+        "type": "function",
+        "function": {"name": "hello", "arguments": "{}"},
+    }
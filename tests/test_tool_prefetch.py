@@ -0,0 +1,136 @@
+import json
+import threading
+from datetime import date
+
+from my_openai.tool_executor import ToolExecutor
+from my_openai.tool_prefetch import ToolPrefetcher, guess, hotel_key, parse_date_range
+
+
+def tool_call(name, **arguments):
+    return {
+        "id": f"call_{name}",
+        "function": {"name": name, "arguments": json.dumps(arguments)},
+    }
+
+
+def test_explicit_dates_are_parsed():
+    assert parse_date_range("from 2024-01-07 back to 2024-01-01") == (
+        date(2024, 1, 1),
+        date(2024, 1, 7),
+    )
+
+
+def test_no_dates_or_too_many_days_arent_guessed():
+    assert parse_date_range("over the last week") is None
+    assert parse_date_range("2024-02-30") is None
+    assert parse_date_range("from 2024-01-01 to 2024-03-01") is None
+
+
+def test_hero_questions_with_dates_are_guessed():
+    assert guess("Best healers from 2024-01-01 to 2024-01-07?") == [
+        ("heroes", (date(2024, 1, 1), date(2024, 1, 7)))
+    ]
+
+
+def test_hero_questions_without_dates_are_not():
+    assert guess("Who has the best win rate this week?") == []
+
+
+def test_only_the_hotel_part_of_a_question_is_searched():
+    guesses = guess("What's 2 + 2? Find me hotels with a pool in Seattle.")
+
+    assert guesses == [("hotels", "hotel pool seattle")]
+
+
+def test_hotel_keys_ignore_stop_words_plurals_and_order():
+    assert hotel_key("a hotel with pools in Seattle", None) == hotel_key(
+        "seattle hotels pool", "3"
+    )
+    assert hotel_key("hotel", "two") == hotel_key("hotel", 3)
+
+
+class Tools:
+    def __init__(self):
+        self.calls = []
+        self.fetched = threading.Event()
+        self._lock = threading.Lock()
+
+    def record(self, *call):
+        with self._lock:
+            self.calls.append(call)
+
+    def fetch_hero_range(self, start_date, end_date):
+        self.record("fetch", start_date, end_date)
+        self.fetched.set()
+
+    def search_hotels(self, query, count):
+        self.record("search", query, count)
+        return [f"hotel for {query}"]
+
+    def get_heroes_winrate_stats(self, start_date, end_date, **kwargs):
+        # Must only run once the prefetch has warmed the cache.
+        assert self.fetched.is_set()
+        self.record("stats", start_date, end_date)
+        return [{"name": "Li Li"}]
+
+    def get_hotel_information(self, query, count=3):
+        self.record("tool search", query, count)
+        return [f"hotel for {query}"]
+
+
+def make_prefetcher(tools):
+    executor = ToolExecutor(
+        {
+            "get_heroes_winrate_stats": tools.get_heroes_winrate_stats,
+            "get_hotel_information": tools.get_hotel_information,
+        }
+    )
+    return executor, ToolPrefetcher(
+        executor, tools.fetch_hero_range, tools.search_hotels
+    )
+
+
+def test_guesses_the_llm_asks_for_are_hits():
+    tools = Tools()
+    executor, prefetcher = make_prefetcher(tools)
+    speculation = prefetcher.start(
+        "Best healers from 2024-01-01 to 2024-01-07, and hotels with pools?"
+    )
+
+    results = executor.collect(
+        [
+            speculation.submit(
+                tool_call(
+                    "get_heroes_winrate_stats",
+                    start_date="2024-01-02",
+                    end_date="2024-01-03",
+                )
+            ),
+            speculation.submit(tool_call("get_hotel_information", query="pool hotel")),
+        ]
+    )
+
+    assert [r["error"] for r in results] == [None, None]
+    # The hotel search wasn't run again, the stats call read the warm cache.
+    assert sorted(call[0] for call in tools.calls) == ["fetch", "search", "stats"]
+    assert speculation.finish() == {
+        "speculated": 2,
+        "speculationHits": 2,
+        "speculationWasted": 0,
+    }
+    assert prefetcher.get_stats()["hitRate"] == 1.0
+
+
+def test_guesses_nobody_asks_for_are_wasted():
+    tools = Tools()
+    executor, prefetcher = make_prefetcher(tools)
+    speculation = prefetcher.start("Any hotels near the beach?")
+
+    executor.collect(
+        [speculation.submit(tool_call("get_hotel_information", query="ski lodge"))]
+    )
+
+    assert speculation.finish()["speculationWasted"] == 1
+    stats = prefetcher.get_stats()
+    assert stats["missed"] == 1
+    assert stats["wasteRate"] == 1.0